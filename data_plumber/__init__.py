@@ -1,17 +1,45 @@
 from .array import Pipearray
-from .error import PipelineError
+from .capture import Capture
+from .error import PipelineError, BudgetExceededError
 from .fork import Fork
-from .pipeline import Pipeline
+from .handle import PipelineHandle
+from .history import RunHistory
+from .hooks import Hooks
+from .lazy import Lazy
+from .memory import MemoryProfile
+from .metrics import MetricsRegistry
+from .output import Projection
+from .pipeline import Pipeline, FrozenPipeline
+from .profile import PipelineProfile
+from .registry import PipelineRegistry
 from .ref import PreviousN, Previous, First, NextN, Next, Skip, Last, \
     StageById, StageByIndex, StageByIncrement
+from .resource import Resource
+from .sink import JSONLSink, CSVSink, SQLiteSink
+from .source import JSONLSource, CSVSource
 from .stage import Stage
 
 __all__ = [
     "Pipearray",
+    "Capture",
     "PipelineError",
+    "BudgetExceededError",
     "Fork",
+    "PipelineHandle",
+    "RunHistory",
+    "Hooks",
+    "Lazy",
+    "MemoryProfile",
+    "MetricsRegistry",
     "Pipeline",
+    "FrozenPipeline",
+    "PipelineProfile",
+    "PipelineRegistry",
+    "Projection",
     "PreviousN", "Previous", "First", "NextN", "Next", "Skip", "Last", \
         "StageById", "StageByIndex", "StageByIncrement",
+    "Resource",
+    "JSONLSink", "CSVSink", "SQLiteSink",
+    "JSONLSource", "CSVSource",
     "Stage",
 ]
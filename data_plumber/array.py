@@ -5,8 +5,35 @@ This module defines the `Pipearray`-class, a means to issue `Pipeline`-
 executions on identical input data with a single command.
 """
 
+from typing import Optional, Callable, Any, Iterator, AsyncIterator, \
+    Iterable, Mapping
+import asyncio
+from concurrent.futures import Executor, ProcessPoolExecutor, as_completed
+from contextlib import closing
+from functools import partial
+from threading import Event
+from time import monotonic
+
+from .batch import pack, run_chunk, map_chunks
+from .capture import Capture
+from .error import BudgetExceededError
 from .pipeline import Pipeline
-from .output import PipelineOutput
+from .output import PipelineOutput, Projection
+
+
+class _AnyEvent:
+    """Cancellation token that is set if any of its tokens is set."""
+    def __init__(self, *events: Any) -> None:
+        self._events = [e for e in events if e is not None]
+
+    def is_set(self) -> bool:
+        return any(e.is_set() for e in self._events)
+
+
+def _matches(status: Optional[int], value: int | Callable[[int], bool]):
+    if callable(value):
+        return value(status)
+    return status == value
 
 
 class Pipearray:
@@ -22,6 +49,24 @@ class Pipearray:
     been omitted), whereas in the opposite case a list of
     `PipelineOutput`s is returned.
 
+    If `share_stages` is enabled, the results of `Stage`s that are
+    shared between `Pipeline`s are re-used: as long as `Pipeline`s
+    execute an identical sequence of `Stage`-objects (with identical
+    names and positions) from their start (up to the first `Fork`),
+    these `Stage`s are executed only once per `Pipearray.run` and their
+    `StageRecord`s and exported kwargs are re-used by the other
+    `Pipeline`s. Note that this requires the shared `Stage`s to not
+    depend on or modify the persistent data-object `out` (their effect
+    on `out` is only visible in the `Pipeline` that actually executed
+    them). Sharing also ends at `Stage`s with requirements that refer
+    to the arrangement of the `Pipeline` (like `Last` or `NextN`), and
+    `Pipeline`s with `Resource`s or constants (see
+    `Pipeline.specialize`) do not take part. With a
+    `ProcessPoolExecutor`, `Stage`s are not shared.
+
+    If an `executor` is given, the `Pipeline`s are submitted to that
+    `concurrent.futures.Executor` and run concurrently.
+
     Example usage:
      >>> from data_plumber import Pipearray, Pipeline
      >>> Pipearray(
@@ -34,12 +79,31 @@ class Pipearray:
              validation_aspect_2=Pipeline(...)
          ).run(...)
      <dict[str, PipelineOutput]>
+
+    Keyword arguments:
+    args -- anonymous `Pipeline`s
+    kwargs -- labeled `Pipeline`s
+    share_stages -- re-use results of shared `Stage`-prefixes between
+                    `Pipeline`s
+                    (default `False`)
+    executor -- `concurrent.futures.Executor` used to run `Pipeline`s
+                concurrently
+                (default `None`; sequential execution)
+    capture -- `Capture` that records (a sample of) the kwargs and
+               outputs of `Pipearray.run`s for `replay`
+               (default `None`)
     """
     def __init__(
         self,
         *args: Pipeline,
+        share_stages: bool = False,
+        executor: Optional[Executor] = None,
+        capture: Optional[Capture] = None,
         **kwargs: Pipeline
     ) -> None:
+        self._share_stages = share_stages
+        self._executor = executor
+        self._capture = capture
         if kwargs:  # labeled Pipearray
             self._pipelines: dict[str, Pipeline] | list[Pipeline] = {}
             self._pipelines.update(kwargs)
@@ -48,18 +112,400 @@ class Pipearray:
             self._pipelines = []
             self._pipelines.extend(args)
 
+    def _items(self) -> list[tuple[str | int, Pipeline]]:
+        if isinstance(self._pipelines, dict):
+            return list(self._pipelines.items())
+        return list(enumerate(self._pipelines))
+
+    def _cancel_token(self, cancel: Optional[Any]) -> tuple[Any, Any]:
+        """
+        Returns pair of internal `Event` (used to interrupt running
+        `Pipeline`s) and combined cancellation token.
+        """
+        # cancellation tokens cannot be passed into other processes
+        if isinstance(self._executor, ProcessPoolExecutor):
+            return None, cancel
+        abort = Event()
+        return abort, _AnyEvent(abort, cancel)
+
+    def _shared_cache(self) -> Optional[dict]:
+        """
+        Returns new cache for shared `Stage`-results (`None` if sharing
+        is disabled).
+        """
+        # a cache would be copied into every process (i.e. not shared)
+        if not self._share_stages \
+                or isinstance(self._executor, ProcessPoolExecutor):
+            return None
+        return {}
+
+    def _iterate(
+        self,
+        kwargs: dict[str, Any],
+        max_stages: Optional[int] = None,
+        deadline: Optional[float] = None,
+        cancel: Optional[Any] = None,
+        max_steps: Optional[int] = None,
+    ) -> Iterator[tuple[str | int, PipelineOutput]]:
+        """
+        Generator for pairs of label (index for anonymous `Pipearray`s)
+        and `PipelineOutput` in order of completion. When closed early,
+        pending `Pipeline`s are cancelled.
+        """
+        shared = self._shared_cache()
+
+        if self._executor is None:
+            for label, p in self._items():
+                yield label, p._run(
+                    kwargs.copy(), None, max_stages, deadline, cancel, shared,
+                    max_steps=max_steps
+                )
+            return
+
+        abort, token = self._cancel_token(cancel)
+        futures = {
+            self._executor.submit(
+                p._run, kwargs.copy(), None, max_stages, deadline, token,
+                shared, max_steps=max_steps
+            ): label
+            for label, p in self._items()
+        }
+        try:
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+            if abort is not None:
+                abort.set()
+
     def run(
         self,
+        max_stages: Optional[int] = None,
+        deadline: Optional[float] = None,
+        cancel: Optional[Any] = None,
+        max_steps: Optional[int] = None,
         **kwargs
     ) -> list[PipelineOutput] | dict[str, PipelineOutput]:
         """
         Trigger `Pipearray` execution.
 
         Keyword arguments:
+        max_stages -- maximum number of `Stage`s to be executed per
+                      `Pipeline` (see `Pipeline.run`)
+                      (default `None`; unlimited)
+        deadline -- absolute point in time (as given by
+                    `time.monotonic`) shared by all `Pipeline`s (see
+                    `Pipeline.run`)
+                    (default `None`; no deadline)
+        cancel -- cancellation token shared by all `Pipeline`s (see
+                  `Pipeline.run`)
+                  (default `None`)
+        max_steps -- maximum number of `_PipelineComponent`s to be
+                     evaluated per `Pipeline` (see `Pipeline.run`)
+                     (default `None`; unlimited)
         kwargs -- keyword arguments that are passed into `Pipeline`s as
                   keyword arguments
         """
 
+        captured = None
+        if self._capture is not None and self._capture.sample():
+            captured = kwargs.copy()
+        results = dict(
+            self._iterate(kwargs, max_stages, deadline, cancel, max_steps)
+        )
         if isinstance(self._pipelines, dict):
-            return {k: p.run(**kwargs) for k, p in self._pipelines.items()}
-        return [p.run(**kwargs) for p in self._pipelines]
+            outputs: list[PipelineOutput] | dict[str, PipelineOutput] = {
+                k: results[k] for k in self._pipelines
+            }
+        else:
+            outputs = [results[i] for i in range(len(self._pipelines))]
+        if captured is not None:
+            self._capture.record(captured, outputs)
+        return outputs
+
+    def run_iter(
+        self,
+        max_stages: Optional[int] = None,
+        deadline: Optional[float] = None,
+        cancel: Optional[Any] = None,
+        max_steps: Optional[int] = None,
+        **kwargs
+    ) -> Iterator[tuple[str | int, PipelineOutput]]:
+        """
+        Returns a generator for pairs of label (index for anonymous
+        `Pipearray`s) and `PipelineOutput` in order of completion of the
+        individual `Pipeline`s (this corresponds to the order of
+        `Pipeline`s if the `Pipearray` has no `executor`). Closing the
+        generator early cancels pending `Pipeline`s.
+
+        Keyword arguments:
+        max_stages, deadline, cancel, max_steps -- see `Pipearray.run`
+        kwargs -- keyword arguments that are passed into `Pipeline`s as
+                  keyword arguments
+        """
+        return self._iterate(kwargs, max_stages, deadline, cancel, max_steps)
+
+    async def run_iter_async(
+        self,
+        max_stages: Optional[int] = None,
+        deadline: Optional[float] = None,
+        cancel: Optional[Any] = None,
+        max_steps: Optional[int] = None,
+        **kwargs
+    ) -> AsyncIterator[tuple[str | int, PipelineOutput]]:
+        """
+        Asynchronous generator for pairs of label (index for anonymous
+        `Pipearray`s) and `PipelineOutput` in order of completion of the
+        individual `Pipeline`s. `Pipeline`s are run in the `Pipearray`'s
+        `executor` (or the event loop's default executor). Closing the
+        generator early cancels pending `Pipeline`s.
+
+        In addition to the behavior described in `Pipeline.run`, the
+        `deadline` also interrupts waiting for currently running
+        `Stage`s: a `BudgetExceededError` (without partial output) is
+        raised as soon as the deadline passes.
+
+        Keyword arguments:
+        max_stages, deadline, cancel, max_steps -- see `Pipearray.run`
+        kwargs -- keyword arguments that are passed into `Pipeline`s as
+                  keyword arguments
+        """
+        loop = asyncio.get_running_loop()
+        shared = self._shared_cache()
+        abort, token = self._cancel_token(cancel)
+        futures = {
+            loop.run_in_executor(
+                self._executor,
+                partial(
+                    p._run, kwargs.copy(), None, max_stages, deadline, token,
+                    shared, max_steps=max_steps
+                )
+            ): label
+            for label, p in self._items()
+        }
+        pending = set(futures)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending,
+                    timeout=None if deadline is None
+                    else max(0, deadline - monotonic()),
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    raise BudgetExceededError("deadline")
+                for future in done:
+                    yield futures[future], future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+            if abort is not None:
+                abort.set()
+
+    def _map_chunks(
+        self,
+        inputs: Iterable[Mapping[str, Any]],
+        chunksize: int,
+        statuses: bool,
+        kwargs: dict[str, Any],
+        projection: Optional[Projection] = None,
+    ) -> Iterator[list[Any]]:
+        return map_chunks(
+            partial(
+                run_chunk,
+                pack([p for _, p in self._items()], self._executor),
+                kwargs, self._share_stages, statuses, projection
+            ),
+            inputs, chunksize, self._executor
+        )
+
+    def run_many(
+        self,
+        inputs: Iterable[Mapping[str, Any]],
+        chunksize: int = 64,
+        projection: Optional[Projection | str] = None,
+        **kwargs
+    ) -> Iterator[list[PipelineOutput] | dict[str, PipelineOutput]]:
+        """
+        Returns a generator for the results of `Pipearray.run`s for
+        every element in `inputs` (in order of `inputs`). The grid of
+        inputs and `Pipeline`s is processed in chunks of inputs which
+        are, if the `Pipearray` has an `executor`, submitted to that
+        `Executor`. In a `ProcessPoolExecutor`, every `Pipeline` is set
+        up only once per worker process (this requires the `Pipeline`s
+        to be picklable).
+
+        Keyword arguments:
+        inputs -- iterable of kwargs for individual `Pipearray.run`s
+        chunksize -- number of inputs per chunk
+                     (default 64)
+        projection -- see `Pipeline.run` (applied in the workers)
+                      (default `None`)
+        kwargs -- common keyword arguments for all runs (overridden by
+                  individual `inputs`)
+        """
+        labels = [label for label, _ in self._items()]
+        if isinstance(projection, str):
+            projection = Projection(projection)
+        for outputs in self._map_chunks(
+            inputs, chunksize, False, kwargs, projection
+        ):
+            if isinstance(self._pipelines, dict):
+                yield dict(zip(labels, outputs))
+            else:
+                yield outputs
+
+    def status_matrix(
+        self,
+        inputs: Iterable[Mapping[str, Any]],
+        chunksize: int = 64,
+        **kwargs
+    ) -> dict[str | int, list[Optional[int]]]:
+        """
+        Returns a columnar matrix of `last_status`es for every element
+        in `inputs` (rows) and `Pipeline` (columns) as a dictionary of
+        columns by label (index for anonymous `Pipearray`s). See
+        `Pipearray.run_many` for details. Only `last_status`es are
+        transferred from the workers.
+
+        Keyword arguments:
+        inputs -- iterable of kwargs for individual `Pipearray.run`s
+        chunksize -- number of inputs per chunk
+                     (default 64)
+        kwargs -- common keyword arguments for all runs (overridden by
+                  individual `inputs`)
+        """
+        columns: dict[str | int, list[Optional[int]]] = {
+            label: [] for label, _ in self._items()
+        }
+        _columns = list(columns.values())
+        for statuses in self._map_chunks(inputs, chunksize, True, kwargs):
+            for column, status in zip(_columns, statuses):
+                column.append(status)
+        return columns
+
+    def any_status(
+        self,
+        status: int | Callable[[int], bool],
+        max_stages: Optional[int] = None,
+        deadline: Optional[float] = None,
+        cancel: Optional[Any] = None,
+        max_steps: Optional[int] = None,
+        **kwargs
+    ) -> bool:
+        """
+        Returns `True` if the `last_status` of any `Pipeline` matches
+        `status`. No further `Pipeline`s are executed after the first
+        match (pending `Pipeline`s are cancelled).
+
+        Keyword arguments:
+        status -- either integer status or `Callable` that is called
+                  with a `last_status` and returns a `bool`
+        max_stages, deadline, cancel, max_steps -- see `Pipearray.run`
+        kwargs -- keyword arguments that are passed into `Pipeline`s as
+                  keyword arguments
+        """
+        with closing(
+            self._iterate(kwargs, max_stages, deadline, cancel, max_steps)
+        ) as outputs:
+            return any(
+                _matches(output.last_status, status) for _, output in outputs
+            )
+
+    def first_failure(
+        self,
+        ok: int | Callable[[int], bool] = 0,
+        max_stages: Optional[int] = None,
+        deadline: Optional[float] = None,
+        cancel: Optional[Any] = None,
+        max_steps: Optional[int] = None,
+        **kwargs
+    ) -> Optional[tuple[str | int, PipelineOutput]]:
+        """
+        Returns the pair of label (index for anonymous `Pipearray`s) and
+        `PipelineOutput` of the first `Pipeline` (in order of
+        completion) that failed or `None` if none failed. A `Pipeline`
+        is considered to have failed if it has a `last_status` that does
+        not match `ok`. No further `Pipeline`s are executed after the
+        first failure (pending `Pipeline`s are cancelled).
+
+        Keyword arguments:
+        ok -- either integer status or `Callable` that is called with a
+              `last_status` and returns a `bool`
+              (default 0)
+        max_stages, deadline, cancel, max_steps -- see `Pipearray.run`
+        kwargs -- keyword arguments that are passed into `Pipeline`s as
+                  keyword arguments
+        """
+        with closing(
+            self._iterate(kwargs, max_stages, deadline, cancel, max_steps)
+        ) as outputs:
+            return next(
+                (
+                    (label, output) for label, output in outputs
+                    if output.last_status is not None
+                    and not _matches(output.last_status, ok)
+                ),
+                None
+            )
+
+    def all_ok(
+        self,
+        ok: int | Callable[[int], bool] = 0,
+        max_stages: Optional[int] = None,
+        deadline: Optional[float] = None,
+        cancel: Optional[Any] = None,
+        max_steps: Optional[int] = None,
+        **kwargs
+    ) -> bool:
+        """
+        Returns `True` if no `Pipeline` failed (see
+        `Pipearray.first_failure`).
+
+        Keyword arguments:
+        ok -- either integer status or `Callable` that is called with a
+              `last_status` and returns a `bool`
+              (default 0)
+        max_stages, deadline, cancel, max_steps -- see `Pipearray.run`
+        kwargs -- keyword arguments that are passed into `Pipeline`s as
+                  keyword arguments
+        """
+        return self.first_failure(
+            ok, max_stages, deadline, cancel, max_steps, **kwargs
+        ) is None
+
+    def worst_status(
+        self,
+        worst: Optional[int] = None,
+        max_stages: Optional[int] = None,
+        deadline: Optional[float] = None,
+        cancel: Optional[Any] = None,
+        max_steps: Optional[int] = None,
+        **kwargs
+    ) -> Optional[int]:
+        """
+        Returns the largest `last_status` of all `Pipeline`s (`None` if
+        no `Pipeline` generated a record). If the worst possible status
+        is known, no further `Pipeline`s are executed once it is
+        reached (pending `Pipeline`s are cancelled).
+
+        Keyword arguments:
+        worst -- worst possible status
+                 (default `None`)
+        max_stages, deadline, cancel, max_steps -- see `Pipearray.run`
+        kwargs -- keyword arguments that are passed into `Pipeline`s as
+                  keyword arguments
+        """
+        result = None
+        with closing(
+            self._iterate(kwargs, max_stages, deadline, cancel, max_steps)
+        ) as outputs:
+            for _, output in outputs:
+                if output.last_status is None:
+                    continue
+                if result is None or output.last_status > result:
+                    result = output.last_status
+                if worst is not None and result >= worst:
+                    break
+        return result
@@ -0,0 +1,148 @@
+"""
+# data_plumber/batch.py
+
+This module defines helpers for the chunked execution of `Pipeline`s on
+batches of inputs (internal use).
+"""
+
+from typing import Optional, Callable, Any, Iterable, Iterator, Mapping
+import os
+import pickle
+from collections import deque, OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor
+from itertools import islice
+from uuid import uuid4
+from weakref import WeakKeyDictionary
+
+
+# pickled Pipelines by Pipeline (in the submitting process) as triple of
+# version, token, and payload; a Pipeline is pickled once per version
+_payloads: "WeakKeyDictionary[Any, tuple[int, str, bytes]]" = \
+    WeakKeyDictionary()
+# Pipelines that have been received by this (worker-)process by token
+# (least recently used first); this allows to re-use their state (e.g.
+# Resources) across chunks
+_worker_pipelines: "OrderedDict[str, Any]" = OrderedDict()
+# maximum number of Pipelines that are kept per worker process
+WORKER_CACHE_SIZE = 16
+
+
+class PackedPipeline:
+    """
+    Pickled `Pipeline` with a token that identifies it in worker
+    processes (internal use).
+    """
+    def __init__(self, token: str, payload: bytes) -> None:
+        self.token = token
+        self.payload = payload
+
+
+def chunked(iterable: Iterable[Any], chunksize: int) -> Iterator[list[Any]]:
+    """Split `iterable` into lists of (at most) `chunksize` elements."""
+    if chunksize < 1:
+        raise ValueError(
+            f"Chunk size has to be a positive integer (got '{chunksize}')."
+        )
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, chunksize)):
+        yield chunk
+
+
+def pack(pipelines: list[Any], executor: Optional[Executor]) -> list[Any]:
+    """
+    Returns `pipelines` prepared for submission to `executor`: for a
+    `ProcessPoolExecutor`, `Pipeline`s are replaced by
+    `PackedPipeline`s, otherwise they are returned unchanged.
+    """
+    if not isinstance(executor, ProcessPoolExecutor):
+        return pipelines
+    packed = []
+    for pipeline in pipelines:
+        entry = _payloads.get(pipeline)
+        if entry is None or entry[0] != pipeline._version:
+            entry = (pipeline._version, uuid4().hex, pickle.dumps(pipeline))
+            _payloads[pipeline] = entry
+        packed.append(PackedPipeline(entry[1], entry[2]))
+    return packed
+
+
+def _worker_pipeline(pipeline: Any) -> Any:
+    if not isinstance(pipeline, PackedPipeline):
+        return pipeline
+    cached = _worker_pipelines.get(pipeline.token)
+    if cached is not None:
+        _worker_pipelines.move_to_end(pipeline.token)
+        return cached
+    _worker_pipelines[pipeline.token] = cached = \
+        pickle.loads(pipeline.payload)
+    while len(_worker_pipelines) > WORKER_CACHE_SIZE:
+        _, evicted = _worker_pipelines.popitem(last=False)
+        evicted.close()
+    return cached
+
+
+def run_chunk(
+    pipelines: list[Any],
+    kwargs: dict[str, Any],
+    share_stages: bool,
+    statuses: bool,
+    projection: Optional[Any],
+    chunk: list[Mapping[str, Any]],
+) -> list[list[Any]]:
+    """
+    Run all `pipelines` on every input in `chunk`. Returns a list (per
+    input) of lists (per `Pipeline`) of either `PipelineOutput`s or
+    `last_status`es (if `statuses`).
+
+    Keyword arguments:
+    pipelines -- list of `Pipeline`s (or `PackedPipeline`s, see `pack`)
+    kwargs -- common kwargs for all runs (overridden by inputs)
+    share_stages -- see `Pipearray`
+    statuses -- if `True`, only return `last_status`es
+    projection -- `Projection` that is applied to `PipelineOutput`s
+    chunk -- list of inputs (kwargs for individual runs)
+    """
+    pipelines = [_worker_pipeline(p) for p in pipelines]
+    results = []
+    for _kwargs in chunk:
+        shared: Optional[dict] = {} if share_stages else None
+        outputs = [
+            p._run(
+                kwargs | dict(_kwargs), shared=shared, projection=projection
+            ) for p in pipelines
+        ]
+        results.append(
+            [o.last_status for o in outputs] if statuses else outputs
+        )
+    return results
+
+
+def map_chunks(
+    function: Callable[[list[Any]], list[Any]],
+    inputs: Iterable[Any],
+    chunksize: int,
+    executor: Optional[Executor] = None,
+) -> Iterator[Any]:
+    """
+    Returns a generator for the results of `function` applied to chunks
+    of `inputs` in order of `inputs`. If an `executor` is given, chunks
+    are submitted to that `Executor` (with a bounded number of pending
+    chunks).
+    """
+    if executor is None:
+        for chunk in chunked(inputs, chunksize):
+            yield from function(chunk)
+        return
+
+    limit = 2 * (os.cpu_count() or 1)
+    pending: deque = deque()
+    try:
+        for chunk in chunked(inputs, chunksize):
+            pending.append(executor.submit(function, chunk))
+            if len(pending) >= limit:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
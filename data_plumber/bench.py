@@ -0,0 +1,433 @@
+"""
+# data_plumber/bench.py
+
+This module defines a load-testing tool for `Pipeline`s and
+`Pipearray`s. Run with
+python -m data_plumber.bench module:attribute [options]
+(see `python -m data_plumber.bench --help`).
+"""
+
+from typing import Optional, Callable, Any, Iterable, Sequence
+import argparse
+import asyncio
+import importlib
+import json
+import platform
+import sys
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from dataclasses import dataclass, field
+from functools import partial
+from itertools import cycle, islice
+from pathlib import Path
+from time import perf_counter
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None  # type: ignore[assignment]
+
+from .capture import load_capture, percentile
+from .source import JSONLSource, CSVSource
+
+
+MODES = ("thread", "process", "async")
+
+# run-function of the target in worker processes (see _init_worker)
+_worker_run: Optional[Callable[..., Any]] = None
+
+
+def load(spec: str) -> Any:
+    """
+    Returns the object given by an importable path of the form
+    "module:attribute" (attribute may be dotted).
+    """
+    module, _, attribute = spec.partition(":")
+    if not module or not attribute:
+        raise ValueError(
+            f"Expected path of the form 'module:attribute' (got '{spec}')."
+        )
+    obj: Any = importlib.import_module(module)
+    for name in attribute.split("."):
+        obj = getattr(obj, name)
+    return obj
+
+
+def run_function(target: Any, compiled: bool = False) -> Callable[..., Any]:
+    """
+    Returns the run-function of `target` (`Pipeline`, `Pipearray`, or a
+    `Callable` that is called with the kwargs of individual runs).
+
+    Keyword arguments:
+    target -- benchmarked object or its path (see `load`)
+    compiled -- if `True`, `Pipeline`s are compiled first (see
+                `Pipeline.compile`)
+                (default `False`)
+    """
+    if isinstance(target, str):
+        target = load(target)
+    if compiled and hasattr(target, "compile"):
+        return target.compile()
+    if hasattr(target, "run"):
+        return target.run
+    if callable(target):
+        return target
+    raise ValueError(
+        f"Benchmark target '{target}' is neither runnable nor callable."
+    )
+
+
+def _usage() -> tuple[float, int]:
+    """
+    Returns pair of CPU time (user and system; in seconds) and peak
+    resident set size (in bytes) of this process and its terminated
+    children (zero if the `resource`-module is not available).
+    """
+    if resource is None:
+        return 0.0, 0
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    # ru_maxrss is given in bytes on macOS and in kilobytes elsewhere
+    scale = 1 if sys.platform == "darwin" else 1024
+    return (
+        own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime,
+        max(own.ru_maxrss, children.ru_maxrss) * scale
+    )
+
+
+def _timed(
+    run: Callable[..., Any], inputs: Iterable[dict[str, Any]]
+) -> tuple[list[float], int]:
+    """Returns pair of latencies and number of errors of runs."""
+    latencies = []
+    errors = 0
+    for kwargs in inputs:
+        start = perf_counter()
+        try:
+            run(**kwargs)
+        except Exception:
+            errors = errors + 1
+        latencies.append(perf_counter() - start)
+    return latencies, errors
+
+
+def _init_worker(target: str, compiled: bool) -> None:
+    global _worker_run
+    _worker_run = run_function(target, compiled)
+
+
+def _run_worker(
+    inputs: list[dict[str, Any]]
+) -> tuple[list[float], int]:
+    assert _worker_run is not None
+    return _timed(_worker_run, inputs)
+
+
+@dataclass
+class BenchResult:
+    """
+    Result of a single benchmark configuration (see `benchmark`).
+
+    Keyword arguments:
+    mode -- one of "thread", "process", or "async"
+    concurrency -- number of concurrent workers
+    runs -- number of measured runs
+    time -- total (wall-clock) time in seconds
+    cpu -- CPU time (user and system; including worker processes) in
+           seconds
+    rss -- peak resident set size of this process (or any of its worker
+           processes) so far in bytes (zero if unavailable)
+    errors -- number of runs that raised an exception
+              (default 0)
+    latencies -- duration of individual runs in seconds
+                 (default `[]`)
+    """
+    mode: str
+    concurrency: int
+    runs: int
+    time: float
+    cpu: float
+    rss: int
+    errors: int = 0
+    latencies: list[float] = field(default_factory=list)
+
+    @property
+    def throughput(self) -> float:
+        """Returns number of runs per second."""
+        return self.runs / self.time if self.time else 0.0
+
+    def percentile(self, q: float) -> Optional[float]:
+        """Returns the `q`-th percentile of latencies (in seconds)."""
+        return percentile(self.latencies, q)
+
+    def as_dict(self) -> dict[str, Any]:
+        """Returns summary (without latencies) as dictionary."""
+        return {
+            "mode": self.mode,
+            "concurrency": self.concurrency,
+            "runs": self.runs,
+            "errors": self.errors,
+            "time": self.time,
+            "throughput": self.throughput,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+            "cpu": self.cpu,
+            "cpu_utilization": self.cpu / self.time if self.time else 0.0,
+            "rss": self.rss,
+        }
+
+
+def _split(inputs: list[Any], count: int) -> list[list[Any]]:
+    # split inputs into (at most) count contiguous chunks
+    size = -(-len(inputs) // count)
+    return [inputs[i:i + size] for i in range(0, len(inputs), size)]
+
+
+async def _run_async(
+    run: Callable[..., Any], inputs: list[dict[str, Any]], concurrency: int
+) -> tuple[list[float], int]:
+    # concurrency coroutines that await runs in a thread pool (as in an
+    # asyncio-based service)
+    loop = asyncio.get_running_loop()
+    iterator = iter(inputs)
+    latencies: list[float] = []
+    errors = 0
+
+    async def worker(executor):
+        nonlocal errors
+        for kwargs in iterator:
+            start = perf_counter()
+            try:
+                await loop.run_in_executor(
+                    executor, lambda: run(**kwargs)
+                )
+            except Exception:
+                errors = errors + 1
+            latencies.append(perf_counter() - start)
+
+    with ThreadPoolExecutor(concurrency) as executor:
+        await asyncio.gather(*(worker(executor) for _ in range(concurrency)))
+    return latencies, errors
+
+
+def benchmark(
+    target: Any,
+    inputs: Sequence[dict[str, Any]],
+    mode: str = "thread",
+    concurrency: int = 1,
+    runs: Optional[int] = None,
+    warmup: int = 0,
+    compiled: bool = False,
+) -> BenchResult:
+    """
+    Run `target` on `inputs` with the given concurrency and return a
+    `BenchResult`.
+
+    Keyword arguments:
+    target -- `Pipeline`, `Pipearray`, or `Callable` (see
+              `run_function`); for mode "process", this has to be an
+              importable path (see `load`)
+    inputs -- kwargs for individual runs (repeated if `runs` exceeds
+              their number)
+    mode -- one of "thread" (`concurrency` threads), "process"
+            (`concurrency` worker processes), or "async" (`concurrency`
+            coroutines of an asyncio event loop awaiting runs in a
+            thread pool)
+            (default "thread")
+    concurrency -- number of concurrent workers
+                   (default 1)
+    runs -- number of measured runs
+            (default `None`; number of inputs)
+    warmup -- number of unmeasured runs before measuring (per worker
+              process for mode "process")
+              (default 0)
+    compiled -- see `run_function`
+                (default `False`)
+    """
+    if mode not in MODES:
+        raise ValueError(
+            f"Unknown mode '{mode}' (expected one of {', '.join(MODES)})."
+        )
+    if concurrency < 1:
+        raise ValueError(
+            f"Concurrency has to be a positive integer (got '{concurrency}')."
+        )
+    if not inputs:
+        raise ValueError("Benchmark requires at least one input.")
+    measured = list(islice(cycle(inputs), runs or len(inputs)))
+    warmups = list(islice(cycle(inputs), warmup))
+    chunks = _split(measured, concurrency)
+
+    if mode == "process":
+        if not isinstance(target, str):
+            raise ValueError(
+                "Mode 'process' requires an importable path as target."
+            )
+        with ProcessPoolExecutor(
+            concurrency, initializer=_init_worker,
+            initargs=(target, compiled)
+        ) as executor:
+            # start all workers (and load target) before measuring
+            list(executor.map(_run_worker, [warmups] * concurrency))
+            cpu, _ = _usage()
+            start = perf_counter()
+            results = list(executor.map(_run_worker, chunks))
+            time = perf_counter() - start
+            # wait for workers to terminate in order to include their
+            # resource usage
+            executor.shutdown(wait=True)
+        cpu_end, rss = _usage()
+        # CPU time of workers can only be obtained after they terminated
+        # (and includes the warmup)
+        return BenchResult(
+            mode, concurrency, len(measured), time, cpu_end - cpu, rss,
+            sum(e for _, e in results),
+            [latency for l, _ in results for latency in l]
+        )
+
+    run = run_function(target, compiled)
+    _timed(run, warmups)
+    cpu, _ = _usage()
+    start = perf_counter()
+    if mode == "async":
+        results = [asyncio.run(_run_async(run, measured, concurrency))]
+    elif concurrency == 1:
+        results = [_timed(run, measured)]
+    else:
+        with ThreadPoolExecutor(concurrency) as executor:
+            results = list(executor.map(partial(_timed, run), chunks))
+    time = perf_counter() - start
+    cpu_end, rss = _usage()
+    return BenchResult(
+        mode, concurrency, len(measured), time, cpu_end - cpu, rss,
+        sum(e for _, e in results),
+        [latency for l, _ in results for latency in l]
+    )
+
+
+def read_inputs(path: str | Path) -> list[dict[str, Any]]:
+    """
+    Returns kwargs read from a file: JSON-lines (".jsonl"), CSV
+    (".csv"), or a capture file (".gz"; see `Capture`).
+    """
+    path = Path(path)
+    if path.suffix == ".gz":
+        return [entry.kwargs for entry in load_capture(path)]
+    if path.suffix == ".csv":
+        return list(CSVSource(path))
+    return list(JSONLSource(path))
+
+
+def _parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="python -m data_plumber.bench",
+        description="Load-test a Pipeline or Pipearray.",
+    )
+    parser.add_argument(
+        "target",
+        help="importable path 'module:attribute' of a Pipeline, Pipearray, "
+        + "or callable"
+    )
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument(
+        "--input", help="file with kwargs (.jsonl, .csv, or capture .gz)"
+    )
+    source.add_argument(
+        "--generator",
+        help="importable path 'module:attribute' of an iterable of kwargs "
+        + "(or a callable returning one)"
+    )
+    source.add_argument(
+        "--kwargs", default="{}",
+        help="JSON-object used as kwargs for every run (default '{}')"
+    )
+    parser.add_argument(
+        "--runs", type=int, default=None,
+        help="number of measured runs per configuration (default: number "
+        + "of inputs, 1000 for --kwargs)"
+    )
+    parser.add_argument(
+        "--warmup", type=int, default=10,
+        help="number of unmeasured runs before measuring (default 10)"
+    )
+    parser.add_argument(
+        "--mode", nargs="+", choices=MODES, default=["thread"],
+        help="concurrency mode(s) (default thread)"
+    )
+    parser.add_argument(
+        "--concurrency", nargs="+", type=int, default=[1],
+        help="number(s) of concurrent workers (default 1)"
+    )
+    parser.add_argument(
+        "--compiled", action="store_true",
+        help="compile Pipelines before running"
+    )
+    parser.add_argument(
+        "--json", help="write results as JSON to this file ('-' for stdout)"
+    )
+    return parser
+
+
+def _format(result: BenchResult) -> str:
+    def _ms(value):
+        return "-" if value is None else f"{value * 1000:.3f}"
+    summary = result.as_dict()
+    return (
+        f"{result.mode:<8} {result.concurrency:>5} {result.runs:>8} "
+        + f"{summary['throughput']:>12.1f} {_ms(summary['p50']):>10} "
+        + f"{_ms(summary['p95']):>10} {_ms(summary['p99']):>10} "
+        + f"{summary['cpu_utilization'] * 100:>6.0f}% "
+        + f"{result.rss / 2**20:>9.1f} {result.errors:>7}"
+    )
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    """Command line entry point (returns exit code)."""
+    args = _parser().parse_args(argv)
+    runs = args.runs
+    if args.input is not None:
+        inputs = read_inputs(args.input)
+    elif args.generator is not None:
+        generator = load(args.generator)
+        inputs = list(generator() if callable(generator) else generator)
+    else:
+        inputs = [json.loads(args.kwargs)]
+        runs = runs or 1000
+
+    results = []
+    if args.json != "-":
+        print(
+            f"{'mode':<8} {'conc':>5} {'runs':>8} {'runs/s':>12} "
+            + f"{'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10} {'cpu':>7} "
+            + f"{'rss MiB':>9} {'errors':>7}"
+        )
+    for mode in args.mode:
+        for concurrency in args.concurrency:
+            result = benchmark(
+                args.target if mode == "process" else load(args.target),
+                inputs, mode, concurrency, runs, args.warmup, args.compiled
+            )
+            results.append(result)
+            if args.json != "-":
+                print(_format(result), flush=True)
+
+    if args.json is not None:
+        report = json.dumps(
+            {
+                "target": args.target,
+                "inputs": len(inputs),
+                "python": platform.python_version(),
+                # False on free-threaded builds with the GIL disabled
+                "gil": getattr(sys, "_is_gil_enabled", lambda: True)(),
+                "results": [result.as_dict() for result in results],
+            },
+            indent=2
+        )
+        if args.json == "-":
+            print(report)
+        else:
+            Path(args.json).write_text(report, encoding="utf-8")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
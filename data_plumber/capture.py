@@ -0,0 +1,326 @@
+"""
+# data_plumber/capture.py
+
+This module defines the `Capture`-class, a sampled recording of the
+inputs and outputs of `Pipeline.run`s (or `Pipearray.run`s), as well as
+`replay` for re-running captured inputs and comparing the results.
+"""
+
+from typing import Optional, Callable, Any, Iterable, Iterator
+import gzip
+import json
+import random
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from threading import Lock
+from time import perf_counter
+
+from .output import PipelineOutput
+
+
+REDACTED = "<redacted>"
+
+
+def _records(output: PipelineOutput) -> list[list[Any]]:
+    return [[r.index, r.id_, r.message, r.status] for r in output.records]
+
+
+def _kind(outputs: Any) -> str:
+    # kind of result ("pipeline" for Pipeline.run, "pipearray" for
+    # Pipearray.run)
+    return "pipeline" if isinstance(outputs, PipelineOutput) else "pipearray"
+
+
+def _outputs(outputs: Any) -> Any:
+    # convert output of Pipeline.run or Pipearray.run
+    if isinstance(outputs, PipelineOutput):
+        return _records(outputs)
+    if isinstance(outputs, dict):
+        return {str(k): _records(o) for k, o in outputs.items()}
+    return [_records(o) for o in outputs]
+
+
+def _comparable(outputs: Any, kind: str) -> Any:
+    # reduce (converted) outputs to pairs of status and message
+    if kind == "pipeline":
+        return [(r[3], r[2]) for r in outputs]
+    if isinstance(outputs, dict):
+        return {k: _comparable(o, "pipeline") for k, o in outputs.items()}
+    return [_comparable(o, "pipeline") for o in outputs]
+
+
+def percentile(values: list[float], q: float) -> Optional[float]:
+    """
+    Returns the `q`-th percentile (0 to 100; nearest rank) of `values`
+    (`None` if empty).
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    rank = max(0, min(len(values) - 1, round(q / 100 * len(values)) - 1))
+    return values[rank]
+
+
+@dataclass
+class CapturedRun:
+    """
+    Entry of a capture file.
+
+    Keyword arguments:
+    kwargs -- (redacted) kwargs of the run
+    outputs -- recorded `StageRecord`s as lists of index, identifier,
+               message, and status (for `Pipearray.run`s a list or
+               dictionary of these per `Pipeline`)
+    kind -- "pipeline" for `Pipeline.run`s and "pipearray" for
+            `Pipearray.run`s
+            (default "pipeline")
+    """
+    kwargs: dict[str, Any]
+    outputs: Any
+    kind: str = "pipeline"
+
+
+class Capture:
+    """
+    A `Capture` samples the kwargs and resulting `StageRecord`s of the
+    `Pipeline.run`s (or `Pipearray.run`s) it is given to and appends
+    them to a gzip-compressed file in JSON-lines format (values that are
+    not JSON-serializable are stored as strings). Captured runs can be
+    re-run with `replay`, e.g. in order to compare a refactored
+    `Pipeline` against production traffic.
+
+    Kwargs are copied before the run (only if sampled), i.e. kwargs
+    exported by `Stage`s are not captured. Like a `RunHistory`, a
+    `Capture` cannot be pickled; use a separate file per process.
+
+    Example usage:
+     >>> from data_plumber import Pipeline, Capture
+     >>> capture = Capture("traffic.jsonl.gz", rate=0.01, redact=["token"])
+     >>> p = Pipeline(..., capture=capture)
+     >>> p.run(...)
+     >>> capture.close()
+
+    Keyword arguments:
+    path -- path to the capture file (appended to if it exists)
+    rate -- fraction of runs that are captured
+            (default 1.0)
+    redact -- either names of kwargs whose values are replaced by
+              "<redacted>" or a `Callable` that returns the redacted
+              copy of a dictionary of kwargs
+              (default `None`)
+    seed -- seed for sampling
+            (default `None`)
+    """
+
+    def __init__(
+        self,
+        path: str | Path,
+        rate: float = 1.0,
+        redact: Optional[
+            Iterable[str] | Callable[[dict[str, Any]], dict[str, Any]]
+        ] = None,
+        seed: Optional[int] = None,
+    ) -> None:
+        if not 0 <= rate <= 1:
+            raise ValueError(
+                f"Sampling rate has to be between 0 and 1 (got '{rate}')."
+            )
+        self._path = Path(path)
+        self._rate = rate
+        if redact is None or callable(redact):
+            self._redact = redact
+        else:
+            names = frozenset(redact)
+            self._redact = lambda kwargs: {
+                k: (REDACTED if k in names else v) for k, v in kwargs.items()
+            }
+        self._random = random.Random(seed)
+        self._lock = Lock()
+        self._file: Any = None
+        self._count = 0
+
+    @property
+    def path(self) -> Path:
+        """Returns the path of the capture file."""
+        return self._path
+
+    @property
+    def count(self) -> int:
+        """Returns the number of captured runs."""
+        return self._count
+
+    # the following methods are called by Pipeline and Pipearray
+    def sample(self) -> bool:
+        """Returns `True` if the next run is to be captured."""
+        if self._rate >= 1:
+            return True
+        with self._lock:
+            return self._random.random() < self._rate
+
+    def record(self, kwargs: dict[str, Any], outputs: Any) -> None:
+        """
+        Append captured run.
+
+        Keyword arguments:
+        kwargs -- copy of the kwargs of the run
+        outputs -- result of the run
+        """
+        if self._redact is not None:
+            kwargs = self._redact(kwargs)
+        line = json.dumps(
+            {
+                "kwargs": kwargs,
+                "outputs": _outputs(outputs),
+                "kind": _kind(outputs),
+            },
+            default=str
+        ) + "\n"
+        with self._lock:
+            if self._file is None:
+                self._file = gzip.open(self._path, "at", encoding="utf-8")
+            self._file.write(line)
+            self._count = self._count + 1
+
+    def flush(self) -> None:
+        """Write buffered runs."""
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+
+    def close(self) -> None:
+        """Write buffered runs and close file."""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __getstate__(self):
+        raise TypeError(
+            "'Capture' cannot be pickled (use a separate capture file per "
+            + "process)."
+        )
+
+
+def load_capture(path: str | Path) -> Iterator[CapturedRun]:
+    """Returns a generator for the `CapturedRun`s in a capture file."""
+    with gzip.open(path, "rt", encoding="utf-8") as file:
+        for line in file:
+            if line.strip():
+                entry = json.loads(line)
+                yield CapturedRun(
+                    entry["kwargs"], entry["outputs"],
+                    entry.get("kind", "pipeline")
+                )
+
+
+@dataclass
+class ReplayReport:
+    """
+    Result of `replay`.
+
+    Keyword arguments:
+    runs -- number of replayed runs
+    time -- total (wall-clock) time in seconds
+    latencies -- duration of individual runs in seconds (in order of the
+                 capture file)
+    mismatches -- triples of position in the capture file, recorded and
+                  replayed pairs of status and message
+    """
+    runs: int
+    time: float
+    latencies: list[float] = field(default_factory=list)
+    mismatches: list[tuple[int, Any, Any]] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        """Returns `True` if all replayed runs match their recording."""
+        return not self.mismatches
+
+    @property
+    def throughput(self) -> float:
+        """Returns number of runs per second."""
+        return self.runs / self.time if self.time else 0.0
+
+    def percentile(self, q: float) -> Optional[float]:
+        """Returns the `q`-th percentile of latencies (in seconds)."""
+        return percentile(self.latencies, q)
+
+    def as_dict(self) -> dict[str, Any]:
+        """Returns summary as (JSON-serializable) dictionary."""
+        return {
+            "runs": self.runs,
+            "time": self.time,
+            "throughput": self.throughput,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+            "mismatches": len(self.mismatches),
+        }
+
+    def __str__(self) -> str:
+        def _ms(value):
+            return "-" if value is None else f"{value * 1000:.3f} ms"
+        return (
+            f"{self.runs} runs in {self.time:.3f} s "
+            + f"({self.throughput:.1f} runs/s), "
+            + f"p50 {_ms(self.percentile(50))}, "
+            + f"p95 {_ms(self.percentile(95))}, "
+            + f"p99 {_ms(self.percentile(99))}, "
+            + f"{len(self.mismatches)} mismatches"
+        )
+
+
+def replay(
+    target: Any,
+    path: str | Path,
+    concurrency: int = 1,
+    compare: bool = True,
+) -> ReplayReport:
+    """
+    Re-run the captured inputs of a capture file with `target` and
+    compare statuses and messages with the recorded outputs. Returns a
+    `ReplayReport` with throughput, latencies, and mismatches.
+
+    Keyword arguments:
+    target -- `Pipeline`, `Pipearray`, or `Callable` that returns their
+              output for kwargs (e.g. the result of `Pipeline.compile`)
+    path -- path to the capture file
+    concurrency -- number of threads that run inputs concurrently
+                   (default 1)
+    compare -- if `False`, outputs are not compared
+               (default `True`)
+    """
+    run = target if not hasattr(target, "run") else target.run
+    captured = list(load_capture(path))
+
+    def _run(entry: CapturedRun) -> tuple[float, Any]:
+        start = perf_counter()
+        outputs = run(**entry.kwargs)
+        return perf_counter() - start, outputs
+
+    start = perf_counter()
+    if concurrency <= 1:
+        results = [_run(entry) for entry in captured]
+    else:
+        with ThreadPoolExecutor(concurrency) as executor:
+            results = list(executor.map(_run, captured))
+    report = ReplayReport(
+        len(captured), perf_counter() - start,
+        [latency for latency, _ in results]
+    )
+    if compare:
+        for position, (entry, (_, outputs)) in enumerate(
+            zip(captured, results)
+        ):
+            expected = _comparable(entry.outputs, entry.kind)
+            actual = _comparable(_outputs(outputs), _kind(outputs))
+            if expected != actual:
+                report.mismatches.append((position, expected, actual))
+    return report
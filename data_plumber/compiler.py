@@ -0,0 +1,528 @@
+"""
+# data_plumber/compiler.py
+
+This module defines a code generator that translates a `Pipeline` into
+a specialized Python function which replaces the generic execution loop
+of `Pipeline.run` (internal use, see `Pipeline.compile`).
+
+Starting at the first component, the generator traces the `Pipeline`
+and emits straight-line code. At a `Fork`, the trace continues with
+the most frequent target (hot target) as given by a `layout`; all other
+targets (and `Fork`s without hot target) resume execution in the
+generic loop. The same applies if the trace revisits a position or
+reaches a group of adaptively ordered `Stage`s.
+"""
+
+from typing import Callable, Any, Optional
+import linecache
+from functools import partial
+from itertools import count
+from operator import eq
+from time import monotonic, perf_counter
+from weakref import finalize
+
+from .context import PipelineContext
+from .error import PipelineError, BudgetExceededError
+from .fork import Fork
+from .hooks import wants_context
+from .lazy import has_lazy, resolve
+from .output import StageRecord, PipelineOutput
+from .ref import Previous
+from .specialize import Constant
+from .stage import Stage, _default_primer, _default_action, \
+    _default_export, _default_status, _default_message
+
+
+# numbers of generated functions (see compile_pipeline)
+_COUNTER = count()
+
+
+def _check_budget(deadline, cancel, records, kwargs, data) -> None:
+    if deadline is not None and monotonic() >= deadline:
+        raise BudgetExceededError(
+            "deadline", PipelineOutput(records, kwargs, data)
+        )
+    if cancel is not None and cancel.is_set():
+        raise BudgetExceededError(
+            "cancel", PipelineOutput(records, kwargs, data)
+        )
+
+
+def _latest_status(status, target, stage, records) -> int:
+    if status is None:
+        # this Stage has not been executed
+        raise PipelineError(
+            f"Referenced Stage '{target}' (required by Stage"
+            + f" '{stage}') has not been executed yet. "
+            + f"Records until error: {records}"
+        )
+    return status
+
+
+class _Generator:
+    """Source code generator for a single `Pipeline`."""
+
+    def __init__(self, pipeline: Any, layout: dict[int, int]) -> None:
+        self.pipeline = pipeline
+        self.layout = layout
+        self.profile = pipeline._profile
+        self.metrics = pipeline._metrics is not None
+        self.hooks = pipeline._hooks
+        self.memory = pipeline._memory is not None
+        self.stages: list[str] = pipeline._pipeline
+        self.catalog = pipeline._stage_catalog
+        # part of runs evaluated by Pipeline.specialize
+        self.prefix = pipeline._prefix
+        self.start = 0 if self.prefix is None else self.prefix.index
+        # groups of adaptively ordered Stages are left to the generic loop
+        self.groups = (
+            {} if pipeline._scheduler is None
+            else pipeline._commutative_groups()
+        )
+        self.lines: list[str] = []
+        self.indent = 1
+        self.namespace: dict[str, Any] = {
+            "P": pipeline,
+            "STAGES": pipeline._pipeline,
+            "LOOP": pipeline._loop,
+            "PipelineContext": PipelineContext,
+            "PipelineOutput": PipelineOutput,
+            "StageRecord": StageRecord,
+            "BudgetExceededError": BudgetExceededError,
+            "_check_budget": _check_budget,
+            "_latest_status": _latest_status,
+            "Fork": Fork,
+            "PROFILE": pipeline._profile,
+            "METRICS": pipeline._metrics,
+            "MEMORY": pipeline._memory,
+            "perf_counter": perf_counter,
+            "_has_lazy": has_lazy,
+            "_resolve": resolve,
+        }
+        # first position of components by id
+        self.namespace["IDX"] = {
+            _s: index for index, _s in reversed(list(enumerate(self.stages)))
+        }
+        self._names: dict[int, str] = {}
+        # local variables holding the latest status of Stages by id
+        self.status_vars: dict[str, str] = {}
+        # statuses of Stages in the prefix that cannot change during the
+        # remainder of runs (no Forks, loops, or repetitions)
+        self.constant_statuses: dict[str, int] = {}
+        if self.prefix is not None and not pipeline._loop \
+                and not self.groups and not any(
+                    isinstance(self.catalog.get(_s), Fork)
+                    for _s in self.stages[self.start:]
+                ):
+            self.constant_statuses = {
+                _s: status for _s, status in self.prefix.statuses.items()
+                if _s not in self.stages[self.start:]
+            }
+
+    def emit(self, line: str) -> None:
+        self.lines.append("    " * self.indent + line)
+
+    def name(self, obj: Any) -> str:
+        """Returns name of `obj` in the generated function's namespace."""
+        if (name := self._names.get(id(obj))) is None:
+            name = f"_c{len(self._names)}"
+            self._names[id(obj)] = name
+            self.namespace[name] = obj
+        return name
+
+    def status_var(self, stage_id: str) -> str:
+        if (name := self.status_vars.get(stage_id)) is None:
+            name = f"_s{len(self.status_vars)}"
+            self.status_vars[stage_id] = name
+        return name
+
+    def context(self, index: int | str) -> str:
+        return (
+            f"PipelineContext(STAGES, {index}, LOOP, records, kwargs, data, "
+            + "stage_count)"
+        )
+
+    def requirements(self, index: int, _s: str, s: Stage) -> Optional[str]:
+        """
+        Returns an expression that evaluates the requirements of `Stage`
+        `s` or `None` if it is unconditional.
+        """
+        if not s.requires:
+            return None
+        generic = f"P._meets_requirements({_s!r}, {self.context(index)})"
+        conditions = []
+        for ref, req in s.requires.items():
+            if ref is Previous:
+                # latest status of previous Stage is its own status (the
+                # generic check raises the appropriate error if there is
+                # no previous Stage)
+                status = f"(records[-1].status if records else {generic})"
+                if callable(req):
+                    conditions.append(f"{self.name(req)}(status={status})")
+                else:
+                    conditions.append(f"{status} == {self.name(req)}")
+                continue
+            if not ref.static:
+                return generic
+            try:
+                target = ref.get(
+                    PipelineContext(
+                        self.stages, index, self.pipeline._loop, [], {},
+                        None, -1
+                    )
+                ).stage
+            except PipelineError:
+                return generic
+            if not isinstance(self.catalog.get(target), Stage):
+                return generic
+            if target in self.constant_statuses:
+                # fold requirement
+                value = self.constant_statuses[target]
+                if not (
+                    req(status=value) if callable(req) else value == req
+                ):
+                    return "False"
+                continue
+            status = (
+                f"_latest_status({self.status_var(target)}, {target!r}, "
+                + f"{_s!r}, records)"
+            )
+            if callable(req):
+                conditions.append(f"{self.name(req)}(status={status})")
+            else:
+                conditions.append(f"{status} == {self.name(req)}")
+        return " and ".join(conditions) or None
+
+    def hook(self, event: str, index: int | str, arguments: str) -> None:
+        """
+        Emit direct calls to the callbacks of `Hooks` for `event` (no
+        code if there are none).
+        """
+        if self.hooks is None:
+            return
+        callbacks = self.hooks.callbacks(event)
+        if any(map(wants_context, callbacks)):
+            self.emit(f"context = {self.context(index)}")
+        for callback in callbacks:
+            self.emit(
+                f"{self.name(callback)}({arguments}"
+                + (", context=context)" if wants_context(callback) else ")")
+            )
+
+    def has_hook(self, event: str) -> bool:
+        return self.hooks is not None and bool(self.hooks.callbacks(event))
+
+    def exit(self, index: int | str, reason: str) -> None:
+        """Emit exit of the run (indented)."""
+        self.indent = self.indent + 1
+        self.hook("on_exit", index, f"index={index}, reason={reason!r}")
+        self.emit("return P._finish(finalize_output, records, kwargs, data)")
+        self.indent = self.indent - 1
+
+    def exit_condition(self, status: str) -> str:
+        exit_on_status = self.pipeline._exit_on_status
+        if isinstance(exit_on_status, partial) \
+                and exit_on_status.func is eq and not exit_on_status.keywords:
+            return f"{status} == {self.name(exit_on_status.args[0])}"
+        return f"{self.name(exit_on_status)}({status})"
+
+    def stage(self, index: int, _s: str, s: Stage) -> None:
+        """Emit execution of `Stage` `s` at position `index`."""
+        self.emit(
+            "if max_stages is not None and stage_count + 1 >= max_stages:"
+        )
+        self.emit(
+            "    raise BudgetExceededError(\"max_stages\", "
+            + "PipelineOutput(records, kwargs, data))"
+        )
+        self.emit("stage_count = stage_count + 1")
+        self.hook("before_stage", index, f"index={index}, stage={_s!r}")
+        if self.memory:
+            self.emit("memory_start = MEMORY.start_stage()")
+        if self.metrics:
+            self.emit("started = perf_counter()")
+        args = "**kwargs, out=data, primer=primer, count=stage_count"
+        for function in (s.primer, s.action, s.export):
+            self.lazy(function)
+        # calls to default-Callables are folded
+        if s.primer is _default_primer:
+            self.emit("primer = None")
+        else:
+            self.emit(
+                f"primer = {self.name(s.primer)}"
+                + "(**kwargs, out=data, count=stage_count)"
+            )
+        if s.action is not _default_action:
+            self.emit(f"{self.name(s.action)}({args})")
+        if s.export is not _default_export:
+            self.emit(f"exported_kwargs = {self.name(s.export)}({args})")
+            self.emit("P._validate_external_kwargs(**exported_kwargs)")
+            self.emit("kwargs.update(exported_kwargs)")
+            self.emit("if not lazy:")
+            self.emit("    lazy = _has_lazy(exported_kwargs)")
+        self.lazy(s.status)
+        self.lazy(s.message)
+        if s.status is _default_status:
+            self.emit("status = 0")
+        elif isinstance(s.status, Constant):
+            self.emit(f"status = {self.name(s.status.value)}")
+        else:
+            self.emit(f"status = {self.name(s.status)}({args})")
+        if s.message is _default_message:
+            self.emit("msg = \"\"")
+        elif isinstance(s.message, Constant):
+            self.emit(f"msg = {self.name(s.message.value)}")
+        else:
+            self.emit(f"msg = {self.name(s.message)}({args}, status=status)")
+        if self.memory:
+            self.emit(f"MEMORY.record_stage({_s!r}, memory_start)")
+        self.emit(f"records.append(StageRecord({index}, {_s!r}, msg, status))")
+        self.emit(f"{self.status_var(_s)} = status")
+        if self.profile is not None:
+            self.emit(f"PROFILE.record_stage({_s!r}, status)")
+        if self.metrics:
+            self.emit(
+                f"shard.stage({_s!r}, status, perf_counter() - started)"
+            )
+        self.hook(
+            "after_stage", index,
+            f"index={index}, stage={_s!r}, status=status, message=msg"
+        )
+        self.emit(f"if {self.exit_condition('status')}:")
+        self.exit(index, "status")
+
+    def lazy(self, function: Callable[..., Any]) -> None:
+        """Emit resolution of `Lazy` kwargs that `function` declares."""
+        if function in (
+            _default_primer, _default_action, _default_export,
+            _default_status, _default_message
+        ) or isinstance(function, Constant):
+            return
+        self.emit("if lazy:")
+        self.emit(f"    _resolve({self.name(function)}, kwargs)")
+
+    def resume(self, index: str) -> None:
+        """Emit continuation of execution in generic loop."""
+        self.emit(
+            "return P._execute(kwargs, finalize_output, max_stages, deadline, "
+            + f"cancel, None, ({index}, records, data, stage_count)"
+            + (", shard=shard)" if self.metrics else ")")
+        )
+
+    def record_fork(self, index: int, _s: str, target: str) -> None:
+        """Emit recording of `Fork`-decision (indented)."""
+        if self.profile is not None:
+            self.emit(f"    PROFILE.record_fork({index}, {target})")
+        if self.metrics:
+            self.emit(f"    shard.fork({index}, {target})")
+        self.indent = self.indent + 1
+        self.hook(
+            "on_fork", index, f"index={index}, fork={_s!r}, target={target}"
+        )
+        self.indent = self.indent - 1
+
+    def fork(self, index: int, _s: str, f: Fork) -> Optional[int]:
+        """
+        Emit evaluation of `Fork` `f` at position `index`. Returns
+        position of the hot target (or `None` if the trace ends).
+        """
+        self.lazy(f.fork)
+        if type(f) is Fork:
+            # call conditional directly and resolve identifiers without
+            # constructing a StageRef
+            self.emit(
+                f"result = {self.name(f.fork)}(**kwargs, out=data, "
+                + "count=stage_count, records=records)"
+            )
+            self.emit("if result is None:")
+            self.record_fork(index, _s, "None")
+            self.exit(index, "fork")
+            self.emit("if result.__class__ is str and result in IDX:")
+            self.emit("    target = IDX[result]")
+            self.emit("else:")
+            self.emit(
+                f"    target = Fork._to_ref(result).get({self.context(index)})"
+                + ".index"
+            )
+        else:
+            self.emit(
+                f"stage_ref = {self.name(f)}.eval({self.context(index)})"
+            )
+            self.emit("if stage_ref is None:")
+            self.record_fork(index, _s, "None")
+            self.exit(index, "fork")
+            self.emit(f"target = stage_ref.get({self.context(index)}).index")
+        self.indent = self.indent - 1
+        self.record_fork(index, _s, "target")
+        self.indent = self.indent + 1
+        hot = self.layout.get(index)
+        if hot is None:
+            self.resume("target")
+            return None
+        self.emit(f"if target != {hot}:")
+        self.indent = self.indent + 1
+        self.resume("target")
+        self.indent = self.indent - 1
+        return hot
+
+    def component(self, index: int) -> Optional[int]:
+        """
+        Emit evaluation of `_PipelineComponent` at position `index`.
+        Returns next position in trace (or `None` if the trace ends).
+        """
+        _s = self.stages[index]
+        if index in self.groups:
+            self.resume(str(index))
+            return None
+        self.emit(f"# [{index}] {_s!r}")
+        self.emit("if budgeted:")
+        self.emit("    _check_budget(deadline, cancel, records, kwargs, data)")
+        s = self.catalog.get(_s)
+        if s is None:  # empty component
+            return index + 1
+        if isinstance(s, Fork):
+            return self.fork(index, _s, s)
+        assert isinstance(s, Stage)
+        condition = self.requirements(index, _s, s)
+        if condition is None:
+            self.stage(index, _s, s)
+            return index + 1
+        self.emit(f"if {condition}:")
+        self.indent = self.indent + 1
+        self.stage(index, _s, s)
+        self.indent = self.indent - 1
+        if self.metrics or self.has_hook("on_requirement_skip"):
+            self.emit("else:")
+            if self.metrics:
+                self.emit(f"    shard.skip({_s!r})")
+            self.indent = self.indent + 1
+            self.hook(
+                "on_requirement_skip", index, f"index={index}, stage={_s!r}"
+            )
+            self.indent = self.indent - 1
+        return index + 1
+
+    def trace(self) -> None:
+        """Emit straight-line code along the hot path."""
+        visited = set()
+        index: Optional[int] = self.start
+        while index is not None:
+            if self.pipeline._loop:
+                index = index % len(self.stages)
+            elif index >= len(self.stages):
+                self.indent = self.indent - 1
+                self.exit(index, "end")
+                return
+            if index in visited:
+                self.resume(str(index))
+                return
+            visited.add(index)
+            index = self.component(index)
+
+    def generate(self) -> str:
+        """Returns source code of the function `execute`."""
+        # step budgets are only counted by the generic loop
+        self.emit("if shared is not None or max_steps is not None:")
+        self.emit(
+            "    return P._execute(kwargs, finalize_output, max_stages, "
+            + "deadline, cancel, shared, max_steps=max_steps, shard=shard)"
+        )
+        self.emit("budgeted = deadline is not None or cancel is not None")
+        if self.prefix is None:
+            self.emit("records = []")
+            self.emit("data = P._initialize_output()")
+            self.emit("stage_count = -1")
+        else:
+            # continue after prefix (see Pipeline._execute)
+            self.emit(
+                "if max_stages is not None and max_stages < "
+                + f"{self.prefix.count}:"
+            )
+            self.emit(
+                "    return P._execute(kwargs, finalize_output, max_stages, "
+                + "deadline, cancel, None, "
+                + "(0, [], P._initialize_output(), -1), shard=shard)"
+            )
+            self.emit(f"records = list({self.name(self.prefix.records)})")
+            self.emit(f"kwargs.update({self.name(self.prefix.exported)})")
+            self.emit("data = P._initialize_output()")
+            self.emit(f"stage_count = {self.prefix.count - 1}")
+        self.emit("lazy = _has_lazy(kwargs)")
+        if self.metrics:
+            self.emit("if shard is None:")
+            self.emit("    shard = METRICS.shard()")
+        body_start = len(self.lines)
+        if self.pipeline._loop and not self.groups and not any(
+            isinstance(s, Fork) for s in self.catalog.values()
+        ):
+            # linear loop (starting with the remainder of the first
+            # iteration after a prefix)
+            if self.start:
+                for index in range(self.start, len(self.stages)):
+                    self.component(index)
+            self.emit("while True:")
+            self.indent = self.indent + 1
+            for index in range(len(self.stages)):
+                self.component(index)
+        else:
+            self.trace()
+        # initialize status-variables
+        statuses = {} if self.prefix is None else self.prefix.statuses
+        self.lines[body_start:body_start] = [
+            f"    {var} = "
+            + (self.name(statuses[_s]) if _s in statuses else "None")
+            for _s, var in self.status_vars.items()
+        ]
+        return "\n".join(
+            [
+                "def execute(kwargs, finalize_output, max_stages, deadline, "
+                + "cancel, shared=None, max_steps=None, shard=None):"
+            ] + self.lines
+        ) + "\n"
+
+
+def generate_source(
+    pipeline: Any, layout: Optional[dict[int, int]] = None
+) -> tuple[str, dict[str, Any]]:
+    """
+    Returns pair of source code and namespace of a function `execute`
+    that is equivalent to `pipeline._execute`.
+
+    Keyword arguments:
+    pipeline -- `Pipeline` to be compiled
+    layout -- hot target positions by `Fork`-position
+              (default `None`)
+    """
+    generator = _Generator(pipeline, layout or {})
+    return generator.generate(), generator.namespace
+
+
+def compile_pipeline(
+    pipeline: Any, layout: Optional[dict[int, int]] = None
+) -> Callable[..., PipelineOutput]:
+    """
+    Returns a specialized replacement for `pipeline._execute`.
+
+    Keyword arguments:
+    pipeline -- `Pipeline` to be compiled
+    layout -- hot target positions by `Fork`-position
+              (default `None`)
+    """
+    if pipeline._loop and len(pipeline._pipeline) == 0:
+        return pipeline._execute
+    if pipeline._prefix is not None \
+            and pipeline._prefix.reason in ("status", "fork"):
+        # runs end within the prefix
+        return pipeline._execute
+    source, namespace = generate_source(pipeline, layout)
+    # copies of a Pipeline (e.g. FrozenPipelines) share its id
+    filename = f"<data-plumber pipeline {pipeline.id} #{next(_COUNTER)}>"
+    exec(compile(source, filename, "exec"), namespace)
+    # make generated source available in tracebacks (as long as the
+    # function exists)
+    linecache.cache[filename] = (
+        len(source), None, source.splitlines(True), filename
+    )
+    function = namespace["execute"]
+    finalize(function, linecache.cache.pop, filename, None)
+    return function
@@ -4,7 +4,35 @@
 This module defines data-plumber's custom exception types.
 """
 
+from typing import Optional
+
+from .output import PipelineOutput
+
 
 class PipelineError(Exception):
     """Raised on error during `Pipeline.run`."""
     pass
+
+
+class BudgetExceededError(PipelineError):
+    """
+    Raised if a `Pipeline.run` exhausts one of its execution budgets
+    (`max_stages`, `max_steps`, `deadline`, or `cancel`).
+
+    Properties:
+    reason -- name of the exhausted budget (one of "max_stages",
+              "max_steps", "deadline", or "cancel")
+    output -- partial `PipelineOutput` of the interrupted run (the
+              `Pipeline`'s `finalize_output` is not applied)
+    """
+
+    def __init__(
+        self, reason: str, output: Optional[PipelineOutput] = None
+    ) -> None:
+        self.reason = reason
+        self.output = output
+        super().__init__(
+            f"Pipeline execution interrupted: budget '{reason}' exhausted. "
+            + "Records until interruption: "
+            + f"{output.records if output is not None else None}"
+        )
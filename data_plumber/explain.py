@@ -0,0 +1,310 @@
+"""
+# data_plumber/explain.py
+
+This module defines `explain`, an analysis of a single `Pipeline.run`
+similar to SQL's `EXPLAIN ANALYZE` (see `Pipeline.explain`).
+"""
+
+from typing import Optional, Callable, Any
+import copy
+import sys
+from dataclasses import dataclass, field, asdict
+from functools import wraps
+from time import perf_counter
+
+from .context import PipelineContext
+from .fork import Fork
+from .hooks import Hooks
+from .output import PipelineOutput
+from .stage import Stage, _default_primer, _default_action, \
+    _default_export, _default_status, _default_message
+
+
+_DEFAULTS = (
+    _default_primer, _default_action, _default_export, _default_status,
+    _default_message
+)
+
+
+def deep_size(obj: Any) -> int:
+    """
+    Returns the approximate size of `obj` in bytes including the
+    contents of (nested) dictionaries, lists, tuples, and sets.
+    """
+    seen = set()
+    size = 0
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        size = size + sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+    return size
+
+
+@dataclass
+class CallableReport:
+    """
+    Measurement of a single call of a `Stage`- or `Fork`-`Callable`.
+
+    Keyword arguments:
+    time -- execution time in seconds
+    blocks -- net number of allocated memory blocks (as given by
+              `sys.getallocatedblocks`)
+    """
+    time: float
+    blocks: int
+
+
+@dataclass
+class ExplainStep:
+    """
+    Single step of an `Explanation`.
+
+    Keyword arguments:
+    index -- position in the `Pipeline`
+    id_ -- identifier of the `_PipelineComponent`
+    kind -- one of "stage", "skip" (requirements not met), "fork", or
+            "exit"
+    status -- status of an executed `Stage`
+              (default `None`)
+    message -- message of an executed `Stage`
+               (default `None`)
+    target -- position of the target of a `Fork` (`None` for exit)
+              (default `None`)
+    reasons -- unmet requirements of a skipped `Stage` or reason for
+               exiting ("end", "status", or "fork")
+               (default `[]`)
+    callables -- `CallableReport`s by name of (non-default) `Callable`s
+                 (default `{}`)
+    exported -- size of exported kwargs in bytes
+                (default `None`)
+    out -- size of the persistent data-object in bytes after a `Stage`
+           (default `None`)
+    """
+    index: int
+    id_: str
+    kind: str
+    status: Optional[int] = None
+    message: Optional[str] = None
+    target: Optional[int] = None
+    reasons: list[str] = field(default_factory=list)
+    callables: dict[str, CallableReport] = field(default_factory=dict)
+    exported: Optional[int] = None
+    out: Optional[int] = None
+
+    @property
+    def time(self) -> float:
+        """Returns total execution time of `callables` in seconds."""
+        return sum(c.time for c in self.callables.values())
+
+
+@dataclass
+class Explanation:
+    """
+    Result of `Pipeline.explain`: the steps of a `Pipeline.run` in order
+    of execution. Use `str(...)` for a readable report and `as_dict`
+    for structured data.
+
+    Keyword arguments:
+    steps -- list of `ExplainStep`s
+    output -- `PipelineOutput` of the run
+    time -- total time of the run in seconds (including
+            instrumentation)
+    """
+    steps: list[ExplainStep]
+    output: PipelineOutput
+    time: float
+
+    def as_dict(self) -> dict[str, Any]:
+        """
+        Returns `Explanation` as dictionary (without `output`; suited
+        for JSON-serialization).
+        """
+        return {
+            "time": self.time,
+            "steps": [
+                asdict(step) | {"time": step.time} for step in self.steps
+            ]
+        }
+
+    def __str__(self) -> str:
+        lines = [
+            f"EXPLAIN ANALYZE ({len(self.steps)} steps, "
+            + f"{self.time * 1000:.3f} ms)"
+        ]
+        for step in self.steps:
+            head = f"[{step.index}] {step.id_}"
+            if step.kind == "stage":
+                lines.append(
+                    f"{head}  status={step.status}  "
+                    + f"{step.time * 1000:.3f} ms  "
+                    + f"exported={step.exported} B  out={step.out} B"
+                )
+            elif step.kind == "skip":
+                lines.append(f"{head}  skipped: {'; '.join(step.reasons)}")
+            elif step.kind == "fork":
+                lines.append(
+                    f"{head}  fork -> "
+                    + ("exit" if step.target is None else str(step.target))
+                    + f"  {step.time * 1000:.3f} ms"
+                )
+            else:
+                lines.append(f"exit: {', '.join(step.reasons)}")
+            for name, report in step.callables.items():
+                lines.append(
+                    f"    {name:<8} {report.time * 1000:.3f} ms  "
+                    + f"{report.blocks:+d} blocks"
+                )
+        return "\n".join(lines)
+
+
+class _Collector:
+    """Collects `ExplainStep`s via `Hooks` and instrumented `Callable`s."""
+
+    def __init__(self, catalog: dict[str, Any]) -> None:
+        self.catalog = catalog
+        self.steps: list[ExplainStep] = []
+        # reports of Callables since the last step
+        self.pending: dict[str, CallableReport] = {}
+        self.exported: Optional[int] = None
+
+    def instrument(
+        self, function: Callable[..., Any], name: str
+    ) -> Callable[..., Any]:
+        if function in _DEFAULTS:
+            return function
+
+        @wraps(function)
+        def wrapped(**kwargs):
+            blocks = sys.getallocatedblocks()
+            start = perf_counter()
+            result = function(**kwargs)
+            self.pending[name] = CallableReport(
+                perf_counter() - start, sys.getallocatedblocks() - blocks
+            )
+            if name == "export":
+                self.exported = deep_size(result)
+            return result
+        return wrapped
+
+    def stage(self, s: Stage) -> Stage:
+        return Stage(
+            requires=s.requires,
+            primer=self.instrument(s.primer, "primer"),
+            action=self.instrument(s.action, "action"),
+            export=self.instrument(s.export, "export"),
+            status=self.instrument(s.status, "status"),
+            message=self.instrument(s.message, "message"),
+            commutative=s.commutative,
+            depends=s.depends,
+        )
+
+    def take(self) -> dict[str, CallableReport]:
+        pending, self.pending = self.pending, {}
+        return pending
+
+    # hooks
+    def before_stage(self, **kwargs) -> None:
+        self.pending = {}
+        self.exported = None
+
+    def after_stage(
+        self, index: int, stage: str, status: int, message: str,
+        context: PipelineContext, **kwargs
+    ) -> None:
+        self.steps.append(
+            ExplainStep(
+                index, stage, "stage", status=status, message=message,
+                callables=self.take(), exported=self.exported or 0,
+                out=deep_size(context.out)
+            )
+        )
+
+    def on_fork(
+        self, index: int, fork: str, target: Optional[int], **kwargs
+    ) -> None:
+        self.steps.append(
+            ExplainStep(
+                index, fork, "fork", target=target, callables=self.take()
+            )
+        )
+
+    def on_requirement_skip(
+        self, index: int, stage: str, context: PipelineContext, **kwargs
+    ) -> None:
+        self.steps.append(
+            ExplainStep(
+                index, stage, "skip",
+                reasons=self.unmet(self.catalog[stage], context)
+            )
+        )
+
+    def on_exit(self, index: int, reason: str, **kwargs) -> None:
+        self.steps.append(ExplainStep(index, "", "exit", reasons=[reason]))
+
+    @staticmethod
+    def unmet(s: Stage, context: PipelineContext) -> list[str]:
+        # describe unmet requirements (see Pipeline._meets_requirements)
+        reasons = []
+        for ref, req in (s.requires or {}).items():
+            target = ref.get(context).stage
+            status = next(
+                (r.status for r in reversed(context.records)
+                    if r.id_ == target),
+                None
+            )
+            if callable(req):
+                if not req(status=status):
+                    reasons.append(
+                        f"'{target}' has status {status} (requires "
+                        + f"{getattr(req, '__name__', repr(req))})"
+                    )
+            elif status != req:
+                reasons.append(
+                    f"'{target}' has status {status} (requires {req})"
+                )
+        return reasons
+
+
+def explain(pipeline: Any, **kwargs) -> Explanation:
+    """
+    Execute `pipeline` once with `kwargs` (using the generic execution
+    loop) and return an `Explanation` (see `Pipeline.explain`).
+    """
+    collector = _Collector(pipeline._stage_catalog)
+    catalog: dict[str, Any] = {}
+    for _s, s in pipeline._stage_catalog.items():
+        if isinstance(s, Stage):
+            catalog[_s] = collector.stage(s)
+        elif type(s) is Fork:
+            catalog[_s] = Fork(
+                collector.instrument(s.fork, "fork"), s.depends
+            )
+        else:
+            catalog[_s] = s
+    # shallow copy that shares everything but catalog and instruments
+    shadow = copy.copy(pipeline)
+    shadow._stage_catalog = catalog
+    shadow._compiled = None
+    shadow._profile = None
+    shadow._history = None
+    shadow._metrics = None
+    shadow._capture = None
+    shadow._scheduler = copy.deepcopy(pipeline._scheduler)
+    shadow._hooks = Hooks(
+        before_stage=collector.before_stage,
+        after_stage=collector.after_stage,
+        on_fork=collector.on_fork,
+        on_requirement_skip=collector.on_requirement_skip,
+        on_exit=collector.on_exit,
+    )
+    start = perf_counter()
+    output = shadow._run(kwargs, engine=shadow._execute)
+    return Explanation(collector.steps, output, perf_counter() - start)
@@ -5,7 +5,7 @@ This module defines the `Fork`-class which enables more complex flows
 in a `Pipeline.run`.
 """
 
-from typing import Callable, Optional
+from typing import Callable, Optional, Iterable
 
 from .component import _PipelineComponent
 from .context import PipelineContext
@@ -43,13 +43,20 @@ class Fork(_PipelineComponent):
     fork -- callable that returns a reference to a `Stage` as (StageRef
             | str | int)
             (kwargs: `out`, `count`)
+    depends -- names of the kwargs that `fork` depends on exclusively
+               (neither on `out`, `count`, and `records` nor on other
+               kwargs); if all of them are given to
+               `Pipeline.specialize`, `fork` is evaluated ahead of time
+               (default `None`; undeclared)
     """
 
     def __init__(
         self,
-        fork: Callable[..., Optional[StageRef | str | int]]
+        fork: Callable[..., Optional[StageRef | str | int]],
+        depends: Optional[Iterable[str]] = None
     ) -> None:
         self._fork = fork
+        self._depends = None if depends is None else frozenset(depends)
         super().__init__()
 
     def eval(self, context: PipelineContext) -> Optional[StageRef]:
@@ -61,13 +68,17 @@ class Fork(_PipelineComponent):
         context -- `Pipeline` execution context
         """
 
-        result = self._fork(
-            **context.kwargs,
-            out=context.out,
-            count=context.count,
-            records=context.records
+        return self._to_ref(
+            self._fork(
+                **context.kwargs,
+                out=context.out,
+                count=context.count,
+                records=context.records
+            )
         )
 
+    @staticmethod
+    def _to_ref(result: Optional[StageRef | str | int]) -> Optional[StageRef]:
         # replace int or string by corresponding StageRef.
         if isinstance(result, str):
             return StageById(result)
@@ -75,3 +86,16 @@ class Fork(_PipelineComponent):
             return StageByIncrement(result)
         # otherwise it is either a StageRef already or None
         return result
+
+    @property
+    def fork(self) -> Callable[..., Optional[StageRef | str | int]]:
+        """Returns a `Fork`'s conditional `Callable`."""
+        return self._fork
+
+    @property
+    def depends(self) -> Optional[frozenset[str]]:
+        """
+        Returns names of the kwargs that the `Fork` is declared to
+        depend on (`None` if undeclared).
+        """
+        return self._depends
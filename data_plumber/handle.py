@@ -0,0 +1,186 @@
+"""
+# data_plumber/handle.py
+
+This module defines the `PipelineHandle`-class, a reference to the
+current version of a `Pipeline` that can be replaced atomically while
+the `Pipeline` is being run.
+"""
+
+from typing import Optional, Callable, Any, Iterable, Iterator, Mapping
+from concurrent.futures import Future
+from threading import Lock, Thread
+
+from .output import PipelineOutput
+from .pipeline import Pipeline, FrozenPipeline
+
+
+def _thaw(frozen: FrozenPipeline) -> Pipeline:
+    # mutable copy of a FrozenPipeline that shares its configuration
+    # (Resources, profile, metrics, ...) and id
+    pipeline = Pipeline.__new__(Pipeline)
+    pipeline.__dict__.update(frozen.__dict__)
+    del pipeline._layout, pipeline._engine  # type: ignore[attr-defined]
+    pipeline._pipeline = list(frozen._pipeline)
+    pipeline._stage_catalog = dict(frozen._stage_catalog)
+    pipeline._compiled = None
+    pipeline._groups = None
+    return pipeline
+
+
+class PipelineHandle:
+    """
+    A `PipelineHandle` holds the current version of a `Pipeline` as
+    `FrozenPipeline` and allows to replace it atomically while other
+    threads run it (read-copy-update): `PipelineHandle.run` reads the
+    current version once, i.e. runs that are in flight finish on the
+    version they started with. A new version is frozen (which includes
+    generating its code, see `Pipeline.freeze`) and optionally warmed up
+    with sample inputs before it is published, so that the switch does
+    not cause a latency spike. Readers do not acquire locks; publishing
+    is serialized.
+
+    Use `PipelineHandle.update` for changes to the current definition
+    (the modified copy shares `Resource`s, `PipelineProfile`, metrics,
+    etc. with the current version) and `PipelineHandle.publish` for
+    entirely new `Pipeline`s. `Resource`s of replaced `Pipeline`s are
+    not closed automatically.
+
+    Example usage:
+     >>> from data_plumber import Pipeline, Stage, PipelineHandle
+     >>> handle = PipelineHandle(Pipeline(...), warmup=[{...}])
+     >>> handle.run(...)  # on many threads
+     >>> handle.update(lambda p: p.append(Stage(...)))  # on reload
+     2
+     >>> handle.publish(Pipeline(...), background=True)
+     <Future at ... state=pending>
+
+    Keyword arguments:
+    pipeline -- initial `Pipeline`
+    warmup -- kwargs of runs that are executed with a new version before
+              it is published (these runs are recorded like regular
+              runs, e.g. in a `RunHistory`)
+              (default `None`)
+    """
+
+    def __init__(
+        self,
+        pipeline: Pipeline,
+        warmup: Optional[Iterable[Mapping[str, Any]]] = None,
+    ) -> None:
+        self._warmup = [dict(kwargs) for kwargs in (warmup or [])]
+        self._lock = Lock()
+        self._version = 1
+        self._current = self._prepare(pipeline, self._warmup)
+
+    @staticmethod
+    def _prepare(
+        pipeline: Pipeline, warmup: list[dict[str, Any]]
+    ) -> FrozenPipeline:
+        frozen = pipeline.freeze()
+        for kwargs in warmup:
+            frozen.run(**kwargs)
+        return frozen
+
+    @property
+    def current(self) -> FrozenPipeline:
+        """Returns the current version of the `Pipeline`."""
+        return self._current
+
+    @property
+    def version(self) -> int:
+        """Returns the number of the current version (starting at 1)."""
+        return self._version
+
+    def run(self, **kwargs) -> PipelineOutput:
+        """Run the current version (see `Pipeline.run`)."""
+        return self._current.run(**kwargs)
+
+    def run_many(
+        self, inputs: Iterable[Mapping[str, Any]], **kwargs
+    ) -> Iterator[PipelineOutput]:
+        """
+        Run the current version (at the time of the call) for all
+        `inputs` (see `Pipeline.run_many`).
+        """
+        return self._current.run_many(inputs, **kwargs)
+
+    def _publish(
+        self,
+        pipeline: Pipeline | Callable[[Pipeline], Any],
+        warmup: Optional[Iterable[Mapping[str, Any]]],
+    ) -> int:
+        warmup = self._warmup if warmup is None \
+            else [dict(kwargs) for kwargs in warmup]
+        with self._lock:
+            if not isinstance(pipeline, Pipeline):
+                # read-copy-update of the current version
+                draft = _thaw(self._current)
+                pipeline(draft)
+                pipeline = draft
+            frozen = self._prepare(pipeline, warmup)
+            # single reference assignment; runs that already read the
+            # previous version keep using it
+            self._current = frozen
+            self._version = self._version + 1
+            return self._version
+
+    def _submit(
+        self,
+        pipeline: Pipeline | Callable[[Pipeline], Any],
+        warmup: Optional[Iterable[Mapping[str, Any]]],
+        background: bool,
+    ) -> int | Future:
+        if not background:
+            return self._publish(pipeline, warmup)
+        future: Future = Future()
+
+        def target():
+            try:
+                future.set_result(self._publish(pipeline, warmup))
+            except BaseException as exception:
+                future.set_exception(exception)
+        Thread(target=target, daemon=True).start()
+        return future
+
+    def publish(
+        self,
+        pipeline: Pipeline,
+        warmup: Optional[Iterable[Mapping[str, Any]]] = None,
+        background: bool = False,
+    ) -> int | Future:
+        """
+        Freeze and warm up `pipeline` and publish it as the new current
+        version. Returns the new version number (or a `Future` of it if
+        `background`).
+
+        Keyword arguments:
+        pipeline -- new `Pipeline`
+        warmup -- kwargs of warm-up runs
+                  (default `None`; use `warmup` given to the constructor)
+        background -- if `True`, preparation and publishing happen in a
+                      separate thread
+                      (default `False`)
+        """
+        return self._submit(pipeline, warmup, background)
+
+    def update(
+        self,
+        function: Callable[[Pipeline], Any],
+        warmup: Optional[Iterable[Mapping[str, Any]]] = None,
+        background: bool = False,
+    ) -> int | Future:
+        """
+        Apply `function` to a mutable copy of the current version (e.g.
+        `lambda p: p.insert(1, Stage(...))`) and publish the result (see
+        `PipelineHandle.publish`). The copy shares `Resource`s,
+        `PipelineProfile`, metrics, `Hooks`, etc. as well as the
+        `Pipeline.id` with the current version.
+
+        Keyword arguments:
+        function -- `Callable` that modifies the given `Pipeline`
+        warmup -- see `PipelineHandle.publish`
+                  (default `None`)
+        background -- see `PipelineHandle.publish`
+                      (default `False`)
+        """
+        return self._submit(function, warmup, background)
@@ -0,0 +1,370 @@
+"""
+# data_plumber/history.py
+
+This module defines the `RunHistory`-class, a persistent (SQLite-based)
+store of the `StageRecord`s of `Pipeline.run`s.
+"""
+
+from typing import Optional, Any
+import sqlite3
+import zlib
+from collections import deque
+from dataclasses import dataclass
+from pathlib import Path
+from threading import Event, Lock, Thread
+from time import time
+
+from .output import StageRecord, PipelineOutput
+
+
+# messages of at least this length are stored compressed
+COMPRESS_MIN_LENGTH = 64
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY, pipeline TEXT, time REAL, last_status INTEGER
+);
+CREATE TABLE IF NOT EXISTS records (
+    run INTEGER, position INTEGER, stage_index INTEGER, stage TEXT,
+    status INTEGER, message
+);
+CREATE INDEX IF NOT EXISTS runs_time ON runs (time);
+CREATE INDEX IF NOT EXISTS runs_pipeline ON runs (pipeline, time);
+CREATE INDEX IF NOT EXISTS records_stage ON records (stage, status, run);
+CREATE INDEX IF NOT EXISTS records_run ON records (run, position);
+"""
+
+
+def _compress(message: Any) -> Optional[str | bytes]:
+    # messages that are not strings are converted (`None` is kept)
+    if message is None:
+        return None
+    if not isinstance(message, str):
+        message = str(message)
+    if len(message) < COMPRESS_MIN_LENGTH:
+        return message
+    return zlib.compress(message.encode("utf-8"))
+
+
+def _decompress(message: Optional[str | bytes]) -> Optional[str]:
+    if isinstance(message, bytes):
+        return zlib.decompress(message).decode("utf-8")
+    return message
+
+
+@dataclass
+class HistoryRun:
+    """
+    Entry of a `RunHistory`.
+
+    Keyword arguments:
+    id_ -- run identifier (in `RunHistory`)
+    pipeline -- `Pipeline.id`
+    time -- time of the end of the run (seconds since the epoch)
+    records -- list of `StageRecord`s
+    """
+    id_: int
+    pipeline: str
+    time: float
+    records: list[StageRecord]
+
+    @property
+    def last_status(self) -> Optional[int]:
+        """Returns the last `Stage`'s status result."""
+        return self.records[-1].status if self.records else None
+
+
+class RunHistory:
+    """
+    A `RunHistory` stores the `StageRecord`s of all (completed) runs of
+    the `Pipeline`s it is given to in an SQLite-database. Runs are only
+    queued when they complete; a writer thread appends them in batches
+    (every `interval` seconds or once `batch_size` runs are pending).
+    Tables are indexed by `Stage` identifier, status, time, and
+    `Pipeline.id`; longer messages are stored compressed (messages that
+    are not strings are converted). If a batch of runs cannot be
+    written, it is set aside (see `RunHistory.discard_failed`) such that
+    later runs are still written. Multiple processes can write to the
+    same database (with their own `RunHistory`); a `RunHistory` itself
+    cannot be pickled.
+
+    Example usage:
+     >>> from data_plumber import Pipeline, RunHistory
+     >>> history = RunHistory("history.db")
+     >>> p = Pipeline(..., history=history)
+     >>> p.run(...)
+     >>> history.runs(stage="validate", status=1, since=time() - 86400)
+     [HistoryRun(...), ...]
+
+    Keyword arguments:
+    path -- path to the database file
+    batch_size -- number of pending runs that triggers a write
+                  (default 1000)
+    interval -- maximum time in seconds between writes
+                (default 1.0)
+    """
+
+    def __init__(
+        self,
+        path: str | Path,
+        batch_size: int = 1000,
+        interval: float = 1.0,
+    ) -> None:
+        self._path = str(path)
+        self._batch_size = batch_size
+        self._interval = interval
+        # pending runs as (pipeline, time, records)
+        self._pending: deque = deque()
+        self._lock = Lock()
+        # transactions are handled explicitly; access is serialized by
+        # the lock
+        self._connection = sqlite3.connect(
+            self._path, check_same_thread=False, isolation_level=None
+        )
+        with self._lock:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.executescript(_SCHEMA)
+        self._wake = Event()
+        self._closed = False
+        # first error of writing runs and runs that could not be written
+        self._error: Optional[Exception] = None
+        self._failed: list[tuple[str, float, tuple[StageRecord, ...]]] = []
+        self._thread = Thread(target=self._work, daemon=True)
+        self._thread.start()
+
+    @property
+    def path(self) -> str:
+        """Returns the path of the database file."""
+        return self._path
+
+    def record(self, pipeline: str, output: PipelineOutput) -> None:
+        """
+        Queue the records of a run (called by `Pipeline`).
+
+        Keyword arguments:
+        pipeline -- `Pipeline.id`
+        output -- `PipelineOutput` of the run
+        """
+        self._pending.append((pipeline, time(), tuple(output.records)))
+        if len(self._pending) >= self._batch_size:
+            self._wake.set()
+
+    def _work(self) -> None:
+        while not self._closed:
+            self._wake.wait(self._interval)
+            self._wake.clear()
+            self._write()
+
+    def _write(self) -> None:
+        with self._lock:
+            if not self._pending:
+                return
+            runs = []
+            while self._pending:
+                runs.append(self._pending.popleft())
+            try:
+                # lock database before assigning run ids
+                self._connection.execute("BEGIN IMMEDIATE")
+                (last_id,) = self._connection.execute(
+                    "SELECT COALESCE(MAX(id), 0) FROM runs"
+                ).fetchone()
+                self._connection.executemany(
+                    "INSERT INTO runs VALUES (?, ?, ?, ?)",
+                    [
+                        (
+                            last_id + i, pipeline, time_,
+                            records[-1].status if records else None
+                        )
+                        for i, (pipeline, time_, records)
+                        in enumerate(runs, start=1)
+                    ]
+                )
+                self._connection.executemany(
+                    "INSERT INTO records VALUES (?, ?, ?, ?, ?, ?)",
+                    [
+                        (
+                            last_id + i, position, r.index, r.id_, r.status,
+                            _compress(r.message)
+                        )
+                        for i, (_, _, records) in enumerate(runs, start=1)
+                        for position, r in enumerate(records)
+                    ]
+                )
+                self._connection.execute("COMMIT")
+            except Exception as exc:  # pylint: disable=broad-except
+                if self._connection.in_transaction:
+                    self._connection.execute("ROLLBACK")
+                # set runs aside (retrying them would block later runs)
+                self._failed.extend(runs)
+                if self._error is None:
+                    self._error = exc
+
+    def flush(self) -> None:
+        """
+        Write all pending runs. If runs could not be written (here or on
+        the writer thread), the first error is raised until it is
+        handled with `RunHistory.discard_failed`.
+        """
+        self._write()
+        if self._error is not None:
+            raise self._error
+
+    def discard_failed(
+        self
+    ) -> list[tuple[str, float, tuple[StageRecord, ...]]]:
+        """
+        Returns the runs that could not be written (as triples of
+        `Pipeline.id`, time, and `StageRecord`s), removes them, and
+        resets the error that is raised by `RunHistory.flush`.
+        """
+        with self._lock:
+            failed, self._failed = self._failed, []
+            self._error = None
+        return failed
+
+    @staticmethod
+    def _filter(
+        pipeline: Optional[str],
+        stage: Optional[str],
+        status: Optional[int],
+        since: Optional[float],
+        until: Optional[float],
+        by_run: bool,
+    ) -> tuple[str, list[Any]]:
+        # returns pair of WHERE-clause and parameters; if `by_run`, the
+        # conditions for stage and status select runs with at least one
+        # matching record (otherwise they apply to records directly)
+        conditions = []
+        parameters: list[Any] = []
+        if pipeline is not None:
+            conditions.append("runs.pipeline = ?")
+            parameters.append(pipeline)
+        if since is not None:
+            conditions.append("runs.time >= ?")
+            parameters.append(since)
+        if until is not None:
+            conditions.append("runs.time < ?")
+            parameters.append(until)
+        record_conditions = []
+        if stage is not None:
+            record_conditions.append("records.stage = ?")
+            parameters.append(stage)
+        if status is not None:
+            record_conditions.append("records.status = ?")
+            parameters.append(status)
+        if by_run and record_conditions:
+            conditions.append(
+                "runs.id IN (SELECT run FROM records WHERE "
+                + " AND ".join(record_conditions) + ")"
+            )
+        else:
+            conditions.extend(record_conditions)
+        if not conditions:
+            return "", parameters
+        return " WHERE " + " AND ".join(conditions), parameters
+
+    def runs(
+        self,
+        pipeline: Optional[str] = None,
+        stage: Optional[str] = None,
+        status: Optional[int] = None,
+        since: Optional[float] = None,
+        until: Optional[float] = None,
+        limit: Optional[int] = None,
+    ) -> list[HistoryRun]:
+        """
+        Returns list of runs (in order of completion) that match all of
+        the given criteria (pending runs are written first).
+
+        Keyword arguments:
+        pipeline -- `Pipeline.id`
+                    (default `None`)
+        stage -- identifier of a `Stage` that has been executed
+                 (default `None`)
+        status -- status of a `StageRecord` (of `stage`, if given)
+                  (default `None`)
+        since -- minimum time (seconds since the epoch)
+                 (default `None`)
+        until -- maximum time (exclusive; seconds since the epoch)
+                 (default `None`)
+        limit -- maximum number of runs
+                 (default `None`)
+        """
+        self._write()
+        where, parameters = self._filter(
+            pipeline, stage, status, since, until, True
+        )
+        query = f"SELECT id, pipeline, time FROM runs{where} ORDER BY id"
+        if limit is not None:
+            query = query + " LIMIT ?"
+            parameters.append(limit)
+        with self._lock:
+            runs = {
+                id_: HistoryRun(id_, pipeline_, time_, [])
+                for id_, pipeline_, time_ in self._connection.execute(
+                    query, parameters
+                )
+            }
+            for run, index, id_, status_, message in self._connection.execute(
+                "SELECT run, stage_index, stage, status, message FROM records "
+                + f"WHERE run IN ({query.replace('id, pipeline, time', 'id')})"
+                + " ORDER BY run, position",
+                parameters
+            ):
+                runs[run].records.append(
+                    StageRecord(index, id_, _decompress(message), status_)
+                )
+        return list(runs.values())
+
+    def records(
+        self,
+        pipeline: Optional[str] = None,
+        stage: Optional[str] = None,
+        status: Optional[int] = None,
+        since: Optional[float] = None,
+        until: Optional[float] = None,
+        limit: Optional[int] = None,
+    ) -> list[StageRecord]:
+        """
+        Returns list of `StageRecord`s (in order of runs) that match all
+        of the given criteria (see `RunHistory.runs`; here, `stage` and
+        `status` apply to the `StageRecord`s themselves).
+        """
+        self._write()
+        where, parameters = self._filter(
+            pipeline, stage, status, since, until, False
+        )
+        query = (
+            "SELECT records.stage_index, records.stage, records.message, "
+            + "records.status FROM records JOIN runs ON runs.id = records.run"
+            + f"{where} ORDER BY records.run, records.position"
+        )
+        if limit is not None:
+            query = query + " LIMIT ?"
+            parameters.append(limit)
+        with self._lock:
+            return [
+                StageRecord(index, id_, _decompress(message), status_)
+                for index, id_, message, status_ in self._connection.execute(
+                    query, parameters
+                )
+            ]
+
+    def close(self) -> None:
+        """Write pending runs and close database."""
+        if self._closed:
+            return
+        self._closed = True
+        self._wake.set()
+        self._thread.join()
+        try:
+            self.flush()
+        finally:
+            with self._lock:
+                self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,148 @@
+"""
+# data_plumber/hooks.py
+
+This module defines the `Hooks`-class, a registry of callbacks that are
+invoked on events during `Pipeline.run`s (e.g. for tracing or
+auditing).
+"""
+
+from typing import Optional, Callable, Any, Iterable
+
+from .lazy import parameters
+
+
+# event -> names of keyword arguments passed to callbacks (besides the
+# optional `context`)
+EVENTS: dict[str, tuple[str, ...]] = {
+    "before_stage": ("index", "stage"),
+    "after_stage": ("index", "stage", "status", "message"),
+    "on_fork": ("index", "fork", "target"),
+    "on_requirement_skip": ("index", "stage"),
+    "on_exit": ("index", "reason"),
+    "on_finalize": ("output",),
+}
+
+
+def wants_context(callback: Callable[..., Any]) -> bool:
+    """
+    Returns `True` if `callback` declares the argument `context`
+    explicitly.
+    """
+    return "context" in parameters(callback)
+
+
+class _Dispatcher:
+    """Callbacks of a single event (internal use)."""
+
+    __slots__ = ("callbacks", "context")
+
+    def __init__(self, callbacks: tuple[Callable[..., Any], ...]) -> None:
+        # pairs of callback and whether it wants a context
+        self.callbacks = tuple((c, wants_context(c)) for c in callbacks)
+        # whether a PipelineContext has to be built
+        self.context = any(wants for _, wants in self.callbacks)
+
+    def __call__(self, context: Any, **arguments: Any) -> None:
+        for callback, wants in self.callbacks:
+            if wants:
+                callback(context=context, **arguments)
+            else:
+                callback(**arguments)
+
+
+class Hooks:
+    """
+    A `Hooks`-object holds callbacks for the following events of the
+    `Pipeline.run`s of the `Pipeline`s it is given to. Callbacks are
+    called with keyword arguments (they should accept `**kwargs`):
+    * **before_stage**: before a `Stage` is executed (`index` and
+      `stage` identifier)
+    * **after_stage**: after a `Stage` has been executed (`index`,
+      `stage`, `status`, and `message`)
+    * **on_fork**: after a `Fork` has been evaluated (`index`, `fork`
+      identifier, and `target` position or `None` for exiting)
+    * **on_requirement_skip**: if a `Stage` is skipped due to unmet
+      requirements (`index` and `stage`)
+    * **on_exit**: when the execution stops (`index` and `reason`, one of
+      "end", "status", or "fork")
+    * **on_finalize**: after `finalize_output` (`output`, i.e. the
+      `PipelineOutput`)
+
+    Callbacks that declare the argument `context` explicitly receive a
+    `PipelineContext` (except for `on_finalize`); it is only built if
+    requested. If no callbacks are registered, hooks cause no overhead
+    in compiled `Pipeline`s (see `Pipeline.compile`).
+
+    Example usage:
+     >>> from data_plumber import Pipeline, Hooks
+     >>> hooks = Hooks(after_stage=lambda stage, status, **kwargs: ...)
+     >>> Pipeline(..., hooks=hooks).run(...)
+
+    Keyword arguments:
+    kwargs -- initial callbacks (or iterables of callbacks) by event
+    """
+
+    def __init__(
+        self, **kwargs: Callable[..., Any] | Iterable[Callable[..., Any]]
+    ) -> None:
+        self._callbacks: dict[str, list[Callable[..., Any]]] = {
+            event: [] for event in EVENTS
+        }
+        # counter for changes (invalidates compiled Pipelines)
+        self._version = 0
+        self._dispatchers: dict[str, Optional[_Dispatcher]] = {}
+        self._update()
+        for event, callbacks in kwargs.items():
+            if callable(callbacks):
+                callbacks = [callbacks]
+            for callback in callbacks:
+                self.add(event, callback)
+
+    def _update(self) -> None:
+        self._version = self._version + 1
+        self._dispatchers = {
+            event: (_Dispatcher(tuple(callbacks)) if callbacks else None)
+            for event, callbacks in self._callbacks.items()
+        }
+
+    def _check(self, event: str) -> None:
+        if event not in EVENTS:
+            raise ValueError(
+                f"Unknown event '{event}' (available events: "
+                + f"{', '.join(EVENTS)})."
+            )
+
+    @property
+    def version(self) -> int:
+        """Returns the number of changes to the registered callbacks."""
+        return self._version
+
+    def callbacks(self, event: str) -> list[Callable[..., Any]]:
+        """Returns a copy of the list of callbacks for `event`."""
+        self._check(event)
+        return self._callbacks[event].copy()
+
+    def dispatcher(self, event: str) -> Optional[_Dispatcher]:
+        """
+        Returns dispatcher for `event` (or `None` if there are no
+        callbacks).
+        """
+        return self._dispatchers[event]
+
+    def add(
+        self, event: str, callback: Callable[..., Any]
+    ) -> Callable[..., Any]:
+        """Register `callback` for `event`. Returns `callback`."""
+        self._check(event)
+        self._callbacks[event].append(callback)
+        self._update()
+        return callback
+
+    def remove(self, event: str, callback: Callable[..., Any]) -> None:
+        """Remove `callback` from the callbacks for `event`."""
+        self._check(event)
+        self._callbacks[event].remove(callback)
+        self._update()
+
+    def __bool__(self) -> bool:
+        return any(self._callbacks.values())
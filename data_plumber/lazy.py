@@ -0,0 +1,91 @@
+"""
+# data_plumber/lazy.py
+
+This module defines the `Lazy`-class, a wrapper for kwargs of a
+`Pipeline.run` that are only computed when needed.
+"""
+
+from typing import Callable, Any, Mapping
+from functools import lru_cache
+from inspect import signature, Parameter
+
+
+class Lazy:
+    """
+    A `Lazy` wraps a `Callable` without arguments that computes the
+    value of a kwarg of a `Pipeline.run` (either given as argument or
+    exported by a `Stage`). The value is computed at most once per run
+    and only if a `Stage`- or `Fork`-`Callable` that is about to be
+    executed declares the corresponding argument explicitly in its
+    signature; afterwards, the kwarg is replaced by its value for the
+    remainder of that run. `Callable`s that only accept the kwarg via
+    `**kwargs` receive the `Lazy` itself (which can be called to get
+    the value).
+
+    Example usage:
+     >>> from data_plumber import Pipeline, Stage, Lazy
+     >>> Pipeline(
+             Stage(status=lambda token, **kwargs: ...),
+             Stage(status=lambda body, **kwargs: ...),
+         ).run(
+             token=Lazy(lambda: decode(raw_token)),
+             body=Lazy(lambda: json.loads(raw_body)),
+         )
+
+    Keyword arguments:
+    factory -- `Callable` without arguments that returns the value
+    """
+
+    def __init__(self, factory: Callable[[], Any]) -> None:
+        self._factory = factory
+
+    @property
+    def factory(self) -> Callable[[], Any]:
+        """Returns a `Lazy`'s `factory` callable."""
+        return self._factory
+
+    def __call__(self) -> Any:
+        return self._factory()
+
+    def __repr__(self) -> str:
+        return f"Lazy({self._factory!r})"
+
+
+def _parameters(function: Callable[..., Any]) -> tuple[str, ...]:
+    try:
+        parameters = signature(function).parameters.values()
+    except (TypeError, ValueError):  # e.g. some builtins
+        return ()
+    return tuple(
+        p.name for p in parameters
+        if p.kind in (Parameter.POSITIONAL_OR_KEYWORD, Parameter.KEYWORD_ONLY)
+    )
+
+
+_cached_parameters = lru_cache(maxsize=1024)(_parameters)
+
+
+def parameters(function: Callable[..., Any]) -> tuple[str, ...]:
+    """
+    Returns the names of the parameters that `function` declares
+    explicitly (i.e. that can be passed as keyword arguments).
+    """
+    try:
+        return _cached_parameters(function)
+    except TypeError:  # unhashable
+        return _parameters(function)
+
+
+def has_lazy(kwargs: Mapping[str, Any]) -> bool:
+    """Returns `True` if any value in `kwargs` is `Lazy`."""
+    return any(isinstance(v, Lazy) for v in kwargs.values())
+
+
+def resolve(function: Callable[..., Any], kwargs: dict[str, Any]) -> None:
+    """
+    Replace `Lazy` values in `kwargs` by their values (in place) if
+    `function` declares the corresponding argument.
+    """
+    for name in parameters(function):
+        if isinstance(value := kwargs.get(name), Lazy):
+            kwargs[name] = value()
@@ -0,0 +1,217 @@
+"""
+# data_plumber/memory.py
+
+This module defines the `MemoryProfile`-class, a collection of memory
+statistics (based on `tracemalloc`) of the `Stage`s in `Pipeline.run`s.
+"""
+
+import tracemalloc
+from array import array
+from dataclasses import dataclass, field
+from threading import Lock
+
+
+class _Ring:
+    """
+    Fixed-size buffer of the latest integers (no allocations when
+    appending, so that recording does not distort measurements).
+    """
+
+    def __init__(self, size: int) -> None:
+        self.values = array("q", bytes(8 * size))
+        self.size = size
+        self.count = 0
+
+    def append(self, value: int) -> None:
+        self.values[self.count % self.size] = value
+        self.count = self.count + 1
+
+    def latest(self) -> list[int]:
+        """Returns values in order of appending."""
+        if self.count <= self.size:
+            return self.values[:self.count].tolist()
+        start = self.count % self.size
+        return (self.values[start:] + self.values[:start]).tolist()
+
+
+@dataclass
+class StageMemory:
+    """
+    Memory statistics of a single `Stage` (see `MemoryProfile`).
+
+    Keyword arguments:
+    runs -- number of recorded executions
+    net -- total net allocated bytes (allocated minus freed during the
+           executions)
+    peak -- maximum peak of allocated bytes during an execution
+            (relative to the start of that execution)
+    history -- net allocated bytes of the latest executions
+    """
+    runs: int = 0
+    net: int = 0
+    peak: int = 0
+    history: list[int] = field(default_factory=list)
+
+    @property
+    def mean(self) -> float:
+        """Returns mean net allocated bytes per execution."""
+        return self.net / self.runs if self.runs else 0.0
+
+
+class MemoryProfile:
+    """
+    A `MemoryProfile` records the net allocated bytes and the peak of
+    allocated bytes of every `Stage`-execution (i.e. of its
+    `Callable`s) in the `Pipeline.run`s of the `Pipeline`s it is given
+    to. Measurements are based on `tracemalloc`, which is started on
+    first use if it is not already tracing (tracing slows down
+    allocations considerably; stop it with `tracemalloc.stop()`). Since
+    `tracemalloc` is process-wide, measurements of concurrent runs on
+    multiple threads include each other's allocations.
+
+    In addition, the allocated bytes at the start of every run are
+    recorded in order to detect steady growth of retained memory (see
+    `MemoryProfile.growing`).
+
+    Example usage:
+     >>> from data_plumber import Pipeline, MemoryProfile
+     >>> memory = MemoryProfile()
+     >>> p = Pipeline(..., memory=memory)
+     >>> for kwargs in inputs:
+             p.run(**kwargs)
+     >>> memory.stages["parse"].mean, memory.growing()
+     (1024.0, ['parse'])
+
+    Keyword arguments:
+    window -- number of latest runs that are considered by
+              `MemoryProfile.growing`
+              (default 100)
+    """
+
+    def __init__(self, window: int = 100) -> None:
+        self._lock = Lock()
+        self._window = window
+        # stage id -> [runs, net, peak, history]
+        self._stages: dict[str, list] = {}
+        # allocated bytes at the start of the latest runs
+        self._baselines = _Ring(window)
+
+    @property
+    def window(self) -> int:
+        """Returns the number of runs considered by `growing`."""
+        return self._window
+
+    # the following methods are called by Pipeline
+    def start_run(self) -> None:
+        """Record allocated bytes at the start of a run."""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        current, _ = tracemalloc.get_traced_memory()
+        with self._lock:
+            self._baselines.append(current)
+
+    @staticmethod
+    def start_stage() -> int:
+        """Returns allocated bytes at the start of a `Stage`."""
+        tracemalloc.reset_peak()
+        return tracemalloc.get_traced_memory()[0]
+
+    def record_stage(self, stage_id: str, start: int) -> None:
+        """
+        Record execution of a `Stage`.
+
+        Keyword arguments:
+        stage_id -- `Stage` identifier
+        start -- allocated bytes at the start of the `Stage` (see
+                 `MemoryProfile.start_stage`)
+        """
+        current, peak = tracemalloc.get_traced_memory()
+        with self._lock:
+            if (stage := self._stages.get(stage_id)) is None:
+                stage = self._stages[stage_id] = [
+                    0, 0, 0, _Ring(self._window)
+                ]
+            stage[0] = stage[0] + 1
+            stage[1] = stage[1] + current - start
+            stage[2] = max(stage[2], peak - start)
+            stage[3].append(current - start)
+
+    @property
+    def stages(self) -> dict[str, StageMemory]:
+        """
+        Returns a copy of the recorded statistics as dictionary of
+        `StageMemory` by `Stage`-identifier.
+        """
+        with self._lock:
+            return {
+                stage_id: StageMemory(runs, net, peak, history.latest())
+                for stage_id, (runs, net, peak, history)
+                in self._stages.items()
+            }
+
+    def growing(self, min_runs: int = 10, ratio: float = 0.9) -> list[str]:
+        """
+        Returns identifiers of `Stage`s that are likely responsible for
+        a steady growth of retained memory: if the allocated bytes at
+        the start of runs increased from run to run for (at least) the
+        given `ratio` of the latest `window` runs, these are all
+        `Stage`s whose net allocated bytes were positive in (at least)
+        the given `ratio` of their latest executions.
+
+        Keyword arguments:
+        min_runs -- minimum number of recorded runs (and executions of a
+                    `Stage`)
+                    (default 10)
+        ratio -- minimum fraction of growing runs and executions with
+                 positive net allocated bytes
+                 (default 0.9)
+        """
+        with self._lock:
+            baselines = self._baselines.latest()
+            stages = {
+                stage_id: stage[3].latest()
+                for stage_id, stage in self._stages.items()
+            }
+        if len(baselines) < min_runs:
+            return []
+        increases = sum(b > a for a, b in zip(baselines, baselines[1:]))
+        if increases < ratio * (len(baselines) - 1):
+            return []
+        return [
+            stage_id for stage_id, history in stages.items()
+            if len(history) >= min_runs
+            and sum(net > 0 for net in history) >= ratio * len(history)
+        ]
+
+    def report(self) -> str:
+        """
+        Returns table of recorded statistics (sorted by total net
+        allocated bytes).
+        """
+        growing = self.growing()
+        lines = [
+            f"{'stage':<24} {'runs':>8} {'net':>12} {'mean':>10} "
+            + f"{'peak':>10}"
+        ]
+        for stage_id, stage in sorted(
+            self.stages.items(), key=lambda item: -item[1].net
+        ):
+            lines.append(
+                f"{stage_id[:24]:<24} {stage.runs:>8} {stage.net:>12} "
+                + f"{stage.mean:>10.1f} {stage.peak:>10}"
+                + ("  (growing)" if stage_id in growing else "")
+            )
+        return "\n".join(lines)
+
+    def reset(self) -> None:
+        """Discard all recorded statistics."""
+        with self._lock:
+            self._stages = {}
+            self._baselines = _Ring(self._window)
+
+    def __getstate__(self):
+        # statistics are not transferred (e.g. to worker processes)
+        return {"window": self._window}
+
+    def __setstate__(self, state):
+        self.__init__(state["window"])
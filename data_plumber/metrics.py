@@ -0,0 +1,369 @@
+"""
+# data_plumber/metrics.py
+
+This module defines the `MetricsRegistry`-class, a collection of
+counters and latency histograms of `Pipeline.run`s that can be rendered
+in the Prometheus text format.
+"""
+
+from typing import Optional, Any, Iterator
+import os
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from threading import Lock, Thread, local
+from weakref import finalize
+
+
+# upper bounds (in seconds) of histogram buckets
+BUCKETS = (
+    0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5,
+    1.0, 5.0
+)
+
+# name -> (type, help)
+METRICS = {
+    "data_plumber_runs_total":
+        ("counter", "Number of completed Pipeline runs."),
+    "data_plumber_stages_total":
+        ("counter", "Number of executed Stages by status."),
+    "data_plumber_forks_total":
+        ("counter", "Number of Fork decisions by target (-1 for exit)."),
+    "data_plumber_requirement_skips_total":
+        ("counter", "Number of Stages skipped due to unmet requirements."),
+    "data_plumber_run_duration_seconds":
+        ("histogram", "Duration of completed Pipeline runs."),
+    "data_plumber_stage_duration_seconds":
+        ("histogram", "Duration of executed Stages."),
+}
+
+
+class _Shard:
+    """
+    Metrics of a single thread. Only the owning thread writes to a shard
+    so that no locking is required when recording. Values are stored by
+    raw keys; labels are only built in `_Shard.snapshot`.
+    """
+
+    def __init__(self, pipeline: str) -> None:
+        self.pipeline = pipeline
+        # histograms as [bucket counts..., sum, count]
+        self.runs = self._histogram()
+        # stage -> pair of counts by status and histogram (a single
+        # lookup per executed Stage)
+        self.stages: dict[str, tuple[dict[int, int], list]] = {}
+        # (index, target) -> count
+        self.forks: dict[tuple[int, Optional[int]], int] = {}
+        # stage -> count
+        self.skips: dict[str, int] = {}
+
+    @staticmethod
+    def _histogram() -> list:
+        return [0] * (len(BUCKETS) + 3)
+
+    @staticmethod
+    def _observe(histogram: list, value: float) -> None:
+        histogram[bisect_left(BUCKETS, value)] += 1
+        histogram[-2] += value
+        histogram[-1] += 1
+
+    # the following methods are called by Pipeline
+    def run(self, duration: float) -> None:
+        """Record completed run."""
+        self._observe(self.runs, duration)
+
+    def stage(self, stage: str, status: int, duration: float) -> None:
+        """Record executed `Stage`."""
+        # called for every Stage; _observe is inlined
+        try:
+            statuses, histogram = self.stages[stage]
+        except KeyError:
+            statuses, histogram = self.stages[stage] = (
+                {}, self._histogram()
+            )
+        statuses[status] = statuses.get(status, 0) + 1
+        histogram[bisect_left(BUCKETS, duration)] += 1
+        histogram[-2] += duration
+        histogram[-1] += 1
+
+    def fork(self, index: int, target: Optional[int]) -> None:
+        """Record `Fork`-decision."""
+        key = (index, target)
+        self.forks[key] = self.forks.get(key, 0) + 1
+
+    def skip(self, stage: str) -> None:
+        """Record `Stage` skipped due to unmet requirements."""
+        self.skips[stage] = self.skips.get(stage, 0) + 1
+
+    def snapshot(self) -> tuple[dict, dict]:
+        """
+        Returns pair of counters and histograms (dictionaries by pairs
+        of metric name and label values).
+        """
+        # copies are atomic with respect to the recording thread
+        pipeline = self.pipeline
+        runs = self.runs.copy()
+        counters: dict[tuple[str, tuple], int] = {}
+        histograms: dict[tuple[str, tuple], list] = {}
+        if runs[-1]:
+            counters[("data_plumber_runs_total", (pipeline,))] = runs[-1]
+            histograms[("data_plumber_run_duration_seconds", (pipeline,))] = \
+                runs
+        for stage, (statuses, histogram) in self.stages.copy().items():
+            for status, count in statuses.copy().items():
+                counters[(
+                    "data_plumber_stages_total",
+                    (pipeline, stage, str(status))
+                )] = count
+            histograms[
+                ("data_plumber_stage_duration_seconds", (pipeline, stage))
+            ] = histogram.copy()
+        for (index, target), count in self.forks.copy().items():
+            target = -1 if target is None else target
+            counters[(
+                "data_plumber_forks_total",
+                (pipeline, str(index), str(target))
+            )] = count
+        for stage, count in self.skips.copy().items():
+            counters[
+                ("data_plumber_requirement_skips_total", (pipeline, stage))
+            ] = count
+        return counters, histograms
+
+
+# label names by metric
+_LABELS = {
+    "data_plumber_runs_total": ("pipeline",),
+    "data_plumber_stages_total": ("pipeline", "stage", "status"),
+    "data_plumber_forks_total": ("pipeline", "fork", "target"),
+    "data_plumber_requirement_skips_total": ("pipeline", "stage"),
+    "data_plumber_run_duration_seconds": ("pipeline",),
+    "data_plumber_stage_duration_seconds": ("pipeline", "stage"),
+}
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"") \
+        .replace("\n", "\\n")
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    labels = [
+        f"{name}=\"{_escape(value)}\"" for name, value in zip(names, values)
+    ]
+    if extra:
+        labels.append(extra)
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+
+def _format_value(value: float) -> str:
+    if isinstance(value, int) or value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class _Owner:
+    """
+    Thread-local object that is released (and garbage collected) when
+    its thread exits; used to retire the thread's shard.
+    """
+
+
+def _merge(
+    counters: dict, histograms: dict, shard: tuple[dict, dict]
+) -> None:
+    # add snapshot of a shard to counters and histograms
+    shard_counters, shard_histograms = shard
+    for key, value in shard_counters.items():
+        counters[key] = counters.get(key, 0) + value
+    for key, histogram in shard_histograms.items():
+        if (total := histograms.get(key)) is None:
+            histograms[key] = histogram
+        else:
+            histograms[key] = [a + b for a, b in zip(total, histogram)]
+
+
+class PipelineMetrics:
+    """
+    Handle for recording the metrics of a `Pipeline` (with a fixed label
+    `pipeline`) in a `MetricsRegistry` (see `MetricsRegistry.pipeline`).
+    """
+
+    def __init__(self, registry: "MetricsRegistry", name: str) -> None:
+        self._registry = registry
+        self._name = name
+        self._local = local()
+
+    @property
+    def name(self) -> str:
+        """Returns the value of the label `pipeline`."""
+        return self._name
+
+    @property
+    def registry(self) -> "MetricsRegistry":
+        """Returns the `MetricsRegistry`."""
+        return self._registry
+
+    def shard(self) -> _Shard:
+        """Returns the shard of the current thread."""
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = self._registry._add_shard(self._name)
+            # merge shard into the registry's totals when the thread exits
+            owner = self._local.owner = _Owner()
+            finalize(owner, self._registry._retire_shard, shard)
+            return shard
+
+    def __getstate__(self):
+        raise TypeError(
+            "'PipelineMetrics' cannot be pickled (use a separate "
+            + "'MetricsRegistry' per process)."
+        )
+
+
+class MetricsRegistry:
+    """
+    A `MetricsRegistry` collects counters (runs, executed `Stage`s by
+    status, `Fork`-decisions, and requirement skips) as well as latency
+    histograms (runs and `Stage`s) of the `Pipeline`s it is given to.
+    Every thread records into its own shard, i.e. recording requires no
+    locking; shards are only combined when rendering (and merged into
+    a shared total when their thread exits).
+
+    Example usage:
+     >>> from data_plumber import Pipeline, MetricsRegistry
+     >>> metrics = MetricsRegistry()
+     >>> p = Pipeline(..., metrics=metrics.pipeline("checkout"))
+     >>> p.run(...)
+     >>> print(metrics.render())
+     # HELP data_plumber_runs_total Number of completed Pipeline runs.
+     # TYPE data_plumber_runs_total counter
+     data_plumber_runs_total{pipeline="checkout"} 1
+     ...
+    """
+
+    def __init__(self) -> None:
+        self._lock = Lock()
+        self._shards: list[_Shard] = []
+        # combined counters and histograms of retired shards
+        self._total: tuple[dict, dict] = ({}, {})
+        self._pipelines: dict[str, PipelineMetrics] = {}
+
+    def _add_shard(self, pipeline: str) -> _Shard:
+        shard = _Shard(pipeline)
+        with self._lock:
+            self._shards.append(shard)
+        return shard
+
+    def _retire_shard(self, shard: _Shard) -> None:
+        # the shard's thread has exited, i.e. it is no longer written
+        snapshot = shard.snapshot()
+        with self._lock:
+            self._shards.remove(shard)
+            _merge(*self._total, snapshot)
+
+    def pipeline(self, name: str) -> PipelineMetrics:
+        """
+        Returns handle for a `Pipeline` (argument `metrics`) that
+        records metrics with label `pipeline=name`.
+        """
+        with self._lock:
+            if (handle := self._pipelines.get(name)) is None:
+                handle = self._pipelines[name] = PipelineMetrics(self, name)
+            return handle
+
+    def collect(self) -> tuple[dict, dict]:
+        """
+        Returns pair of combined counters and histograms (dictionaries
+        by pairs of metric name and label values).
+        """
+        with self._lock:
+            shards = self._shards.copy()
+            counters: dict[tuple[str, tuple], int] = self._total[0].copy()
+            histograms: dict[tuple[str, tuple], list] = \
+                self._total[1].copy()
+        for shard in shards:
+            _merge(counters, histograms, shard.snapshot())
+        return counters, histograms
+
+    def _lines(self) -> Iterator[str]:
+        counters, histograms = self.collect()
+        for name, (type_, help_) in METRICS.items():
+            yield f"# HELP {name} {help_}"
+            yield f"# TYPE {name} {type_}"
+            names = _LABELS[name]
+            if type_ == "counter":
+                for (_name, labels), value in sorted(counters.items()):
+                    if _name == name:
+                        yield f"{name}{_format_labels(names, labels)} {value}"
+                continue
+            for (_name, labels), histogram in sorted(histograms.items()):
+                if _name != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(BUCKETS + (float("inf"),), histogram):
+                    cumulative = cumulative + count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    yield (
+                        f"{name}_bucket"
+                        + _format_labels(names, labels, f"le=\"{le}\"")
+                        + f" {cumulative}"
+                    )
+                yield (
+                    f"{name}_sum{_format_labels(names, labels)} "
+                    + _format_value(histogram[-2])
+                )
+                yield (
+                    f"{name}_count{_format_labels(names, labels)} "
+                    + str(histogram[-1])
+                )
+
+    def render(self) -> str:
+        """Returns all metrics in the Prometheus text format."""
+        return "\n".join(self._lines()) + "\n"
+
+    def write(self, path: str | Path) -> None:
+        """
+        Write rendered metrics to file at `path` (atomically, e.g. for
+        the textfile-collector of a Prometheus node-exporter).
+        """
+        path = Path(path)
+        tmp = path.with_name(path.name + f".{os.getpid()}.tmp")
+        tmp.write_text(self.render(), encoding="utf-8")
+        os.replace(tmp, path)
+
+    def serve(
+        self, port: int = 0, address: str = "127.0.0.1"
+    ) -> ThreadingHTTPServer:
+        """
+        Start a HTTP server (on a daemon thread) that serves rendered
+        metrics for every GET-request. Returns the server (use
+        `server.server_address` to get the port and `server.shutdown()`
+        to stop it).
+
+        Keyword arguments:
+        port -- port to listen on
+                (default 0; any free port)
+        address -- address to listen on
+                   (default "127.0.0.1")
+        """
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):  # pylint: disable=invalid-name
+                body = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header(
+                    "Content-Type", "text/plain; version=0.0.4; charset=utf-8"
+                )
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args: Any) -> None:
+                pass
+
+        server = ThreadingHTTPServer((address, port), Handler)
+        Thread(target=server.serve_forever, daemon=True).start()
+        return server
@@ -1,11 +1,12 @@
 """
 # data_plumber/output.py
 
-This module defines the output-format `PipelineOutput` of a
-`Pipeline.run`.
+This module defines the output-formats `PipelineOutput` of a
+`Pipeline.run` and `ChunkedPipelineOutput` of a `Pipeline.run_chunked`
+as well as the `Projection` of `PipelineOutput`s.
 """
 
-from typing import Any, Optional
+from typing import Any, Optional, Callable, Sequence
 from dataclasses import dataclass
 
 
@@ -102,3 +103,158 @@ class PipelineOutput:
             return self.records[-1][0]
         except IndexError:
             return None
+
+
+@dataclass
+class ChunkedPipelineOutput:
+    """
+    Response type of a call to `Pipeline.run_chunked`.
+
+    Its properties are:
+    * `chunks`: list (per chunk) of lists of `StageRecord`s
+    * `kwargs`: kwargs passed to `Pipeline.run_chunked` (without chunks)
+    * `data`: reference to the persistent object that has been passed
+              through the `Pipeline` for all chunks
+    * `items`: total number of processed items
+
+    Additional convenience methods:
+    * `records`: returns the `StageRecord`s of all chunks
+    * `last_statuses`: returns list of `status` of last `Stage` per
+                       chunk
+    * `status`: returns the largest `status` of last `Stage`s of all
+                chunks
+    * `messages`: returns list of pairs of chunk index and non-empty
+                  `message`s
+    """
+
+    chunks: list[list[StageRecord]]
+    kwargs: dict[str, Any]
+    data: Any
+    items: int
+
+    @property
+    def records(self) -> list[StageRecord]:
+        """Returns the `StageRecord`s of all chunks."""
+        return [record for chunk in self.chunks for record in chunk]
+
+    @property
+    def last_statuses(self) -> list[Optional[int]]:
+        """Returns the last `Stage`'s status result per chunk."""
+        return [chunk[-1].status if chunk else None for chunk in self.chunks]
+
+    @property
+    def status(self) -> Optional[int]:
+        """
+        Returns the largest status result of the last `Stage`s of all
+        chunks (`None` if no chunk generated a record).
+        """
+        return max(
+            (s for s in self.last_statuses if s is not None), default=None
+        )
+
+    @property
+    def messages(self) -> list[tuple[int, str]]:
+        """Returns pairs of chunk index and non-empty message."""
+        return [
+            (index, record.message)
+            for index, chunk in enumerate(self.chunks)
+            for record in chunk if record.message
+        ]
+
+
+# default for `Projection`'s kwargs and data (depends on mode)
+_BY_MODE: Any = object()
+
+
+class Projection:
+    """
+    A `Projection` reduces a `PipelineOutput` to the requested parts
+    such that no references to other objects are retained after a run.
+
+    Available modes for `records` are
+    * "full": all `StageRecord`s (default)
+    * "last": only the last `StageRecord`
+    * "status": only the last `StageRecord` without message
+    * "failures": all `StageRecord`s whose status does not match `ok`
+
+    In mode "full", kwargs and the data-object are kept by default; the
+    other modes drop them by default (keeping all of them requires
+    passing `None` explicitly).
+
+    Example usage:
+     >>> from data_plumber import Pipeline, Projection
+     >>> Pipeline(...).run(
+             projection=Projection("failures", kwargs=["id"], data=[])
+         )
+     PipelineOutput(records=[...], kwargs={'id': ...}, data={})
+
+    Keyword arguments:
+    mode -- one of "full", "last", "status", and "failures"
+            (default "full")
+    kwargs -- names of kwargs to be kept; `None` keeps all kwargs
+              (default all kwargs in mode "full", none otherwise)
+    data -- keys of the persistent data-object to be kept (the result
+            is a dictionary); `None` keeps the data-object as is
+            (default unchanged data-object in mode "full", empty
+            dictionary otherwise)
+    ok -- either integer status or `Callable` that is called with a
+          status and returns a `bool`; used in mode "failures"
+          (default 0)
+    """
+
+    MODES = ("full", "last", "status", "failures")
+
+    def __init__(
+        self,
+        mode: str = "full",
+        kwargs: Optional[Sequence[str]] = _BY_MODE,
+        data: Optional[Sequence[str]] = _BY_MODE,
+        ok: int | Callable[[int], bool] = 0,
+    ) -> None:
+        if mode not in self.MODES:
+            raise ValueError(
+                f"Unknown projection mode '{mode}' (available modes: "
+                + f"{', '.join(self.MODES)})."
+            )
+        self._mode = mode
+        if kwargs is _BY_MODE:
+            kwargs = None if mode == "full" else ()
+        if data is _BY_MODE:
+            data = None if mode == "full" else ()
+        self._kwargs = None if kwargs is None else tuple(kwargs)
+        self._data = None if data is None else tuple(data)
+        self._ok = ok
+
+    @property
+    def mode(self) -> str:
+        """Returns a `Projection`'s mode."""
+        return self._mode
+
+    def _failed(self, status: int) -> bool:
+        if callable(self._ok):
+            return not self._ok(status)
+        return status != self._ok
+
+    def __call__(self, output: PipelineOutput) -> PipelineOutput:
+        records = output.records
+        if self._mode == "last":
+            records = records[-1:]
+        elif self._mode == "status":
+            records = [
+                StageRecord(r.index, r.id_, "", r.status) for r in records[-1:]
+            ]
+        elif self._mode == "failures":
+            records = [r for r in records if self._failed(r.status)]
+        kwargs = output.kwargs
+        if self._kwargs is not None:
+            kwargs = {k: kwargs[k] for k in self._kwargs if k in kwargs}
+        data = output.data
+        if self._data is not None:
+            selected = {}
+            for key in self._data:
+                try:
+                    selected[key] = data[key]
+                except (KeyError, IndexError, TypeError):
+                    pass
+            data = selected
+        return PipelineOutput(records, kwargs, data)
@@ -5,18 +5,49 @@ The `pipeline`-module defines the `Pipeline`-class as the core-component
 of the data-plumber-framework.
 """
 
-from typing import Optional, Callable, Any, Iterator
-from functools import wraps
+from typing import Optional, Callable, Any, Iterator, Iterable, Mapping
+from concurrent.futures import Executor
+from copy import copy
+from functools import wraps, partial
+from operator import eq
+from time import monotonic, perf_counter
+from types import MappingProxyType
 from uuid import uuid4
 
+from .batch import chunked, pack, run_chunk, map_chunks
+from .compiler import compile_pipeline
 from .component import _PipelineComponent
 from .context import PipelineContext
-from .error import PipelineError
-from .output import StageRecord, PipelineOutput
+from .capture import Capture
+from .error import PipelineError, BudgetExceededError
+from .explain import Explanation, explain
+from .resource import Resource
+from .output import StageRecord, PipelineOutput, ChunkedPipelineOutput, \
+    Projection
 from .fork import Fork
+from .history import RunHistory
+from .hooks import Hooks
+from .lazy import has_lazy, resolve
+from .memory import MemoryProfile
+from .metrics import MetricsRegistry, PipelineMetrics
+from .profile import PipelineProfile
+from .schedule import Scheduler, commutative_groups
+from .specialize import Prefix, specialize
 from .stage import Stage
 
 
+# arguments of Pipeline.run that are not forwarded into
+# _PipelineComponents (in addition to finalize_output)
+_RUN_ARGUMENTS = (
+    "max_stages", "max_steps", "deadline", "cancel", "projection"
+)
+
+
+def _skip_finalize(**kwargs) -> None:
+    # finalize_output for individual chunks of Pipeline.run_chunked
+    return None
+
+
 class Pipeline:
     """
     A `Pipeline` provides the core-functionality of the `data-plumber`-
@@ -45,7 +76,7 @@ class Pipeline:
     kwargs -- assignment of custom identifiers for `_PipelineComponent`s
               used in the positional section
     initialize_output -- generator for initial data of `Pipeline.run`s
-                         (default lambda: {})
+                         (default `dict`)
     finalize_output -- `Callable` that is executed after the execution
                        of `Pipeline.run` exits; gets passed the
                        `Pipeline`'s persistent `data`-object, a list of
@@ -59,23 +90,93 @@ class Pipeline:
     loop -- if `True`, loop around and re-iterate `_PipelineComponent`s
             after completion of last `_PipelineComponent` in `Pipeline`
             (default `False`)
+    resources -- dictionary of `Resource`s (or factories thereof) by
+                 name; instances are injected into `_PipelineComponent`s
+                 as keyword arguments (these names become reserved words
+                 in the context of a `Pipeline.run`)
+                 (default `None`)
+    profile -- `PipelineProfile` that collects `Fork`-decisions and
+               `Stage`-status values during `Pipeline.run`s; used to
+               optimize the layout of `Pipeline.compile`
+               (default `None`)
+    reorder -- if `True`, groups of consecutive commutative `Stage`s
+               (see `Stage`) without requirements are executed in an
+               adaptive order, i.e. by decreasing ratio of observed
+               probability to exit the `Pipeline` (`exit_on_status`)
+               and execution time
+               (default `False`)
+    history -- `RunHistory` that stores the `StageRecord`s of all
+               completed `Pipeline.run`s
+               (default `None`)
+    metrics -- `PipelineMetrics` (see `MetricsRegistry.pipeline`) or
+               `MetricsRegistry` (with `Pipeline.id` as label) that
+               records counters and latencies of `Pipeline.run`s
+               (default `None`)
+    hooks -- `Hooks` with callbacks for events during `Pipeline.run`s
+             (default `None`)
+    memory -- `MemoryProfile` that records allocated memory of `Stage`s
+              during `Pipeline.run`s (enables `tracemalloc`)
+              (default `None`)
+    capture -- `Capture` that records (a sample of) the kwargs and
+               `StageRecord`s of `Pipeline.run`s for `replay`
+               (default `None`)
     """
     def __init__(
         self,
         *args: str | _PipelineComponent,
-        initialize_output: Callable[..., Any] = lambda: {},
+        initialize_output: Callable[..., Any] = dict,
         finalize_output: Optional[Callable[..., Any]] = None,
         exit_on_status: Optional[int | Callable[[int], bool]] = None,
         loop: bool = False,
+        resources: Optional[dict[str, Resource | Callable[[], Any]]] = None,
+        profile: Optional[PipelineProfile] = None,
+        reorder: bool = False,
+        history: Optional[RunHistory] = None,
+        metrics: Optional[PipelineMetrics | MetricsRegistry] = None,
+        hooks: Optional[Hooks] = None,
+        memory: Optional[MemoryProfile] = None,
+        capture: Optional[Capture] = None,
         **kwargs: _PipelineComponent
     ) -> None:
         self._initialize_output = initialize_output
         self._finalize_output = finalize_output
         self._exit_on_status = \
             exit_on_status if callable(exit_on_status) \
-            else lambda status: status == exit_on_status
+            else partial(eq, exit_on_status)
         self._loop = loop
         self._id = str(uuid4())
+        self._resources = {
+            k: (r if isinstance(r, Resource) else Resource(r))
+            for k, r in (resources or {}).items()
+        }
+        self._profile = profile
+        self._scheduler = Scheduler() if reorder else None
+        self._history = history
+        self._metrics = \
+            metrics.pipeline(self._id) \
+            if isinstance(metrics, MetricsRegistry) else metrics
+        self._hooks = hooks
+        self._memory = memory
+        self._capture = capture
+        # pair of version and groups of commutative Stages
+        self._groups: Optional[tuple[int, dict[int, int]]] = None
+        # names of budgets etc. are reserved as well since they cannot
+        # be given to Pipeline.run as kwargs (see _RUN_ARGUMENTS)
+        self._reserved_words = \
+            ["out", "primer", "status", "count", "records"] \
+            + list(_RUN_ARGUMENTS) + list(self._resources)
+
+        # counter for changes to the Pipeline's structure (incremented
+        # by every call to _update_catalog)
+        self._version = 0
+        # pair of key (versions and layout) and run-function generated by
+        # Pipeline.compile
+        self._compiled: Optional[tuple[Any, Callable[..., Any]]] = None
+
+        # kwargs bound by Pipeline.specialize and the part of runs that
+        # has been evaluated ahead of time (discarded on changes)
+        self._constants: dict[str, Any] = {}
+        self._prefix: Optional[Prefix] = None
 
         # dictionary of PipelineComponents by their given name/id
         self._stage_catalog: dict[str, _PipelineComponent] = {}
@@ -86,12 +187,25 @@ class Pipeline:
         self._pipeline = list(map(str, args))
 
     def _update_catalog(self, *args, **kwargs):
+        self._version = self._version + 1
+        self._prefix = None
         self._stage_catalog.update(kwargs)
         for s in args:
             if isinstance(s, str):
                 continue
             self._stage_catalog.update({str(s): s})
 
+    def _commutative_groups(self) -> dict[int, int]:
+        # end positions of groups of commutative Stages by start position
+        if self._groups is None or self._groups[0] != self._version:
+            self._groups = (
+                self._version,
+                commutative_groups(
+                    self._pipeline, self._stage_catalog, self._loop
+                )
+            )
+        return self._groups[1]
+
     def _meets_requirements(self, _s: str, context: PipelineContext) -> bool:
         s = self._stage_catalog[_s]
         assert isinstance(s, Stage)
@@ -139,15 +253,15 @@ class Pipeline:
         return index
 
     def _validate_external_kwargs(self, **kwargs):
-        reserved_words = ["out", "primer", "status", "count", "records"]
         # check for reserved kwargs
         if (bad_kwarg := next(
-            (p for p in kwargs if p in reserved_words),
+            (p for p in kwargs if p in self._reserved_words),
             None
         )):
             raise PipelineError(
                 f"Keyword '{bad_kwarg}' is reserved in the context of a "
-                + f"'Pipeline.run'-command. (Reserved words: {reserved_words})"
+                + "'Pipeline.run'-command. (Reserved words: "
+                + f"{self._reserved_words})"
             )
 
     @property
@@ -163,6 +277,41 @@ class Pipeline:
         """
         return self._stage_catalog.copy()
 
+    @property
+    def resources(self) -> dict[str, Resource]:
+        """Returns a (shallow) copy of the `Pipeline`'s `Resource`s."""
+        return self._resources.copy()
+
+    @property
+    def history(self) -> Optional[RunHistory]:
+        """Returns the `Pipeline`'s `RunHistory`."""
+        return self._history
+
+    @property
+    def metrics(self) -> Optional[PipelineMetrics]:
+        """Returns the `Pipeline`'s `PipelineMetrics`."""
+        return self._metrics
+
+    @property
+    def hooks(self) -> Optional[Hooks]:
+        """Returns the `Pipeline`'s `Hooks`."""
+        return self._hooks
+
+    @property
+    def memory(self) -> Optional[MemoryProfile]:
+        """Returns the `Pipeline`'s `MemoryProfile`."""
+        return self._memory
+
+    @property
+    def capture(self) -> Optional[Capture]:
+        """Returns the `Pipeline`'s `Capture`."""
+        return self._capture
+
+    @property
+    def profile(self) -> Optional[PipelineProfile]:
+        """Returns the `Pipeline`'s `PipelineProfile`."""
+        return self._profile
+
     @property
     def stages(self) -> list[str]:
         """
@@ -172,30 +321,216 @@ class Pipeline:
         return self._pipeline.copy()
 
     def run(
-        self, finalize_output: Optional[Callable[..., Any]] = None, **kwargs
+        self,
+        finalize_output: Optional[Callable[..., Any]] = None,
+        max_stages: Optional[int] = None,
+        deadline: Optional[float] = None,
+        cancel: Optional[Any] = None,
+        projection: Optional[Projection | str] = None,
+        max_steps: Optional[int] = None,
+        **kwargs
     ) -> PipelineOutput:
         """
         Trigger `Pipeline` execution.
 
+        Budgets (`max_stages`, `max_steps`, `deadline`, and `cancel`)
+        are checked between `_PipelineComponent`s. If any of them is
+        exhausted, a `BudgetExceededError` is raised which holds the
+        partial `PipelineOutput`.
+
         Keyword arguments:
         finalize_output -- callable that overrides the `Pipeline`'s
                            `finalize_output` (constructor-argument)
                            (default `None`)
+        max_stages -- maximum number of `Stage`s to be executed
+                      (default `None`; unlimited)
+        deadline -- absolute point in time (as given by
+                    `time.monotonic`) after which no further
+                    `_PipelineComponent`s are evaluated
+                    (default `None`; no deadline)
+        cancel -- cancellation token like a `threading.Event`; the run
+                  is interrupted as soon as its `is_set()` returns `True`
+                  (default `None`)
+        projection -- `Projection` (or its mode) that reduces the
+                      returned `PipelineOutput` to the requested parts
+                      (applied after `finalize_output`)
+                      (default `None`; full output)
+        max_steps -- maximum number of `_PipelineComponent`s to be
+                     evaluated (`Stage`s including those with unmet
+                     requirements, `Fork`s, and empty components; stops
+                     loops that do not execute `Stage`s)
+                     (default `None`; unlimited)
         kwargs -- keyword arguments that are forwarded into
                   `_PipelineComponent`s
         """
 
+        return self._run(
+            kwargs, finalize_output, max_stages, deadline, cancel,
+            projection=projection, max_steps=max_steps
+        )
+
+    def _run(
+        self,
+        kwargs: dict[str, Any],
+        finalize_output: Optional[Callable[..., Any]] = None,
+        max_stages: Optional[int] = None,
+        deadline: Optional[float] = None,
+        cancel: Optional[Any] = None,
+        shared: Optional[dict] = None,
+        engine: Optional[Callable[..., PipelineOutput]] = None,
+        projection: Optional[Projection | str] = None,
+        max_steps: Optional[int] = None,
+    ) -> PipelineOutput:
         self._validate_external_kwargs(**kwargs)
 
-        records: list[StageRecord] = []  # record of results
-        data = self._initialize_output()  # output data
+        if engine is None:
+            engine = self._execute
+        # the shard of the current thread is looked up once per run
+        shard = None
+        if self._metrics is not None:
+            shard = self._metrics.shard()
+            started = perf_counter()
+        if self._memory is not None:
+            self._memory.start_run()
+        # individual chunks of Pipeline.run_chunked are not captured
+        captured = None
+        if self._capture is not None \
+                and finalize_output is not _skip_finalize \
+                and self._capture.sample():
+            captured = kwargs.copy()
+        # constants of Pipeline.specialize are bound to the Pipeline (not
+        # captured since they cannot be given to its runs)
+        if self._constants:
+            kwargs.update(self._constants)
+        # results of shared Stages would not depend on resources and
+        # constants of this Pipeline
+        if shared is not None and (self._resources or self._constants):
+            shared = None
+        if not self._resources:
+            output = engine(
+                kwargs, finalize_output, max_stages, deadline, cancel,
+                shared, max_steps=max_steps, shard=shard
+            )
+        else:
+            acquired = {}
+            try:
+                for name, resource in self._resources.items():
+                    acquired[name] = resource.acquire()
+                kwargs.update(acquired)
+                output = engine(
+                    kwargs, finalize_output, max_stages, deadline, cancel,
+                    shared, max_steps=max_steps, shard=shard
+                )
+            finally:
+                for name, instance in acquired.items():
+                    self._resources[name].release(instance)
+                    # strip resources from PipelineOutput.kwargs
+                    kwargs.pop(name, None)
+        if shard is not None:
+            shard.run(perf_counter() - started)
+        if self._history is not None:
+            self._history.record(self._id, output)
+        if captured is not None:
+            self._capture.record(captured, output)
+        if projection is not None:
+            if isinstance(projection, str):
+                projection = Projection(projection)
+            return projection(output)
+        return output
 
-        stage_count = -1
-        index = 0
-        while True:
+    def _execute(
+        self,
+        kwargs: dict[str, Any],
+        finalize_output: Optional[Callable[..., Any]],
+        max_stages: Optional[int],
+        deadline: Optional[float],
+        cancel: Optional[Any],
+        shared: Optional[dict] = None,
+        state: Optional[tuple[int, list[StageRecord], Any, int]] = None,
+        max_steps: Optional[int] = None,
+        shard: Optional[Any] = None,
+    ) -> PipelineOutput:
+        # `shared` is a (Pipearray-)cache of Stage results in the form of
+        # a trie with nodes
+        # (index, id, Stage.id) -> (StageRecord | None, exports, children)
+        # which is followed as long as the execution is linear
+        # `state` allows to resume a run (e.g. from compiled code) with
+        # (index, records, data, stage_count)
+        prefix: Optional[Prefix] = None
+        if state is None:
+            records: list[StageRecord] = []  # record of results
+            data = self._initialize_output()  # output data
+            stage_count = -1
+            index = 0
+            # continue after the part of the run that has been evaluated
+            # by Pipeline.specialize (unless it exceeds max_stages; runs
+            # with max_steps evaluate all components)
+            prefix = self._prefix
+            if prefix is not None and max_steps is None \
+                    and (max_stages is None or prefix.count <= max_stages):
+                shared = None  # shared results would depend on the prefix
+                records.extend(prefix.records)
+                kwargs.update(prefix.exported)
+                stage_count = prefix.count - 1
+                index = prefix.index
+            else:
+                prefix = None
+        else:
+            index, records, data, stage_count = state
+        lazy = has_lazy(kwargs)  # whether there are Lazy kwargs to resolve
+        profile = self._profile
+        memory = self._memory
+        if shard is None and self._metrics is not None:
+            shard = self._metrics.shard()
+        if self._hooks is None:
+            before_stage = after_stage = on_fork = on_skip = on_exit = None
+        else:
+            before_stage = self._hooks.dispatcher("before_stage")
+            after_stage = self._hooks.dispatcher("after_stage")
+            on_fork = self._hooks.dispatcher("on_fork")
+            on_skip = self._hooks.dispatcher("on_requirement_skip")
+            on_exit = self._hooks.dispatcher("on_exit")
+        reason = "end"  # reason for exiting the loop (see Hooks)
+        # whether the run has ended within the prefix
+        exited = prefix is not None and prefix.reason in ("status", "fork")
+        if exited:
+            reason = prefix.reason
+        scheduler = self._scheduler
+        groups = None if scheduler is None else self._commutative_groups()
+        # remaining positions (reversed) of the current group of
+        # commutative Stages, end of that group, and number of records
+        # before that group
+        group: Optional[list[int]] = None
+        group_end = 0
+        group_records = 0
+        steps = 0  # number of evaluated components (see max_steps)
+        while not exited:
             index = self._loop_index(index)
             if index >= len(self._pipeline):  # detect exit point
                 break
+            # budgets
+            if max_steps is not None:
+                if steps >= max_steps:
+                    raise BudgetExceededError(
+                        "max_steps", PipelineOutput(records, kwargs, data)
+                    )
+                steps = steps + 1
+            if deadline is not None and monotonic() >= deadline:
+                raise BudgetExceededError(
+                    "deadline", PipelineOutput(records, kwargs, data)
+                )
+            if cancel is not None and cancel.is_set():
+                raise BudgetExceededError(
+                    "cancel", PipelineOutput(records, kwargs, data)
+                )
+            # enter group of commutative Stages
+            if groups and group is None and index in groups:
+                assert scheduler is not None
+                shared = None  # stop sharing results at first group
+                group_end = groups[index]
+                group_records = len(records)
+                group = scheduler.order(index, group_end)[::-1]
+                index = group.pop()
 
             _s = self._pipeline[index]
             try:
@@ -207,8 +542,11 @@ class Pipeline:
             # ##########
             # Fork
             if isinstance(s, Fork):
+                shared = None  # stop sharing results at first Fork
                 # get StageRef
                 assert isinstance(s, Fork)
+                if lazy:
+                    resolve(s.fork, kwargs)
                 stage_ref = s.eval(
                     PipelineContext(
                         self._pipeline, index, self._loop, records, kwargs,
@@ -216,6 +554,18 @@ class Pipeline:
                     )
                 )
                 if stage_ref is None:  # exit pipeline on request
+                    if profile is not None:
+                        profile.record_fork(index, None)
+                    if shard is not None:
+                        shard.fork(index, None)
+                    if on_fork is not None:
+                        on_fork(
+                            self._hook_context(
+                                on_fork, index, records, kwargs, data,
+                                stage_count
+                            ), index=index, fork=_s, target=None
+                        )
+                    reason = "fork"
                     break
                 # get target of StageRef
                 ref = stage_ref.get(
@@ -224,11 +574,47 @@ class Pipeline:
                         data, stage_count
                     )
                 )
+                if profile is not None:
+                    profile.record_fork(index, ref.index)
+                if shard is not None:
+                    shard.fork(index, ref.index)
+                if on_fork is not None:
+                    on_fork(
+                        self._hook_context(
+                            on_fork, index, records, kwargs, data, stage_count
+                        ), index=index, fork=_s, target=ref.index
+                    )
                 index = ref.index
                 continue
             # ##########
             # Stage
             assert isinstance(s, Stage)
+            # shared results (requirements that refer to the arrangement
+            # of this Pipeline may resolve differently in other Pipelines)
+            if shared is not None and s.requires is not None \
+                    and any(ref.static for ref in s.requires):
+                shared = None
+            if shared is not None and \
+                    (node := shared.get((index, _s, s.id))) is not None:
+                record, exported_kwargs, shared = node
+                if record is not None:
+                    if max_stages is not None \
+                            and stage_count + 1 >= max_stages:
+                        raise BudgetExceededError(
+                            "max_stages", PipelineOutput(records, kwargs, data)
+                        )
+                    stage_count = stage_count + 1
+                    kwargs.update(exported_kwargs)
+                    if not lazy:
+                        lazy = has_lazy(exported_kwargs)
+                    records.append(
+                        StageRecord(index, _s, record.message, record.status)
+                    )
+                    if self._exit_on_status(record.status):
+                        reason = "status"
+                        break
+                index = index + 1
+                continue
             # requires
             if not self._meets_requirements(
                 _s, PipelineContext(
@@ -236,10 +622,39 @@ class Pipeline:
                     data, stage_count
                 )
             ):
+                if shard is not None:
+                    shard.skip(_s)
+                if on_skip is not None:
+                    on_skip(
+                        self._hook_context(
+                            on_skip, index, records, kwargs, data, stage_count
+                        ), index=index, stage=_s
+                    )
+                if shared is not None:
+                    shared = shared.setdefault(
+                        (index, _s, s.id), (None, None, {})
+                    )[2]
                 index = index + 1
                 continue
             # all requirements met
+            if max_stages is not None and stage_count + 1 >= max_stages:
+                raise BudgetExceededError(
+                    "max_stages", PipelineOutput(records, kwargs, data)
+                )
             stage_count = stage_count + 1
+            if before_stage is not None:
+                before_stage(
+                    self._hook_context(
+                        before_stage, index, records, kwargs, data, stage_count
+                    ), index=index, stage=_s
+                )
+            if memory is not None:
+                memory_start = memory.start_stage()
+            if group is not None or shard is not None:
+                started = perf_counter()
+            if lazy:
+                for function in (s.primer, s.action, s.export):
+                    resolve(function, kwargs)
             # primer
             primer = s.primer(**kwargs, out=data, count=stage_count)
             # action
@@ -257,6 +672,11 @@ class Pipeline:
             )
             self._validate_external_kwargs(**exported_kwargs)
             kwargs.update(exported_kwargs)
+            if not lazy:
+                lazy = has_lazy(exported_kwargs)
+            if lazy:
+                resolve(s.status, kwargs)
+                resolve(s.message, kwargs)
             # status/message
             status = s.status(
                 **kwargs,
@@ -271,20 +691,341 @@ class Pipeline:
                 count=stage_count,
                 status=status
             )
+            if memory is not None:
+                memory.record_stage(_s, memory_start)
             records.append(StageRecord(index, _s, msg, status))
+            if profile is not None:
+                profile.record_stage(_s, status)
+            if group is not None or shard is not None:
+                duration = perf_counter() - started
+                if shard is not None:
+                    shard.stage(_s, status, duration)
+            if after_stage is not None:
+                after_stage(
+                    self._hook_context(
+                        after_stage, index, records, kwargs, data, stage_count
+                    ), index=index, stage=_s, status=status, message=msg
+                )
+            if shared is not None:
+                shared = shared.setdefault(
+                    (index, _s, s.id), (records[-1], exported_kwargs, {})
+                )[2]
+            if group is not None:
+                assert scheduler is not None
+                exit_ = self._exit_on_status(status)
+                scheduler.record(index, exit_, duration)
+                if exit_ or not group:
+                    # records of a group are kept in positional order
+                    records[group_records:] = sorted(
+                        records[group_records:], key=lambda r: r.index
+                    )
+                if exit_:
+                    reason = "status"
+                    break
+                if group:
+                    index = group.pop()
+                else:
+                    index = group_end
+                    group = None
+                continue
             if self._exit_on_status(status):
+                reason = "status"
                 break
             index = index + 1
 
+        if on_exit is not None:
+            on_exit(
+                self._hook_context(
+                    on_exit, index, records, kwargs, data, stage_count
+                ), index=index, reason=reason
+            )
+        return self._finish(finalize_output, records, kwargs, data)
+
+    def _hook_context(
+        self,
+        dispatcher: Any,
+        index: int,
+        records: list[StageRecord],
+        kwargs: dict[str, Any],
+        data: Any,
+        stage_count: int
+    ) -> Optional[PipelineContext]:
+        # build PipelineContext only if a hook asks for it
+        if not dispatcher.context:
+            return None
+        return PipelineContext(
+            self._pipeline, index, self._loop, records, kwargs, data,
+            stage_count
+        )
+
+    def _finish(
+        self,
+        finalize_output: Optional[Callable[..., Any]],
+        records: list[StageRecord],
+        kwargs: dict[str, Any],
+        data: Any
+    ) -> PipelineOutput:
         if finalize_output is not None:
+            resolve(finalize_output, kwargs)
             finalize_output(data=data, records=records, **kwargs)
         elif self._finalize_output is not None:
+            resolve(self._finalize_output, kwargs)
             self._finalize_output(data=data, records=records, **kwargs)
-        return PipelineOutput(
+        output = PipelineOutput(
             records,
             kwargs,
             data
         )
+        if self._hooks is not None and finalize_output is not _skip_finalize \
+                and (on_finalize := self._hooks.dispatcher("on_finalize")):
+            on_finalize(None, output=output)
+        return output
+
+    def run_many(
+        self,
+        inputs: Iterable[Mapping[str, Any]],
+        executor: Optional[Executor] = None,
+        chunksize: int = 64,
+        projection: Optional[Projection | str] = None,
+        **kwargs
+    ) -> Iterator[PipelineOutput]:
+        """
+        Returns a generator for the `PipelineOutput`s of `Pipeline.run`s
+        for every element in `inputs` (in order of `inputs`). Inputs are
+        split into chunks which are, if an `executor` is given,
+        submitted to that `Executor`. In a `ProcessPoolExecutor`, the
+        `Pipeline` (and, in particular, its `Resource`s) is set up only
+        once per worker process (this requires the `Pipeline` to be
+        picklable).
+
+        Keyword arguments:
+        inputs -- iterable of kwargs for individual `Pipeline.run`s
+        executor -- `concurrent.futures.Executor` for processing chunks
+                    (default `None`; sequential execution)
+        chunksize -- number of inputs per chunk
+                     (default 64)
+        projection -- see `Pipeline.run` (applied in the workers, i.e.
+                      before outputs are transferred)
+                      (default `None`)
+        kwargs -- common keyword arguments for all `Pipeline.run`s
+                  (overridden by individual `inputs`)
+        """
+        if isinstance(projection, str):
+            projection = Projection(projection)
+        for (output,) in map_chunks(
+            partial(
+                run_chunk, pack([self], executor), kwargs, False, False,
+                projection
+            ),
+            inputs, chunksize, executor
+        ):
+            yield output
+
+    def run_chunked(
+        self,
+        items: Iterable[Any],
+        chunksize: int = 1024,
+        key: str = "chunk",
+        finalize_output: Optional[Callable[..., Any]] = None,
+        stop_on_status: Optional[int | Callable[[int], bool]] = None,
+        max_stages: Optional[int] = None,
+        deadline: Optional[float] = None,
+        cancel: Optional[Any] = None,
+        max_steps: Optional[int] = None,
+        **kwargs
+    ) -> ChunkedPipelineOutput:
+        """
+        Process `items` (e.g. a generator reading from a file) in chunks
+        of (at most) `chunksize` elements. For every chunk, the
+        `Pipeline` is executed with the chunk (a list) passed as kwarg
+        `key`; the persistent data-object is initialized once and passed
+        through the `Pipeline` for all chunks (i.e. it can be used to
+        accumulate results). Since only a single chunk is held at a
+        time, memory is bounded by the chunk size rather than the size
+        of `items`.
+
+        Kwargs exported by `Stage`s only apply to the current chunk.
+        `finalize_output` is called once after the last chunk with
+        `records` of all chunks.
+
+        Keyword arguments:
+        items -- iterable of items to be processed
+        chunksize -- number of items per chunk
+                     (default 1024)
+        key -- name of the kwarg that holds the current chunk
+               (default "chunk")
+        finalize_output -- see `Pipeline.run`
+                           (default `None`)
+        stop_on_status -- either integer status or `Callable` that is
+                          called with the last status of a chunk; if it
+                          matches, no further chunks are processed
+                          (default `None`)
+        max_stages -- maximum number of `Stage`s per chunk
+                      (default `None`)
+        deadline, cancel -- see `Pipeline.run` (apply to all chunks)
+        max_steps -- maximum number of `_PipelineComponent`s per chunk
+                     (default `None`)
+        kwargs -- common keyword arguments for all chunks
+        """
+        if stop_on_status is None or callable(stop_on_status):
+            stop = stop_on_status
+        else:
+            stop = partial(eq, stop_on_status)
+        data = self._initialize_output()
+        chunks = []
+        count = 0
+        for chunk in chunked(items, chunksize):
+            count = count + len(chunk)
+            output = self._run(
+                kwargs | {key: chunk}, _skip_finalize, max_stages, deadline,
+                cancel, engine=partial(
+                    self._execute, state=(0, [], data, -1)
+                ), max_steps=max_steps
+            )
+            chunks.append(output.records)
+            if stop is not None and output.last_status is not None \
+                    and stop(output.last_status):
+                break
+        output = ChunkedPipelineOutput(chunks, kwargs.copy(), data, count)
+        self._finish(finalize_output, output.records, kwargs.copy(), data)
+        return output
+
+    def close(self) -> None:
+        """Close all instances of the `Pipeline`'s `Resource`s."""
+        for resource in self._resources.values():
+            resource.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def compile(self) -> Callable[..., PipelineOutput]:
+        """
+        Returns a drop-in replacement for `Pipeline.run` that uses a
+        Python function which is generated specifically for this
+        `Pipeline`: `Stage`-calls are unrolled, requirements with static
+        references (`StageById`, `StageByIncrement`, ...) are inlined,
+        and calls to default-`Callable`s are omitted.
+
+        If the `Pipeline` has a `PipelineProfile`, execution paths along
+        the most frequent targets of `Fork`s are laid out as straight-
+        line code (other targets continue in the generic execution loop
+        of `Pipeline.run`). Without profile, execution continues in the
+        generic loop after the first `Fork`.
+
+        Callbacks of `Hooks` are called directly from the generated code
+        (without `Hooks` or if no callbacks are registered, no code is
+        generated for them).
+
+        The result is cached until the `Pipeline` or its `Hooks` are
+        changed or the hot targets of the profile change
+        (`_PipelineComponent`s themselves are assumed to not change).
+        """
+        layout = {} if self._profile is None else self._profile.hot_targets()
+        key = (
+            self._version,
+            None if self._hooks is None else self._hooks.version,
+            layout
+        )
+        if self._compiled is None or self._compiled[0] != key:
+            engine = compile_pipeline(self, layout)
+
+            @wraps(self.run)
+            def run(
+                finalize_output: Optional[Callable[..., Any]] = None,
+                max_stages: Optional[int] = None,
+                deadline: Optional[float] = None,
+                cancel: Optional[Any] = None,
+                projection: Optional[Projection | str] = None,
+                max_steps: Optional[int] = None,
+                **kwargs
+            ) -> PipelineOutput:
+                return self._run(
+                    kwargs, finalize_output, max_stages, deadline, cancel,
+                    engine=engine, projection=projection,
+                    max_steps=max_steps
+                )
+            self._compiled = (key, run)
+        return self._compiled[1]
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # generated code cannot be pickled
+        state["_compiled"] = None
+        return state
+
+    def freeze(self) -> "FrozenPipeline":
+        """
+        Returns an immutable snapshot of the `Pipeline` (see
+        `FrozenPipeline`). Later changes to the `Pipeline` do not affect
+        the snapshot.
+        """
+        return FrozenPipeline(self)
+
+    def specialize(self, **constants) -> "Pipeline":
+        """
+        Returns a copy of the `Pipeline` that is specialized for the
+        given constant kwargs (partial evaluation): `Stage`s and `Fork`s
+        that are declared to only depend on these (see `Stage.depends`
+        and `Fork.depends`) are evaluated once ahead of time and
+        replaced by their results. In addition, the leading part of
+        runs (as long as `_PipelineComponent`s only depend on constants
+        and kwargs exported in that part) is evaluated including
+        requirements and `Fork`s; runs of the specialized `Pipeline`
+        start after it with the recorded `StageRecord`s and exported
+        kwargs. Compiling the specialized `Pipeline` folds requirements
+        that follow from the evaluated part.
+
+        The constants are bound to the returned `Pipeline` (and
+        reserved; they cannot be given to its `Pipeline.run`).
+        Callbacks of `Hooks`, metrics, etc. are not triggered for the
+        evaluated part of runs, and values exported by it are shared
+        between runs (they must not be changed in place). Changes to
+        the specialized `Pipeline` discard the evaluated part.
+
+        Keyword arguments:
+        constants -- kwargs that are identical for all runs
+        """
+        specialized = Pipeline.__new__(Pipeline)
+        specialized.__dict__.update(self.__dict__)
+        # attributes of FrozenPipeline
+        specialized.__dict__.pop("_layout", None)
+        specialized.__dict__.pop("_engine", None)
+        specialized._pipeline = list(self._pipeline)
+        specialized._stage_catalog = dict(self._stage_catalog)
+        specialized._reserved_words = list(self._reserved_words)
+        specialized._compiled = None
+        specialized._groups = None
+        specialized._id = str(uuid4())
+        # metrics that are labeled with the id follow the new id (like
+        # the RunHistory)
+        if self._metrics is not None and self._metrics.name == self._id:
+            specialized._metrics = \
+                self._metrics.registry.pipeline(specialized._id)
+        specialize(specialized, constants)
+        return specialized
+
+    def explain(self, **kwargs) -> Explanation:
+        """
+        Execute the `Pipeline` once (like `Pipeline.run` with `kwargs`)
+        and return an `Explanation` (similar to SQL's `EXPLAIN ANALYZE`)
+        with the resolved order of execution: executed `Stage`s (with
+        time and net number of allocated memory blocks per `Callable`,
+        and size of exported kwargs and of the persistent data-object),
+        `Stage`s skipped due to unmet requirements (and which), and the
+        targets of `Fork`s.
+
+        The run uses instrumented copies of the `_PipelineComponent`s
+        and the generic execution loop; `PipelineProfile`, `RunHistory`,
+        metrics, and `Hooks` of the `Pipeline` are not involved.
+
+        Keyword arguments:
+        kwargs -- keyword arguments that are forwarded into
+                  `_PipelineComponent`s
+        """
+        return explain(self, **kwargs)
 
     def run_for_kwargs(self, **kwargs):
         """
@@ -402,3 +1143,123 @@ class Pipeline:
 
     def __len__(self):
         return len(self._pipeline)
+
+
+class FrozenPipeline(Pipeline):
+    """
+    Immutable snapshot of a `Pipeline` (see `Pipeline.freeze`) that can
+    be run by many threads at the same time without locks.
+
+    The sequence and catalog of `_PipelineComponent`s are stored as
+    read-only containers (`append`, `prepend`, `insert`, and `+` raise a
+    `PipelineError`) and all lookup tables that a `Pipeline` otherwise
+    builds lazily (groups of commutative `Stage`s and the code generated
+    by `Pipeline.compile`) are precomputed when the snapshot is taken:
+    `FrozenPipeline.run` always executes the compiled code (laid out
+    according to the hot targets of the `PipelineProfile` at the time of
+    freezing). Code is only re-generated if the `Hooks` change.
+
+    The `Pipeline.id` and collectors like the `PipelineProfile`,
+    `RunHistory`, metrics, `Hooks`, `MemoryProfile`, and `Capture` are
+    shared with the original `Pipeline` (i.e. they record runs of both),
+    as are the `Resource`s themselves. The mappings of `Resource`s and
+    constants (see `Pipeline.specialize`) are copied, and the adaptive
+    order of commutative `Stage`s (see `reorder`) continues from a copy
+    of the statistics at the time of freezing.
+
+    Example usage:
+     >>> from data_plumber import Pipeline, Stage
+     >>> frozen = Pipeline(Stage(...), Stage(...)).freeze()
+     >>> with ThreadPoolExecutor(64) as executor:
+             executor.map(lambda kwargs: frozen.run(**kwargs), inputs)
+
+    Keyword arguments:
+    pipeline -- `Pipeline` to take the snapshot of
+    """
+    def __init__(self, pipeline: Pipeline) -> None:
+        self.__dict__.update(pipeline.__dict__)
+        # mutable state is copied
+        self._resources = dict(pipeline._resources)
+        self._constants = dict(pipeline._constants)
+        if pipeline._scheduler is not None:
+            self._scheduler = copy(pipeline._scheduler)
+        self._pipeline = tuple(pipeline._pipeline)  # type: ignore[assignment]
+        self._stage_catalog = MappingProxyType(  # type: ignore[assignment]
+            dict(pipeline._stage_catalog)
+        )
+        self._reserved_words = list(pipeline._reserved_words)
+        self._compiled = None
+        self._groups = (
+            self._version,
+            commutative_groups(
+                self._pipeline, self._stage_catalog, self._loop
+            )
+        )
+        self._layout = \
+            {} if self._profile is None else self._profile.hot_targets()
+        self._engine: Optional[tuple[Any, Callable[..., Any]]] = None
+        self._compile_engine()
+
+    def _compile_engine(self) -> Callable[..., PipelineOutput]:
+        # (re-)generate code if Hooks have changed; concurrent calls may
+        # both generate equivalent code, of which either is kept
+        version = None if self._hooks is None else self._hooks.version
+        engine = self._engine
+        if engine is None or engine[0] != version:
+            engine = self._engine = (
+                version, compile_pipeline(self, self._layout)
+            )
+        return engine[1]
+
+    def _run(
+        self,
+        kwargs: dict[str, Any],
+        finalize_output: Optional[Callable[..., Any]] = None,
+        max_stages: Optional[int] = None,
+        deadline: Optional[float] = None,
+        cancel: Optional[Any] = None,
+        shared: Optional[dict] = None,
+        engine: Optional[Callable[..., PipelineOutput]] = None,
+        projection: Optional[Projection | str] = None,
+        max_steps: Optional[int] = None,
+    ) -> PipelineOutput:
+        return super()._run(
+            kwargs, finalize_output, max_stages, deadline, cancel, shared,
+            engine or self._compile_engine(), projection, max_steps
+        )
+
+    @property
+    def stages(self) -> list[str]:
+        """
+        Returns a copy of the `FrozenPipeline`'s list of
+        `_PipelineComponent`s.
+        """
+        return list(self._pipeline)
+
+    def specialize(self, **constants) -> "FrozenPipeline":
+        """
+        Returns a specialized `FrozenPipeline` (see
+        `Pipeline.specialize`).
+        """
+        return super().specialize(**constants).freeze()
+
+    def _frozen(self, *args, **kwargs):
+        raise PipelineError(
+            "'FrozenPipeline' cannot be changed (modify the original "
+            + "'Pipeline' and call 'Pipeline.freeze' again)."
+        )
+
+    append = prepend = insert = __add__ = _frozen  # type: ignore
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        # read-only mapping and generated code cannot be pickled
+        state["_stage_catalog"] = dict(self._stage_catalog)
+        state["_engine"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._stage_catalog = MappingProxyType(self._stage_catalog)
+        self._compile_engine()
+
@@ -0,0 +1,187 @@
+"""
+# data_plumber/profile.py
+
+This module defines the `PipelineProfile`-class, a collection of runtime
+statistics of `Pipeline.run`s that can be used to optimize `Pipeline`-
+compilation.
+"""
+
+from typing import Optional, Callable
+from pathlib import Path
+from threading import Lock
+import json
+
+
+class PipelineProfile:
+    """
+    A `PipelineProfile` collects the frequencies of `Fork`-decisions
+    (by position of the `Fork` in a `Pipeline`) and of `Stage`-status
+    values (by `Stage` identifier) during `Pipeline.run`s. It can be
+    saved to and loaded from a JSON-file in order to warm-start a
+    `Pipeline` with an optimized layout (see `Pipeline.compile`).
+
+    Note that profiles refer to positions in a `Pipeline` and are
+    therefore only meaningful for the arrangement of `Pipeline`-
+    components they were recorded with.
+
+    Example usage:
+     >>> from data_plumber import Pipeline, PipelineProfile
+     >>> p = Pipeline(..., profile=PipelineProfile())
+     >>> p.run(...)
+     >>> p.profile.save("profile.json")
+     >>> Pipeline(
+             ..., profile=PipelineProfile.load("profile.json")
+         ).compile()
+    """
+
+    def __init__(self) -> None:
+        self._lock = Lock()
+        # fork position -> target position (None for exit) -> count
+        self._forks: dict[int, dict[Optional[int], int]] = {}
+        # stage id -> status -> count
+        self._stages: dict[str, dict[int, int]] = {}
+
+    def __getstate__(self):
+        return {"forks": self.forks, "stages": self.stages}
+
+    def __setstate__(self, state):
+        self.__init__()
+        self._forks = state["forks"]
+        self._stages = state["stages"]
+
+    def record_fork(self, index: int, target: Optional[int]) -> None:
+        """
+        Count `Fork`-decision.
+
+        Keyword arguments:
+        index -- position of the `Fork`
+        target -- position of the target (`None` for exit)
+        """
+        with self._lock:
+            targets = self._forks.setdefault(index, {})
+            targets[target] = targets.get(target, 0) + 1
+
+    def record_stage(self, stage_id: str, status: int) -> None:
+        """
+        Count `Stage`-status.
+
+        Keyword arguments:
+        stage_id -- `Stage` identifier
+        status -- status returned by the `Stage`
+        """
+        with self._lock:
+            statuses = self._stages.setdefault(stage_id, {})
+            statuses[status] = statuses.get(status, 0) + 1
+
+    @property
+    def forks(self) -> dict[int, dict[Optional[int], int]]:
+        """
+        Returns a copy of the recorded `Fork`-decisions as dictionary of
+        target counts (`None` for exit) by `Fork`-position.
+        """
+        with self._lock:
+            return {k: v.copy() for k, v in self._forks.items()}
+
+    @property
+    def stages(self) -> dict[str, dict[int, int]]:
+        """
+        Returns a copy of the recorded `Stage`-status values as
+        dictionary of status counts by `Stage`-identifier.
+        """
+        with self._lock:
+            return {k: v.copy() for k, v in self._stages.items()}
+
+    def hot_target(self, index: int) -> Optional[int]:
+        """
+        Returns the most frequent target position of the `Fork` at
+        `index` (`None` if it has not been recorded or exiting is most
+        frequent).
+        """
+        with self._lock:
+            targets = self._forks.get(index)
+            if not targets:
+                return None
+            return max(targets.items(), key=lambda item: item[1])[0]
+
+    def hot_targets(self) -> dict[int, int]:
+        """
+        Returns a dictionary of the most frequent target positions by
+        `Fork`-position (see `hot_target`).
+        """
+        return {
+            index: target for index in self.forks
+            if (target := self.hot_target(index)) is not None
+        }
+
+    def runs(self, stage_id: str) -> int:
+        """Returns the number of recorded executions of a `Stage`."""
+        with self._lock:
+            return sum(self._stages.get(stage_id, {}).values())
+
+    def failure_rate(
+        self, stage_id: str, ok: int | Callable[[int], bool] = 0
+    ) -> Optional[float]:
+        """
+        Returns the fraction of recorded executions of a `Stage` that
+        returned a status that does not match `ok` (`None` if it has not
+        been recorded).
+
+        Keyword arguments:
+        stage_id -- `Stage` identifier
+        ok -- either integer status or `Callable` that is called with a
+              status and returns a `bool`
+              (default 0)
+        """
+        with self._lock:
+            statuses = self._stages.get(stage_id, {}).copy()
+        total = sum(statuses.values())
+        if total == 0:
+            return None
+        return sum(
+            count for status, count in statuses.items()
+            if not (ok(status) if callable(ok) else status == ok)
+        ) / total
+
+    def to_dict(self) -> dict:
+        """Returns JSON-serializable representation of this profile."""
+        return {
+            "forks": {
+                str(index): {
+                    "exit" if target is None else str(target): count
+                    for target, count in targets.items()
+                } for index, targets in self.forks.items()
+            },
+            "stages": {
+                stage_id: {
+                    str(status): count for status, count in statuses.items()
+                } for stage_id, statuses in self.stages.items()
+            },
+        }
+
+    @classmethod
+    def from_dict(cls, json_: dict) -> "PipelineProfile":
+        """Returns `PipelineProfile` from its JSON-representation."""
+        profile = cls()
+        profile._forks = {
+            int(index): {
+                None if target == "exit" else int(target): count
+                for target, count in targets.items()
+            } for index, targets in json_.get("forks", {}).items()
+        }
+        profile._stages = {
+            stage_id: {
+                int(status): count for status, count in statuses.items()
+            } for stage_id, statuses in json_.get("stages", {}).items()
+        }
+        return profile
+
+    def save(self, path: str | Path) -> None:
+        """Write profile to JSON-file at `path`."""
+        Path(path).write_text(json.dumps(self.to_dict()), encoding="utf-8")
+
+    @classmethod
+    def load(cls, path: str | Path) -> "PipelineProfile":
+        """Returns `PipelineProfile` loaded from JSON-file at `path`."""
+        return cls.from_dict(
+            json.loads(Path(path).read_text(encoding="utf-8"))
+        )
@@ -33,6 +33,11 @@ class _StageRef(metaclass=abc.ABCMeta):
     intended for explicit use.
     """
 
+    # `True` if the resolution of a StageRef only depends on the
+    # arrangement of the Pipeline (stages, current_position, and loop)
+    # and not on the progress of a Pipeline.run (records, ...)
+    static = False
+
     STAGEREF_ERROR_MSG = \
         "Unable to resolve StageRef {target}{location} in Pipeline with " \
         + "stages {stages}. Records until error: {records}"
@@ -129,6 +134,8 @@ class First(_StageRef):
 class Last(_StageRef):
     """Reference to the last `Stage` of registered `Stage`s in `Pipeline`."""
 
+    static = True
+
     @classmethod
     def get(cls, context: PipelineContext) -> StageRefOutput:
         if len(context.stages) == 0:
@@ -161,6 +168,8 @@ def NextN(n: int) -> StageRef:
         )
 
     class _(_StageRef):
+        static = True
+
         @classmethod
         def get(cls, context: PipelineContext) -> StageRefOutput:
             stage_index = context.current_position + n
@@ -203,6 +212,8 @@ def StageById(stage_id: str) -> StageRef:
     """
 
     class _(_StageRef):
+        static = True
+
         @classmethod
         def get(cls, context: PipelineContext) -> StageRefOutput:
             try:
@@ -235,6 +246,8 @@ def StageByIndex(stage_index: int) -> StageRef:
     """
 
     class _(_StageRef):
+        static = True
+
         @classmethod
         def get(cls, context: PipelineContext) -> StageRefOutput:
             try:
@@ -266,6 +279,8 @@ def StageByIncrement(index_increment: int) -> StageRef:
     """
 
     class _(_StageRef):
+        static = True
+
         @classmethod
         def get(cls, context: PipelineContext) -> StageRefOutput:
             stage_index = context.current_position + index_increment
@@ -0,0 +1,276 @@
+"""
+# data_plumber/registry.py
+
+This module defines the `PipelineRegistry`-class, a keyed collection of
+`Pipeline`-definitions with a bounded cache of compiled `Pipeline`s.
+"""
+
+from typing import Optional, Callable, Any, Hashable
+import linecache
+import sys
+from collections import OrderedDict
+from dataclasses import dataclass
+from threading import Lock
+from time import time
+
+from .output import PipelineOutput
+from .pipeline import Pipeline, FrozenPipeline
+
+
+def compiled_size(frozen: FrozenPipeline) -> int:
+    """
+    Returns the approximate size of the compiled state of a
+    `FrozenPipeline` in bytes (generated code objects, their namespace,
+    and source; `_PipelineComponent`s are not included since they are
+    part of the definition).
+    """
+    size = sys.getsizeof(frozen._pipeline) \
+        + sys.getsizeof(dict(frozen._stage_catalog))
+    engine = None if frozen._engine is None else frozen._engine[1]
+    code = getattr(engine, "__code__", None)
+    if code is None:  # not generated (see compile_pipeline)
+        return size
+    size = size + sys.getsizeof(engine.__globals__)  # type: ignore
+    stack = [code]
+    while stack:
+        code = stack.pop()
+        size = size + sys.getsizeof(code)
+        stack.extend(c for c in code.co_consts if hasattr(c, "co_code"))
+    cached = linecache.cache.get(engine.__code__.co_filename)  # type: ignore
+    if cached is not None:
+        size = size + sys.getsizeof("".join(cached[2]))
+    return size
+
+
+def _release(frozen: FrozenPipeline) -> None:
+    # close Resources of a FrozenPipeline that has been removed from the
+    # cache and drop generated source that is kept for tracebacks
+    engine = None if frozen._engine is None else frozen._engine[1]
+    code = getattr(engine, "__code__", None)
+    if code is not None:
+        linecache.cache.pop(code.co_filename, None)
+    frozen.close()
+
+
+@dataclass
+class KeyUsage:
+    """
+    Usage statistics of a key in a `PipelineRegistry`.
+
+    Keyword arguments:
+    hits -- number of lookups that found a compiled `Pipeline` in the
+            cache
+    misses -- number of lookups that required compilation
+    evictions -- number of times the compiled `Pipeline` was evicted
+    last_used -- time of the latest lookup (as given by `time.time`;
+                 `None` if never used)
+    size -- approximate size of the compiled `Pipeline` in bytes if
+            currently cached (otherwise `None`)
+    """
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    last_used: Optional[float] = None
+    size: Optional[int] = None
+
+    @property
+    def lookups(self) -> int:
+        """Returns the total number of lookups."""
+        return self.hits + self.misses
+
+
+class PipelineRegistry:
+    """
+    A `PipelineRegistry` maps keys (e.g. tenants) to `Pipeline`-
+    definitions and compiles (freezes, see `Pipeline.freeze`) these the
+    first time they are used. Compiled `Pipeline`s are kept in a
+    least-recently-used cache that is bounded by the number of entries
+    and (optionally) by their approximate total size (see
+    `compiled_size`). Lookups of cached `Pipeline`s take constant time.
+
+    Runs that are in flight are not affected by evictions (they keep
+    using the evicted `FrozenPipeline`). `Pipeline`s that are evicted,
+    replaced, or unregistered are closed (see `Pipeline.close`), i.e.
+    the registry owns the `Resource`s of its `Pipeline`s (instances
+    that are in use by runs in flight are closed when they are
+    released, and new instances are created on the next use).
+    Compilation happens outside of the registry's lock, i.e. lookups of
+    other keys are not blocked.
+
+    Example usage:
+     >>> from data_plumber import Pipeline, PipelineRegistry
+     >>> registry = PipelineRegistry(capacity=500, max_bytes=2**28)
+     >>> registry.register("tenant-1", Pipeline(...))
+     >>> registry.register("tenant-2", lambda: build_pipeline("tenant-2"))
+     >>> registry.run("tenant-1", ...)
+     <data_plumber.output.PipelineOutput object at ...>
+     >>> registry.usage()["tenant-1"]
+     KeyUsage(hits=0, misses=1, evictions=0, last_used=..., size=...)
+
+    Keyword arguments:
+    capacity -- maximum number of compiled `Pipeline`s in the cache
+                (default 256)
+    max_bytes -- maximum approximate total size of compiled `Pipeline`s
+                 in bytes
+                 (default `None`; unbounded)
+    """
+
+    def __init__(
+        self, capacity: int = 256, max_bytes: Optional[int] = None
+    ) -> None:
+        if capacity < 1:
+            raise ValueError(
+                f"Capacity has to be a positive integer (got '{capacity}')."
+            )
+        self._capacity = capacity
+        self._max_bytes = max_bytes
+        self._lock = Lock()
+        # key -> Pipeline or factory
+        self._definitions: dict[Hashable, Any] = {}
+        # key -> pair of FrozenPipeline and size (in order of use)
+        self._cache: OrderedDict[Hashable, tuple[FrozenPipeline, int]] = \
+            OrderedDict()
+        self._bytes = 0
+        # key -> [hits, misses, evictions, last_used]
+        self._usage: dict[Hashable, list] = {}
+
+    @property
+    def capacity(self) -> int:
+        """Returns the maximum number of cached `Pipeline`s."""
+        return self._capacity
+
+    @property
+    def cached(self) -> list[Hashable]:
+        """Returns keys of cached `Pipeline`s (least recently used first)."""
+        with self._lock:
+            return list(self._cache)
+
+    @property
+    def size(self) -> int:
+        """Returns approximate total size of cached `Pipeline`s."""
+        return self._bytes
+
+    def register(
+        self, key: Hashable, pipeline: Pipeline | Callable[[], Pipeline]
+    ) -> None:
+        """
+        Register (or replace) the definition for `key`.
+
+        Keyword arguments:
+        key -- hashable key
+        pipeline -- `Pipeline` or `Callable` that returns the `Pipeline`
+                    (called when the key is first used and after
+                    evictions)
+        """
+        with self._lock:
+            self._definitions[key] = pipeline
+            self._usage.setdefault(key, [0, 0, 0, None])
+            replaced = self._discard(key)
+        if replaced is not None:
+            _release(replaced)
+
+    def unregister(self, key: Hashable) -> None:
+        """Remove the definition (and cached `Pipeline`) of `key`."""
+        with self._lock:
+            del self._definitions[key]
+            self._usage.pop(key, None)
+            removed = self._discard(key)
+        if removed is not None:
+            _release(removed)
+
+    def _discard(self, key: Hashable) -> Optional[FrozenPipeline]:
+        # remove key from cache (requires lock)
+        entry = self._cache.pop(key, None)
+        if entry is None:
+            return None
+        self._bytes = self._bytes - entry[1]
+        return entry[0]
+
+    def _evict(self) -> list[FrozenPipeline]:
+        # evict least recently used entries until within bounds (requires
+        # lock; the most recently used entry is kept); returns evicted
+        # Pipelines (to be released outside of the lock)
+        evicted = []
+        while len(self._cache) > self._capacity or (
+            self._max_bytes is not None and self._bytes > self._max_bytes
+            and len(self._cache) > 1
+        ):
+            key, (frozen, size) = self._cache.popitem(last=False)
+            self._bytes = self._bytes - size
+            self._usage[key][2] = self._usage[key][2] + 1
+            evicted.append(frozen)
+        return evicted
+
+    def get(self, key: Hashable) -> FrozenPipeline:
+        """
+        Returns the compiled `Pipeline` for `key` (compiled on first
+        use). Raises a `KeyError` for unknown keys.
+        """
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None:
+                self._cache.move_to_end(key)
+                usage = self._usage[key]
+                usage[0] = usage[0] + 1
+                usage[3] = time()
+                return entry[0]
+            definition = self._definitions[key]
+        # compile without holding the lock
+        pipeline = definition if isinstance(definition, Pipeline) \
+            else definition()
+        frozen = pipeline.freeze()
+        size = compiled_size(frozen)
+        with self._lock:
+            if self._definitions.get(key) is not definition:
+                # replaced or removed during compilation
+                return frozen
+            usage = self._usage[key]
+            usage[3] = time()
+            if (entry := self._cache.get(key)) is not None:
+                # compiled concurrently by another thread
+                self._cache.move_to_end(key)
+                usage[0] = usage[0] + 1
+                return entry[0]
+            usage[1] = usage[1] + 1
+            self._cache[key] = (frozen, size)
+            self._bytes = self._bytes + size
+            evicted = self._evict()
+        for _frozen in evicted:
+            _release(_frozen)
+        return frozen
+
+    def run(self, key: Hashable, **kwargs) -> PipelineOutput:
+        """Run the `Pipeline` for `key` (see `Pipeline.run`)."""
+        return self.get(key).run(**kwargs)
+
+    def usage(self) -> dict[Hashable, KeyUsage]:
+        """Returns `KeyUsage` by key for all registered keys."""
+        with self._lock:
+            return {
+                key: KeyUsage(
+                    hits, misses, evictions, last_used,
+                    None if key not in self._cache else self._cache[key][1]
+                )
+                for key, (hits, misses, evictions, last_used)
+                in self._usage.items()
+            }
+
+    def clear(self) -> None:
+        """Evict all compiled `Pipeline`s (keeps definitions)."""
+        with self._lock:
+            evicted = []
+            for key in list(self._cache):
+                if (frozen := self._discard(key)) is not None:
+                    evicted.append(frozen)
+                    self._usage[key][2] = self._usage[key][2] + 1
+        for _frozen in evicted:
+            _release(_frozen)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._definitions
+
+    def __len__(self) -> int:
+        return len(self._definitions)
+
+    def keys(self):
+        return self._definitions.keys()
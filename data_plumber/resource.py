@@ -0,0 +1,216 @@
+"""
+# data_plumber/resource.py
+
+This module defines the `Resource`-class, a declaration of objects like
+database connections that are shared between `Pipeline.run`s.
+"""
+
+from typing import Optional, Callable, Any
+import os
+from threading import Lock, local, get_ident
+from queue import LifoQueue, Empty
+from weakref import finalize
+
+
+class _Slot:
+    """Thread-local holder whose lifetime is bound to its thread."""
+    def __init__(self, value: Any, generation: int) -> None:
+        self.value = value
+        # value of Resource._generation at creation (the instance is
+        # stale after Resource.close)
+        self.generation = generation
+        self.finalizer: Optional[finalize] = None
+
+
+class Resource:
+    """
+    A `Resource` describes an object (e.g. a database connection) that
+    is created once per worker (thread or process) and injected into
+    `Stage`/`Fork`-`Callable`s as keyword argument by a `Pipeline`. By
+    default, every thread gets its own instance which is closed when
+    the thread exits (e.g. on shutdown of a `ThreadPoolExecutor`) or
+    the owning `Pipeline` is closed. Instances are always closed by
+    the thread they belong to (objects like `sqlite3`-connections can
+    only be used by the thread that created them): `Resource.close`
+    closes the calling thread's instance immediately and those of
+    other threads when these threads use the `Resource` again or exit.
+    If `pool_size` is given, instead a bounded pool of instances is
+    shared between threads and every `Pipeline.run` borrows a single
+    instance for its duration.
+
+    Example usage:
+     >>> from data_plumber import Pipeline, Stage, Resource
+     >>> Pipeline(
+             Stage(
+                 primer=lambda db, **kwargs: db.execute(...)
+             ),
+             resources={"db": Resource(lambda: sqlite3.connect(...))}
+         )
+     <data_plumber.pipeline.Pipeline object at ...>
+
+    Keyword arguments:
+    factory -- `Callable` without arguments that returns a new instance
+    close -- `Callable` that is called with an instance to release it;
+             if `None`, the instance's `close`-method is used if
+             available
+             (default `None`)
+    pool_size -- maximum number of instances shared between threads;
+                 `None` corresponds to one instance per thread
+                 (default `None`)
+    """
+
+    def __init__(
+        self,
+        factory: Callable[[], Any],
+        close: Optional[Callable[[Any], Any]] = None,
+        pool_size: Optional[int] = None
+    ) -> None:
+        if pool_size is not None and pool_size < 1:
+            raise ValueError(
+                "'Resource' requires a positive 'pool_size' "
+                + f"(got '{pool_size}')."
+            )
+        self._factory = factory
+        self._close = close
+        self._pool_size = pool_size
+        self._reset()
+
+    def _reset(self) -> None:
+        self._pid = os.getpid()
+        self._lock = Lock()
+        # per-thread mode; pairs of thread identifier and finalizer
+        self._local = local()
+        self._finalizers: list[tuple[int, finalize]] = []
+        self._generation = 0
+        # pooled mode; instances that have been borrowed before
+        # Resource.close are closed when they are released
+        self._pool: LifoQueue = LifoQueue()
+        self._instances: list[Any] = []
+        self._retired: list[Any] = []
+        self._created = 0
+
+    def __getstate__(self):
+        # instances are never shared between processes
+        return {
+            "_factory": self._factory,
+            "_close": self._close,
+            "_pool_size": self._pool_size,
+        }
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._reset()
+
+    def _close_instance(self, instance: Any) -> None:
+        if self._close is not None:
+            self._close(instance)
+        elif hasattr(instance, "close"):
+            instance.close()
+
+    @property
+    def pool_size(self) -> Optional[int]:
+        """Returns a `Resource`'s `pool_size`."""
+        return self._pool_size
+
+    def acquire(self) -> Any:
+        """
+        Returns an instance of this `Resource` for the calling thread.
+        Instances are created lazily. In pooled mode, this call blocks
+        until an instance becomes available.
+        """
+        if self._pid != os.getpid():
+            # running in a (forked) child process
+            self._reset()
+        if self._pool_size is None:
+            slot = getattr(self._local, "slot", None)
+            if slot is not None and slot.generation != self._generation:
+                # Resource has been closed by another thread
+                assert slot.finalizer is not None
+                slot.finalizer()
+                slot = None
+            if slot is None:
+                slot = _Slot(self._factory(), self._generation)
+                slot.finalizer = finalize(
+                    slot, self._close_instance, slot.value
+                )
+                with self._lock:
+                    self._finalizers = [
+                        (ident, f) for ident, f in self._finalizers
+                        if f.alive
+                    ]
+                    self._finalizers.append((get_ident(), slot.finalizer))
+                self._local.slot = slot
+            return slot.value
+        with self._lock:
+            create = self._pool.empty() and self._created < self._pool_size
+            if create:
+                self._created = self._created + 1
+        if not create:
+            return self._pool.get()
+        try:
+            instance = self._factory()
+        except BaseException:
+            with self._lock:
+                self._created = self._created - 1
+            raise
+        with self._lock:
+            self._instances.append(instance)
+        return instance
+
+    def release(self, instance: Any) -> None:
+        """
+        Returns a previously `acquire`d instance. Only has an effect in
+        pooled mode.
+        """
+        if self._pool_size is None:
+            return
+        with self._lock:
+            retired = next(
+                (
+                    position for position, i in enumerate(self._retired)
+                    if i is instance
+                ),
+                None
+            )
+            if retired is not None:
+                # borrowed before Resource.close
+                del self._retired[retired]
+            elif not any(i is instance for i in self._instances):
+                return
+        if retired is not None:
+            self._close_instance(instance)
+            return
+        self._pool.put(instance)
+
+    def close(self) -> None:
+        """
+        Close all instances that have been created by this `Resource`.
+        Per-thread instances of other threads are closed by these
+        threads and borrowed instances of a pool when they are
+        released.
+        """
+        ident = get_ident()
+        with self._lock:
+            self._generation = self._generation + 1
+            finalizers = [
+                f for i, f in self._finalizers if i == ident and f.alive
+            ]
+            self._finalizers = [
+                (i, f) for i, f in self._finalizers if i != ident and f.alive
+            ]
+            idle = []
+            while True:
+                try:
+                    idle.append(self._pool.get_nowait())
+                except Empty:
+                    break
+            self._retired.extend(
+                instance for instance in self._instances
+                if not any(instance is i for i in idle)
+            )
+            self._instances = []
+            self._created = 0
+        for f in finalizers:
+            f()
+        for instance in idle:
+            self._close_instance(instance)
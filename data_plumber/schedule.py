@@ -0,0 +1,124 @@
+"""
+# data_plumber/schedule.py
+
+This module defines the adaptive ordering of commutative `Stage`s in a
+`Pipeline` (internal use, see `Pipeline` with `reorder=True`).
+"""
+
+from typing import Any
+from threading import Lock
+
+from .stage import Stage
+
+
+# weight of a new observation in the exponential moving averages
+ALPHA = 0.1
+
+
+def commutative_groups(
+    stages: list[str], catalog: dict[str, Any], loop: bool = False
+) -> dict[int, int]:
+    """
+    Returns a dictionary of end positions (exclusive) by start position
+    for all groups of (at least two) consecutive commutative `Stage`s
+    without requirements. Groups that are followed by a `Stage` with
+    requirements relative to the records of a run (like `Previous` or
+    `First`) are omitted.
+    """
+    def _commutative(_s: str) -> bool:
+        s = catalog.get(_s)
+        return isinstance(s, Stage) and s.commutative and not s.requires
+
+    def _relative(_s: str) -> bool:
+        s = catalog.get(_s)
+        return isinstance(s, Stage) and s.requires is not None \
+            and any(not ref.static for ref in s.requires)
+
+    # last position of a Stage with record-relative requirements (in a
+    # loop, every Stage follows every group)
+    relative = [index for index, _s in enumerate(stages) if _relative(_s)]
+    if not relative:
+        last_relative = -1
+    elif loop:
+        last_relative = len(stages)
+    else:
+        last_relative = relative[-1]
+
+    groups = {}
+    index = 0
+    while index < len(stages):
+        end = index
+        while end < len(stages) and _commutative(stages[end]):
+            end = end + 1
+        if end - index > 1 and end > last_relative:
+            groups[index] = end
+        index = max(end, index + 1)
+    return groups
+
+
+class Scheduler:
+    """
+    A `Scheduler` keeps exponential moving averages of the failure
+    probability (a status that exits the `Pipeline`) and the cost
+    (execution time in seconds) of `Stage`s by position. Groups of
+    commutative `Stage`s are ordered by decreasing ratio of failure
+    probability and cost, such that `Stage`s which are likely to exit
+    early and cheap to evaluate are executed first.
+
+    `Stage`s without observations are executed first (in their original
+    order) so that every `Stage` is measured at least once.
+    """
+
+    def __init__(self) -> None:
+        self._lock = Lock()
+        # position -> (failure probability, cost)
+        self._stats: dict[int, tuple[float, float]] = {}
+
+    def __getstate__(self):
+        return {"stats": self.stats}
+
+    def __setstate__(self, state):
+        self.__init__()
+        self._stats = state["stats"]
+
+    @property
+    def stats(self) -> dict[int, tuple[float, float]]:
+        """
+        Returns a copy of the pairs of failure probability and cost by
+        position.
+        """
+        with self._lock:
+            return self._stats.copy()
+
+    def record(self, index: int, failed: bool, cost: float) -> None:
+        """
+        Update statistics for the `Stage` at position `index`.
+
+        Keyword arguments:
+        index -- position of `Stage`
+        failed -- whether the `Stage`'s status exited the `Pipeline`
+        cost -- execution time in seconds
+        """
+        with self._lock:
+            if (stats := self._stats.get(index)) is None:
+                self._stats[index] = (float(failed), cost)
+                return
+            self._stats[index] = (
+                stats[0] + ALPHA * (failed - stats[0]),
+                stats[1] + ALPHA * (cost - stats[1]),
+            )
+
+    def order(self, start: int, end: int) -> list[int]:
+        """
+        Returns the positions `start` to `end` (exclusive) in order of
+        execution.
+        """
+        with self._lock:
+            stats = self._stats.copy()
+
+        def _score(index: int) -> float:
+            if (s := stats.get(index)) is None:
+                return float("inf")
+            return s[0] / max(s[1], 1e-9)
+
+        return sorted(range(start, end), key=_score, reverse=True)
@@ -0,0 +1,400 @@
+"""
+# data_plumber/sink.py
+
+This module defines output sinks (`JSONLSink`, `CSVSink`, and
+`SQLiteSink`) that write streams of `PipelineOutput`s (e.g. from
+`Pipeline.run_many` or `Pipearray.run_many`) in batches.
+"""
+
+from typing import Optional, Any, Callable, Iterable, Mapping, Sequence
+import csv
+import json
+import sqlite3
+from dataclasses import asdict
+from pathlib import Path
+from queue import Queue
+from threading import Lock, Thread
+
+from .output import PipelineOutput
+
+
+# available fields of rows
+FIELDS: dict[str, Callable[[int, Any, PipelineOutput], Any]] = {
+    "index": lambda index, label, output: index,
+    "pipeline": lambda index, label, output: label,
+    "last_status": lambda index, label, output: output.last_status,
+    "last_message": lambda index, label, output: output.last_message,
+    "records": lambda index, label, output:
+        [asdict(record) for record in output.records],
+}
+
+
+def _scalar(value: Any) -> Any:
+    # convert value for columnar sinks
+    if value is None or isinstance(value, (int, float, str, bytes)):
+        return value
+    if isinstance(value, (list, dict)):
+        return json.dumps(value, default=str)
+    return str(value)
+
+
+class _Sink:
+    """
+    Base class for sinks. Outputs are converted into rows (dictionaries)
+    on the calling thread, buffered, and written in batches of
+    `batch_size` rows. If `background` is `True`, batches are written by
+    a separate writer thread (errors of the writer are raised on the
+    next call to `write`, `flush`, or `close`). After an error, the sink
+    is failed: no further rows are written and every call to `write` or
+    `flush` raises that error again.
+    """
+
+    def __init__(
+        self,
+        fields: Sequence[str] = ("last_status", "last_message"),
+        data: Optional[Sequence[str]] = None,
+        kwargs: Optional[Sequence[str]] = None,
+        batch_size: int = 1000,
+        background: bool = False,
+    ) -> None:
+        for field in fields:
+            if field not in FIELDS:
+                raise ValueError(
+                    f"Unknown field '{field}' (available fields: "
+                    + f"{', '.join(FIELDS)})."
+                )
+        if batch_size < 1:
+            raise ValueError(
+                "Batch size has to be a positive integer "
+                + f"(got '{batch_size}')."
+            )
+        self._fields = list(fields)
+        self._data = list(data or [])
+        self._kwargs = list(kwargs or [])
+        columns = self.columns
+        if duplicates := sorted(
+            {column for column in columns if columns.count(column) > 1}
+        ):
+            raise ValueError(
+                f"Duplicate column names {duplicates} (fields, keys of "
+                + "'data', and names of 'kwargs' have to be distinct)."
+            )
+        self._batch_size = batch_size
+        self._lock = Lock()
+        self._buffer: list[dict[str, Any]] = []
+        self._count = 0
+        self._opened = False
+        self._closed = False
+        self._error: Optional[BaseException] = None
+        self._queue: Optional[Queue] = None
+        self._thread: Optional[Thread] = None
+        if background:
+            self._queue = Queue(maxsize=8)
+            self._thread = Thread(target=self._work, daemon=True)
+            self._thread.start()
+
+    @property
+    def columns(self) -> list[str]:
+        """Returns the names of the columns of rows."""
+        return self._fields + self._data + self._kwargs
+
+    def _row(self, index: int, label: Any, output: PipelineOutput) -> dict:
+        row = {
+            field: FIELDS[field](index, label, output)
+            for field in self._fields
+        }
+        for key in self._data:
+            try:
+                row[key] = output.data[key]
+            except (KeyError, IndexError, TypeError):
+                row[key] = None
+        for key in self._kwargs:
+            row[key] = output.kwargs.get(key)
+        return row
+
+    def _open(self) -> None:
+        """Prepare output (called on the writing thread)."""
+
+    def _write_batch(self, rows: list[dict[str, Any]]) -> None:
+        """Write rows (called on the writing thread)."""
+        raise NotImplementedError
+
+    def _close(self) -> None:
+        """Release output (called on the writing thread)."""
+
+    def _write(self, rows: list[dict[str, Any]]) -> None:
+        if not self._opened:
+            self._open()
+            self._opened = True
+        self._write_batch(rows)
+
+    def _work(self) -> None:
+        assert self._queue is not None
+        while True:
+            rows = self._queue.get()
+            try:
+                if rows is None:
+                    if self._opened:
+                        self._close()
+                    return
+                if self._error is None:
+                    self._write(rows)
+            except BaseException as exc:  # pylint: disable=broad-except
+                self._error = exc
+            finally:
+                self._queue.task_done()
+
+    def _check(self) -> None:
+        if self._closed:
+            raise ValueError("Sink has already been closed.")
+        if self._error is not None:
+            # rows after the first error are dropped
+            raise self._error
+
+    def _submit(self, rows: list[dict[str, Any]]) -> None:
+        if self._queue is not None:
+            self._queue.put(rows)
+            return
+        try:
+            self._write(rows)
+        except BaseException as exc:
+            self._error = exc
+            raise
+
+    def write(
+        self,
+        output: PipelineOutput
+            | Sequence[PipelineOutput] | Mapping[Any, PipelineOutput]
+    ) -> None:
+        """
+        Add output of a `Pipeline.run` (or `Pipearray.run`; one row per
+        `Pipeline` with label or index as field `pipeline`).
+        """
+        self._check()
+        if isinstance(output, PipelineOutput):
+            items: Iterable[tuple[Any, PipelineOutput]] = [(None, output)]
+        elif isinstance(output, Mapping):
+            items = output.items()
+        else:
+            items = enumerate(output)
+        with self._lock:
+            index = self._count
+            self._count = self._count + 1
+            self._buffer.extend(
+                self._row(index, label, o) for label, o in items
+            )
+            if len(self._buffer) < self._batch_size:
+                return
+            rows, self._buffer = self._buffer, []
+            self._submit(rows)
+
+    def write_many(self, outputs: Iterable[Any]) -> int:
+        """
+        Add all `outputs` (e.g. the generator returned by
+        `Pipeline.run_many`) and flush. Returns number of outputs.
+        """
+        count = 0
+        for output in outputs:
+            self.write(output)
+            count = count + 1
+        self.flush()
+        return count
+
+    def flush(self) -> None:
+        """Write buffered rows (and wait for the writer thread)."""
+        self._check()
+        with self._lock:
+            rows, self._buffer = self._buffer, []
+            if rows:
+                self._submit(rows)
+        if self._queue is not None:
+            self._queue.join()
+        self._check()
+
+    def close(self) -> None:
+        """Flush and release output."""
+        if self._closed:
+            return
+        try:
+            self.flush()
+        finally:
+            self._closed = True
+            if self._queue is not None:
+                assert self._thread is not None
+                self._queue.put(None)
+                self._thread.join()
+            elif self._opened:
+                self._close()
+        if self._error is not None:
+            raise self._error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class JSONLSink(_Sink):
+    """
+    Sink that writes one JSON-object per output to a file in JSON-lines
+    format (values that are not JSON-serializable are converted to
+    strings).
+
+    Example usage:
+     >>> from data_plumber import Pipeline, JSONLSource, JSONLSink
+     >>> with JSONLSink("output.jsonl", data=["result"]) as sink:
+             sink.write_many(
+                 Pipeline(...).run_many(JSONLSource("input.jsonl"))
+             )
+
+    Keyword arguments:
+    path -- path to the output file
+    fields -- names of output-fields; available fields are "index"
+              (position of output in the stream), "pipeline" (label or
+              index in a `Pipearray`), "last_status", "last_message",
+              and "records" (list of `StageRecord`s as dictionaries)
+              (default `("last_status", "last_message")`)
+    data -- keys of the persistent data-object to be included
+            (default `None`)
+    kwargs -- names of kwargs of the run to be included
+              (default `None`)
+    batch_size -- number of rows per write
+                  (default 1000)
+    background -- if `True`, rows are written on a separate thread
+                  (default `False`)
+    append -- if `True`, append to an existing file
+              (default `False`)
+    """
+
+    def __init__(
+        self,
+        path: str | Path,
+        fields: Sequence[str] = ("last_status", "last_message"),
+        data: Optional[Sequence[str]] = None,
+        kwargs: Optional[Sequence[str]] = None,
+        batch_size: int = 1000,
+        background: bool = False,
+        append: bool = False,
+    ) -> None:
+        self._path = Path(path)
+        self._mode = "a" if append else "w"
+        self._file: Any = None
+        super().__init__(fields, data, kwargs, batch_size, background)
+
+    def _open(self):
+        self._file = open(self._path, self._mode, encoding="utf-8")
+
+    def _write_batch(self, rows):
+        self._file.write(
+            "".join(json.dumps(row, default=str) + "\n" for row in rows)
+        )
+        self._file.flush()
+
+    def _close(self):
+        self._file.close()
+
+
+class CSVSink(_Sink):
+    """
+    Sink that writes one row per output to a CSV-file with header line
+    (lists and dictionaries, e.g. field "records", are written as
+    JSON).
+
+    Keyword arguments:
+    path -- path to the output file
+    fields, data, kwargs, batch_size, background -- see `JSONLSink`
+    delimiter -- column delimiter
+                 (default ",")
+    """
+
+    def __init__(
+        self,
+        path: str | Path,
+        fields: Sequence[str] = ("last_status", "last_message"),
+        data: Optional[Sequence[str]] = None,
+        kwargs: Optional[Sequence[str]] = None,
+        batch_size: int = 1000,
+        background: bool = False,
+        delimiter: str = ",",
+    ) -> None:
+        self._path = Path(path)
+        self._delimiter = delimiter
+        self._file: Any = None
+        self._writer: Any = None
+        super().__init__(fields, data, kwargs, batch_size, background)
+
+    def _open(self):
+        self._file = open(self._path, "w", encoding="utf-8", newline="")
+        self._writer = csv.writer(self._file, delimiter=self._delimiter)
+        self._writer.writerow(self.columns)
+
+    def _write_batch(self, rows):
+        self._writer.writerows(
+            [_scalar(v) for v in row.values()] for row in rows
+        )
+        self._file.flush()
+
+    def _close(self):
+        self._file.close()
+
+
+class SQLiteSink(_Sink):
+    """
+    Sink that inserts one row per output into a table of an SQLite-
+    database (the table is created if it does not exist; lists and
+    dictionaries are stored as JSON, other objects as strings). Every
+    batch is inserted with a single `executemany` in its own
+    transaction.
+
+    Keyword arguments:
+    path -- path to the database file
+    table -- name of the table
+             (default "outputs")
+    fields, data, kwargs, batch_size, background -- see `JSONLSink`
+    """
+
+    def __init__(
+        self,
+        path: str | Path,
+        table: str = "outputs",
+        fields: Sequence[str] = ("last_status", "last_message"),
+        data: Optional[Sequence[str]] = None,
+        kwargs: Optional[Sequence[str]] = None,
+        batch_size: int = 1000,
+        background: bool = False,
+    ) -> None:
+        self._path = str(path)
+        self._table = table
+        self._connection: Optional[sqlite3.Connection] = None
+        super().__init__(fields, data, kwargs, batch_size, background)
+
+    @staticmethod
+    def _quote(name: str) -> str:
+        return '"' + name.replace('"', '""') + '"'
+
+    def _open(self):
+        # the connection is created on the writing thread; access is
+        # serialized by the sink
+        self._connection = sqlite3.connect(
+            self._path, check_same_thread=False
+        )
+        self._connection.execute(
+            f"CREATE TABLE IF NOT EXISTS {self._quote(self._table)} ("
+            + ", ".join(map(self._quote, self.columns)) + ")"
+        )
+        self._connection.commit()
+
+    def _write_batch(self, rows):
+        assert self._connection is not None
+        with self._connection:
+            self._connection.executemany(
+                f"INSERT INTO {self._quote(self._table)} ("
+                + ", ".join(map(self._quote, self.columns)) + ") VALUES ("
+                + ", ".join("?" * len(self.columns)) + ")",
+                [[_scalar(v) for v in row.values()] for row in rows]
+            )
+
+    def _close(self):
+        assert self._connection is not None
+        self._connection.close()
@@ -0,0 +1,296 @@
+"""
+# data_plumber/source.py
+
+This module defines file-based input sources (`JSONLSource` and
+`CSVSource`) that generate kwargs for `Pipeline.run_many` and
+`Pipearray.run_many`.
+"""
+
+from typing import Optional, Any, Iterator, Mapping
+import abc
+import csv
+import io
+import json
+import mmap
+from concurrent.futures import Executor
+from contextlib import contextmanager
+from functools import partial
+from pathlib import Path
+
+from .batch import map_chunks
+
+
+def _ranges(
+    buffer: mmap.mmap, start: int, block_size: int
+) -> Iterator[tuple[int, int]]:
+    # split buffer into byte-ranges of (about) block_size bytes that end
+    # at line breaks
+    size = len(buffer)
+    while start < size:
+        end = buffer.find(b"\n", min(start + block_size, size - 1))
+        end = size if end < 0 else end + 1
+        yield start, end
+        start = end
+
+
+def _select(
+    record: dict[str, Any], columns: Optional[Mapping[str, str]]
+) -> dict[str, Any]:
+    if columns is None:
+        return record
+    return {
+        kwarg: record[field] for field, kwarg in columns.items()
+        if field in record
+    }
+
+
+@contextmanager
+def _mapped(path: str, buffer: Optional[mmap.mmap]) -> Iterator[memoryview]:
+    # view of the mapped file (workers of an Executor map the file
+    # themselves); blocks are decoded directly from the mapping
+    if buffer is not None:
+        with memoryview(buffer) as view:
+            yield view
+        return
+    with open(path, "rb") as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            with memoryview(buffer) as view:
+                yield view
+
+
+def _decode(view: memoryview, start: int, end: int, encoding: str) -> str:
+    with view[start:end] as block:
+        return str(block, encoding)
+
+
+def _parse_lines(path: str, start: int, text: str) -> list[Any]:
+    # parse block that contains empty lines or errors
+    lines = [line for line in text.split("\n") if line.strip()]
+    try:
+        block = json.loads("[" + ",".join(lines) + "]")
+    except json.JSONDecodeError:
+        pass
+    else:
+        # a record that spans multiple lines would be merged
+        if len(block) == len(lines):
+            return block
+    # repeat line by line to locate the error
+    block = []
+    for line in lines:
+        try:
+            block.append(json.loads(line))
+        except json.JSONDecodeError as exc:
+            raise ValueError(
+                f"Bad JSON-line in '{path}' (block starting at "
+                + f"byte {start}): {line[:100]!r} ({exc})"
+            ) from exc
+    return block
+
+
+def _parse_jsonl(
+    path: str,
+    encoding: str,
+    columns: Optional[Mapping[str, str]],
+    chunk: list[tuple[int, int]],
+    buffer: Optional[mmap.mmap] = None,
+) -> list[dict[str, Any]]:
+    records = []
+    with _mapped(path, buffer) as view:
+        for start, end in chunk:
+            text = _decode(view, start, end, encoding).strip()
+            try:
+                # parse entire block with a single call
+                block = json.loads("[" + text.replace("\n", ",") + "]")
+            except json.JSONDecodeError:
+                block = _parse_lines(path, start, text)
+            else:
+                # one record per line (otherwise a record that spans
+                # multiple lines has been merged)
+                if len(block) != text.count("\n") + 1:
+                    block = _parse_lines(path, start, text)
+            records.extend(_select(record, columns) for record in block)
+    return records
+
+
+def _parse_csv(
+    path: str,
+    encoding: str,
+    columns: Optional[Mapping[str, str]],
+    fieldnames: list[str],
+    dialect: dict[str, Any],
+    chunk: list[tuple[int, int]],
+    buffer: Optional[mmap.mmap] = None,
+) -> list[dict[str, Any]]:
+    records = []
+    with _mapped(path, buffer) as view:
+        for start, end in chunk:
+            # only "\n" separates lines (str.splitlines also splits at
+            # other line boundaries, like "\x0c", within values)
+            reader = csv.DictReader(
+                io.StringIO(_decode(view, start, end, encoding), newline=""),
+                fieldnames=fieldnames,
+                **dialect
+            )
+            records.extend(_select(record, columns) for record in reader)
+    return records
+
+
+def _as_batch(parser, chunk: list[tuple[int, int]]) -> list[Any]:
+    return [parser(chunk)]
+
+
+class _FileSource(metaclass=abc.ABCMeta):
+    """
+    Base class for file-based sources. Files are memory-mapped and split
+    into blocks (at line breaks) of about `block_size` bytes; every
+    block is decoded directly from the mapping and parsed as a whole.
+    If an `executor` is given, blocks are parsed by that `Executor`
+    (workers only receive the byte-range of a block and map the file
+    themselves).
+    """
+
+    def __init__(
+        self,
+        path: str | Path,
+        columns: Optional[Mapping[str, str]] = None,
+        block_size: int = 1 << 20,
+        executor: Optional[Executor] = None,
+        encoding: str = "utf-8",
+    ) -> None:
+        if block_size < 1:
+            raise ValueError(
+                "Block size has to be a positive integer "
+                + f"(got '{block_size}')."
+            )
+        self._path = str(path)
+        self._columns = columns
+        self._block_size = block_size
+        self._executor = executor
+        self._encoding = encoding
+
+    @property
+    def path(self) -> str:
+        """Returns the path of the source file."""
+        return self._path
+
+    @abc.abstractmethod
+    def _parser(
+        self, buffer: mmap.mmap
+    ) -> tuple[Any, int]:  # pragma: no cover
+        """
+        Returns pair of parser for lists of byte-ranges (with optional
+        second argument `buffer`, the mapped file) and position of first
+        record.
+        """
+        raise NotImplementedError("Missing definition of _parser.")
+
+    def batches(self) -> Iterator[list[dict[str, Any]]]:
+        """
+        Returns a generator for lists of records (kwargs for individual
+        `Pipeline.run`s) in order of the file (one list per block).
+        """
+        with open(self._path, "rb") as file:
+            if Path(self._path).stat().st_size == 0:
+                return
+            with mmap.mmap(
+                file.fileno(), 0, access=mmap.ACCESS_READ
+            ) as buffer:
+                parser, start = self._parser(buffer)
+                if self._executor is None:
+                    for block in _ranges(buffer, start, self._block_size):
+                        yield parser([block], buffer)
+                    return
+                yield from map_chunks(
+                    partial(_as_batch, parser),
+                    _ranges(buffer, start, self._block_size), 1,
+                    self._executor
+                )
+
+    def __iter__(self) -> Iterator[dict[str, Any]]:
+        for batch in self.batches():
+            yield from batch
+
+
+class JSONLSource(_FileSource):
+    """
+    Source of kwargs for `Pipeline.run_many` (or `Pipearray.run_many`)
+    that reads a file in JSON-lines format (one JSON-object per line;
+    empty lines are ignored).
+
+    Example usage:
+     >>> from data_plumber import Pipeline, JSONLSource
+     >>> outputs = Pipeline(...).run_many(
+             JSONLSource("input.jsonl", columns={"id": "id_"})
+         )
+
+    Keyword arguments:
+    path -- path to the input file
+    columns -- mapping of field names to kwarg names; if given, only
+               these fields are used
+               (default `None`; all fields are used as they are)
+    block_size -- approximate number of bytes that are parsed at once
+                  (default 1 MiB)
+    executor -- `concurrent.futures.Executor` for parsing blocks (e.g.
+                a `ProcessPoolExecutor`)
+                (default `None`; sequential parsing)
+    encoding -- file encoding
+                (default "utf-8")
+    """
+
+    def _parser(self, buffer):
+        return partial(
+            _parse_jsonl, self._path, self._encoding, self._columns
+        ), 0
+
+
+class CSVSource(_FileSource):
+    """
+    Source of kwargs for `Pipeline.run_many` (or `Pipearray.run_many`)
+    that reads a CSV-file with header line (values are strings). Since
+    the file is split at line breaks, values must not contain line
+    breaks.
+
+    Example usage:
+     >>> from data_plumber import Pipeline, CSVSource
+     >>> outputs = Pipeline(...).run_many(
+             CSVSource("input.csv", columns={"Name": "name"})
+         )
+
+    Keyword arguments:
+    path -- path to the input file
+    columns -- mapping of column names to kwarg names; if given, only
+               these columns are used
+               (default `None`; all columns are used as they are)
+    block_size -- approximate number of bytes that are parsed at once
+                  (default 1 MiB)
+    executor -- `concurrent.futures.Executor` for parsing blocks (e.g.
+                a `ProcessPoolExecutor`)
+                (default `None`; sequential parsing)
+    encoding -- file encoding
+                (default "utf-8")
+    delimiter -- column delimiter
+                 (default ",")
+    """
+
+    def __init__(
+        self,
+        path: str | Path,
+        columns: Optional[Mapping[str, str]] = None,
+        block_size: int = 1 << 20,
+        executor: Optional[Executor] = None,
+        encoding: str = "utf-8",
+        delimiter: str = ",",
+    ) -> None:
+        super().__init__(path, columns, block_size, executor, encoding)
+        self._delimiter = delimiter
+
+    def _parser(self, buffer):
+        end = buffer.find(b"\n")
+        end = len(buffer) if end < 0 else end + 1
+        header = buffer[:end].decode(self._encoding)
+        header = header.lstrip("\ufeff").rstrip("\r\n")
+        fieldnames = next(csv.reader([header], delimiter=self._delimiter))
+        return partial(
+            _parse_csv, self._path, self._encoding, self._columns,
+            fieldnames, {"delimiter": self._delimiter}
+        ), end
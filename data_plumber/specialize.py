@@ -0,0 +1,206 @@
+"""
+# data_plumber/specialize.py
+
+This module defines the partial evaluation of a `Pipeline` against
+constant kwargs (see `Pipeline.specialize`).
+"""
+
+from typing import Optional, Any
+from dataclasses import dataclass
+
+from .context import PipelineContext
+from .error import PipelineError
+from .fork import Fork
+from .lazy import has_lazy, resolve
+from .output import StageRecord
+from .stage import Stage
+
+
+class Constant:
+    """
+    `Callable` that returns a value that has been evaluated ahead of
+    time (replaces `Callable`s of specialized `_PipelineComponent`s;
+    calls are folded by `Pipeline.compile`).
+    """
+    __slots__ = ("value",)
+
+    def __init__(self, value: Any) -> None:
+        self.value = value
+
+    def __call__(self, **kwargs) -> Any:
+        return self.value
+
+
+class ConstantExport(Constant):
+    """`Constant` for `Stage.export` (returns a copy)."""
+    __slots__ = ()
+
+    def __call__(self, **kwargs) -> dict[str, Any]:
+        return self.value.copy()
+
+
+@dataclass(frozen=True)
+class Prefix:
+    """
+    Leading part of every run of a specialized `Pipeline` that has been
+    evaluated ahead of time.
+
+    Keyword arguments:
+    index -- position at which runs continue
+    records -- `StageRecord`s of the evaluated `Stage`s
+    exported -- kwargs exported by the evaluated `Stage`s
+    count -- number of evaluated `Stage`s
+    reason -- reason for exiting if runs end within the prefix ("end",
+              "status", or "fork"; see `Hooks`)
+              (default `None`)
+    """
+    index: int
+    records: tuple[StageRecord, ...]
+    exported: dict[str, Any]
+    count: int
+    reason: Optional[str] = None
+
+    @property
+    def statuses(self) -> dict[str, int]:
+        """Returns latest status of evaluated `Stage`s by identifier."""
+        return {record.id_: record.status for record in self.records}
+
+
+def _foldable(component: Any, known: set[str]) -> bool:
+    return component.depends is not None and component.depends <= known
+
+
+def _evaluate(
+    pipeline: Any, _s: str, s: Stage, kwargs: dict[str, Any],
+    count: Optional[int]
+) -> tuple[dict[str, Any], int, str]:
+    """
+    Returns exported kwargs, status, and message of `Stage` `s`
+    (without persistent data-object).
+    """
+    kwargs = kwargs.copy()
+    lazy = has_lazy(kwargs)
+    if lazy:
+        for function in (s.primer, s.action, s.export):
+            resolve(function, kwargs)
+    primer = s.primer(**kwargs, out=None, count=count)
+    s.action(**kwargs, out=None, primer=primer, count=count)
+    exported = s.export(**kwargs, out=None, primer=primer, count=count)
+    pipeline._validate_external_kwargs(**exported)
+    kwargs.update(exported)
+    if lazy or has_lazy(exported):
+        resolve(s.status, kwargs)
+        resolve(s.message, kwargs)
+    status = s.status(**kwargs, out=None, primer=primer, count=count)
+    message = s.message(
+        **kwargs, out=None, primer=primer, count=count, status=status
+    )
+    return exported, status, message
+
+
+def _prefix(pipeline: Any, constants: dict[str, Any]) -> Prefix:
+    """
+    Evaluate the run of `pipeline` from its start as long as the
+    `_PipelineComponent`s are declared to only depend on `constants`
+    (or kwargs exported in the process).
+    """
+    kwargs = constants.copy()
+    known = set(constants)
+    exported: dict[str, Any] = {}
+    records: list[StageRecord] = []
+    stage_count = -1
+    index = 0
+    reason = None
+    groups = {} if pipeline._scheduler is None \
+        else pipeline._commutative_groups()
+    visited = set()
+    while True:
+        index = pipeline._loop_index(index)
+        if index >= len(pipeline._pipeline):
+            reason = "end"
+            break
+        if index in visited or index in groups:
+            # repetitions and adaptively ordered Stages are left to runs
+            break
+        visited.add(index)
+        _s = pipeline._pipeline[index]
+        s = pipeline._stage_catalog.get(_s)
+        if s is None:  # empty component
+            index = index + 1
+            continue
+        if not _foldable(s, known):
+            break
+        context = PipelineContext(
+            pipeline._pipeline, index, pipeline._loop, records, kwargs, None,
+            stage_count
+        )
+        if isinstance(s, Fork):
+            stage_ref = s.eval(context)
+            if stage_ref is None:
+                reason = "fork"
+                break
+            index = stage_ref.get(context).index
+            continue
+        try:
+            met = pipeline._meets_requirements(_s, context)
+        except PipelineError:
+            # raised again in actual runs
+            break
+        if not met:
+            index = index + 1
+            continue
+        stage_count = stage_count + 1
+        _exported, status, message = _evaluate(
+            pipeline, _s, s, kwargs, stage_count
+        )
+        kwargs.update(_exported)
+        exported.update(_exported)
+        known.update(_exported)
+        records.append(StageRecord(index, _s, message, status))
+        if pipeline._exit_on_status(status):
+            reason = "status"
+            break
+        index = index + 1
+    return Prefix(index, tuple(records), exported, stage_count + 1, reason)
+
+
+def specialize(pipeline: Any, constants: dict[str, Any]) -> None:
+    """
+    Specialize (a copy of a) `Pipeline` in place for `constants` (see
+    `Pipeline.specialize`): `_PipelineComponent`s that only depend on
+    `constants` are replaced by their ahead-of-time results and the
+    leading part of runs is evaluated.
+    """
+    pipeline._validate_external_kwargs(**constants)
+    constants = pipeline._constants | constants
+    pipeline._constants = constants
+    pipeline._reserved_words = pipeline._reserved_words + [
+        name for name in constants if name not in pipeline._reserved_words
+    ]
+    known = set(constants)
+    catalog = {}
+    for _s, s in pipeline._stage_catalog.items():
+        if type(s) is Stage and _foldable(s, known) \
+                and not isinstance(s.status, Constant):
+            exported, status, message = _evaluate(
+                pipeline, _s, s, constants, None
+            )
+            s = Stage(
+                requires=s.requires,
+                export=ConstantExport(exported) if exported else None,
+                status=Constant(status),
+                message=Constant(message),
+                commutative=s.commutative,
+                depends=(),
+            )
+        elif type(s) is Fork and _foldable(s, known) \
+                and not isinstance(s.fork, Constant):
+            s = Fork(
+                Constant(
+                    s.fork(**constants, out=None, count=None, records=None)
+                ),
+                depends=(),
+            )
+        catalog[_s] = s
+    pipeline._stage_catalog = catalog
+    pipeline._prefix = _prefix(pipeline, constants)
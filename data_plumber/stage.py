@@ -5,12 +5,33 @@ This module defines the `Stage`-class, a single data-processing unit of
 a `Pipeline`.
 """
 
-from typing import Optional, Callable, Any
+from typing import Optional, Callable, Any, Iterable
 
 from .component import _PipelineComponent
 from .ref import StageRef, StageById, StageByIncrement
 
 
+# module-level defaults (as opposed to lambdas) keep `Stage`s picklable
+def _default_primer(**kwargs) -> None:
+    return None
+
+
+def _default_action(**kwargs) -> None:
+    return None
+
+
+def _default_export(**kwargs) -> dict[str, Any]:
+    return {}
+
+
+def _default_status(**kwargs) -> int:
+    return 0
+
+
+def _default_message(**kwargs) -> str:
+    return ""
+
+
 class Stage(_PipelineComponent):
     """
     A `Stage` represents a single building block in the processing logic
@@ -55,22 +76,34 @@ class Stage(_PipelineComponent):
                 has not yet been executed
     primer -- `Callable` for pre-processing data
               (kwargs: `out`, `count`)
-              (default `lambda **kwargs: None`)
+              (default `_default_primer`; returns `None`)
     action -- `Callable` for main-step of processing
               (kwargs: `out`, `primer`, `count`)
-              (default `lambda **kwargs: None`)
+              (default `_default_action`; returns `None`)
     export -- `Callable` that returns a dictionary of additional kwargs
               to be exported to the parent `Pipeline`; in the following
               `Stage`s, these kwargs are then available as if they were
               provided with the `Pipeline.run`-command
               (kwargs: `out`, `primer`, `count`)
-              (default `lambda **kwargs: None`)
+              (default `_default_export`; returns `{}`)
     status -- `Callable` for generation of `Stage`'s integer exit status
               (kwargs: `out`, `primer`, `count`)
-              (default `lambda **kwargs: 0`)
+              (default `_default_status`; returns `0`)
     message -- `Callable` for generation of `Stage`'s exit message
                (kwargs: `out`, `primer`, `count`, `status`)
-               (default `lambda **kwargs: ""`)
+               (default `_default_message`; returns `""`)
+    commutative -- if `True`, this `Stage` is declared independent of
+                   other commutative `Stage`s (neither through
+                   requirements nor through `out` or exported kwargs);
+                   consecutive commutative `Stage`s can be reordered
+                   by a `Pipeline` with `reorder=True`
+                   (default `False`)
+    depends -- names of the kwargs that this `Stage`'s `Callable`s
+               depend on exclusively (neither on `out` and `count` nor
+               on other kwargs) without side effects; if all of them
+               are given to `Pipeline.specialize`, the `Stage` is
+               evaluated ahead of time
+               (default `None`; undeclared)
     """
 
     def __init__(
@@ -78,11 +111,13 @@ class Stage(_PipelineComponent):
         requires: Optional[
             dict[StageRef | str | int, int | Callable[[int], bool]]
         ] = None,
-        primer: Callable[..., Any] = lambda **kwargs: None,
-        action: Callable[..., Any] = lambda **kwargs: None,
+        primer: Callable[..., Any] = _default_primer,
+        action: Callable[..., Any] = _default_action,
         export: Optional[Callable[..., Optional[dict[str, Any]]]] = None,
-        status: Callable[..., int] = lambda **kwargs: 0,
-        message: Callable[..., str] = lambda **kwargs: ""
+        status: Callable[..., int] = _default_status,
+        message: Callable[..., str] = _default_message,
+        commutative: bool = False,
+        depends: Optional[Iterable[str]] = None
     ) -> None:
         if requires is None:
             self._requires = None
@@ -98,11 +133,13 @@ class Stage(_PipelineComponent):
         self._primer = primer
         self._action = action
         if export is None:
-            self._export: Callable[..., dict[str, Any]] = lambda **kwargs: {}
+            self._export: Callable[..., dict[str, Any]] = _default_export
         else:
             self._export = export  # type: ignore[assignment]
         self._status = status
         self._message = message
+        self._commutative = commutative
+        self._depends = None if depends is None else frozenset(depends)
         super().__init__()
 
     @property
@@ -136,3 +173,16 @@ class Stage(_PipelineComponent):
     def message(self) -> Callable[..., str]:
         """Returns a `Stage`'s `message` callable."""
         return self._message
+
+    @property
+    def commutative(self) -> bool:
+        """Returns `True` if `Stage` is declared commutative."""
+        return self._commutative
+
+    @property
+    def depends(self) -> Optional[frozenset[str]]:
+        """
+        Returns names of the kwargs that the `Stage` is declared to
+        depend on (`None` if undeclared).
+        """
+        return self._depends
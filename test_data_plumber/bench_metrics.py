@@ -0,0 +1,50 @@
+"""
+Benchmark for the overhead of recording metrics (`MetricsRegistry`) in
+`Pipeline.run` and compiled `Pipeline`s.
+
+Run with
+python test_data_plumber/bench_metrics.py [--stages 8] [--runs 20000]
+"""
+
+from typing import Optional
+import argparse
+
+from data_plumber import Pipeline, Stage, MetricsRegistry
+from data_plumber.bench import benchmark
+
+
+def build(stages: int, metrics: Optional[MetricsRegistry]) -> Pipeline:
+    """Returns `Pipeline` of `stages` trivial `Stage`s."""
+    return Pipeline(
+        *(Stage(status=lambda **kwargs: 0) for _ in range(stages)),
+        metrics=metrics
+    )
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--stages", type=int, default=8)
+    parser.add_argument("--runs", type=int, default=20000)
+    parser.add_argument("--warmup", type=int, default=1000)
+    args = parser.parse_args(argv)
+
+    print(f"{args.stages} Stages, {args.runs} runs (median latency)")
+    for compiled in (False, True):
+        medians = []
+        for metrics in (None, MetricsRegistry()):
+            result = benchmark(
+                build(args.stages, metrics), [{"x": 1}], runs=args.runs,
+                warmup=args.warmup, compiled=compiled
+            )
+            medians.append(result.percentile(50) or 0.0)
+        print(
+            f"{'compiled' if compiled else 'generic':>8}: "
+            + f"{medians[0] * 1e6:8.2f} us without metrics, "
+            + f"{medians[1] * 1e6:8.2f} us with metrics "
+            + f"(+{(medians[1] - medians[0]) * 1e6:.2f} us, "
+            + f"+{(medians[1] / medians[0] - 1) * 100:.0f}%)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Benchmark for the thread scaling (runs per second by number of threads)
+of `Pipeline`s, compiled `Pipeline`s, and `FrozenPipeline`s.
+
+Run with
+python test_data_plumber/bench_threads.py [--stages 8] [--runs 20000]
+(e.g. with python3.13t to measure a free-threaded build)
+"""
+
+from typing import Optional
+import argparse
+import sys
+
+from data_plumber import Pipeline, Stage
+from data_plumber.bench import benchmark
+
+
+def build(stages: int) -> Pipeline:
+    """Returns `Pipeline` of `stages` `Stage`s with some work."""
+    return Pipeline(
+        *(
+            Stage(
+                status=lambda x, **kwargs: sum(range(x)) % 2,
+                message=lambda status, **kwargs: str(status)
+            ) for _ in range(stages)
+        )
+    )
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--stages", type=int, default=8)
+    parser.add_argument("--runs", type=int, default=20000)
+    parser.add_argument("--warmup", type=int, default=1000)
+    parser.add_argument(
+        "--threads", type=int, nargs="+", default=[1, 2, 4, 8, 16]
+    )
+    args = parser.parse_args(argv)
+
+    gil = getattr(sys, "_is_gil_enabled", lambda: True)()
+    print(
+        f"{args.stages} Stages, {args.runs} runs (runs per second; "
+        + f"Python {sys.version.split()[0]}, "
+        + f"GIL {'enabled' if gil else 'disabled'})"
+    )
+    print(f"{'threads':>8}" + "".join(f"{n:>10}" for n in args.threads))
+    for name in ("generic", "compiled", "frozen"):
+        pipeline = build(args.stages)
+        if name == "frozen":
+            pipeline = pipeline.freeze()
+        throughputs = [
+            benchmark(
+                pipeline, [{"x": 16}], concurrency=threads, runs=args.runs,
+                warmup=args.warmup, compiled=name == "compiled"
+            ).throughput
+            for threads in args.threads
+        ]
+        print(
+            f"{name:>8}" + "".join(f"{value:10.0f}" for value in throughputs)
+        )
+
+
+if __name__ == "__main__":
+    main()
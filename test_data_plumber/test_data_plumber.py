@@ -3,23 +3,56 @@ Test suite for data-plumber.
 
 Run with
 pytest -v -s --cov=data_plumber.array \
+    --cov=data_plumber.batch \
+    --cov=data_plumber.bench \
+    --cov=data_plumber.capture \
+    --cov=data_plumber.compiler \
     --cov=data_plumber.component \
     --cov=data_plumber.context \
     --cov=data_plumber.error \
+    --cov=data_plumber.explain \
     --cov=data_plumber.fork \
+    --cov=data_plumber.handle \
+    --cov=data_plumber.history \
+    --cov=data_plumber.hooks \
+    --cov=data_plumber.lazy \
+    --cov=data_plumber.memory \
+    --cov=data_plumber.metrics \
     --cov=data_plumber.output \
     --cov=data_plumber.pipeline \
+    --cov=data_plumber.profile \
     --cov=data_plumber.ref \
+    --cov=data_plumber.registry \
+    --cov=data_plumber.resource \
+    --cov=data_plumber.schedule \
+    --cov=data_plumber.specialize \
+    --cov=data_plumber.sink \
+    --cov=data_plumber.source \
     --cov=data_plumber.stage
 """
 
+import os
+import asyncio
+import json
+import tracemalloc
+from time import monotonic, sleep, time
+from threading import Event, Thread
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
 import pytest
 from data_plumber \
     import Pipeline, Stage, Previous, First, Last, Next, Skip, Fork, \
         PreviousN, NextN, StageById, StageByIndex, StageByIncrement, \
-        PipelineError, Pipearray
+        PipelineError, BudgetExceededError, Pipearray, Resource, \
+        PipelineProfile, Lazy, JSONLSource, CSVSource, JSONLSink, CSVSink, \
+        SQLiteSink, RunHistory, Projection, MetricsRegistry, \
+        Hooks, MemoryProfile, Capture, PipelineHandle, PipelineRegistry
+from data_plumber.bench import benchmark, main as bench_main
+from data_plumber.capture import load_capture, replay
+from data_plumber.compiler import generate_source
 from data_plumber.context import PipelineContext
-from data_plumber.output import PipelineOutput
+from data_plumber.output import PipelineOutput, StageRecord
+from data_plumber import source as source_module
 
 
 # #############################
@@ -1418,3 +1451,2324 @@ def test_next_loop(stageref):
     )
 
     assert ref.index == 0
+
+
+# #############################
+# ### Pipeline.run budgets
+
+def test_pipeline_run_max_stages():
+    """
+    Test method `run` of class `Pipeline` with `max_stages`-budget.
+    """
+
+    pipeline = Pipeline(
+        Stage(message=lambda count, **kwargs: str(count)),
+        loop=True
+    )
+
+    with pytest.raises(BudgetExceededError) as exc_info:
+        pipeline.run(max_stages=3)
+
+    assert exc_info.value.reason == "max_stages"
+    assert len(exc_info.value.output.records) == 3
+    assert exc_info.value.output.last_message == "2"
+
+    # budget not exhausted
+    assert len(Pipeline(Stage(), Stage()).run(max_stages=2).records) == 2
+
+
+def test_pipeline_run_max_steps():
+    """
+    Test method `run` of class `Pipeline` with `max_steps`-budget for
+    loops without `Stage`s.
+    """
+
+    pipeline = Pipeline(
+        Stage(),
+        "label",
+        Fork(lambda **kwargs: "label"),
+    )
+    for run in (pipeline.run, pipeline.compile(), pipeline.freeze().run):
+        with pytest.raises(BudgetExceededError) as exc_info:
+            run(max_steps=10, max_stages=5)
+        assert exc_info.value.reason == "max_steps"
+        assert len(exc_info.value.output.records) == 1
+
+    # Stages with unmet requirements are counted as well
+    with pytest.raises(BudgetExceededError) as exc_info:
+        Pipeline(
+            "a", "loop", "b", "fork",
+            a=Stage(status=lambda **kwargs: 1),
+            b=Stage(requires={"a": 0}),
+            fork=Fork(lambda **kwargs: "loop"),
+        ).run(max_steps=7, max_stages=5)
+    assert len(exc_info.value.output.records) == 1
+    assert len(Pipeline(Stage(), Stage()).run(max_steps=2).records) == 2
+
+    # names of budgets cannot be exported
+    with pytest.raises(PipelineError):
+        Pipeline(
+            Stage(export=lambda **kwargs: {"deadline": 0})
+        ).run()
+
+
+def test_pipeline_run_deadline():
+    """
+    Test method `run` of class `Pipeline` with `deadline`-budget.
+    """
+
+    pipeline = Pipeline(
+        Stage(),
+        Fork(lambda **kwargs: First),
+    )
+
+    with pytest.raises(BudgetExceededError) as exc_info:
+        pipeline.run(deadline=monotonic() + 0.01)
+
+    assert exc_info.value.reason == "deadline"
+    assert len(exc_info.value.output.records) > 0
+
+
+def test_pipeline_run_cancel():
+    """
+    Test method `run` of class `Pipeline` with `cancel`-budget.
+    """
+
+    cancel = Event()
+    pipeline = Pipeline(
+        Stage(),
+        Stage(action=lambda **kwargs: cancel.set()),
+        Stage(),
+        finalize_output=lambda data, **kwargs: data.update({"final": 0})
+    )
+
+    with pytest.raises(BudgetExceededError) as exc_info:
+        pipeline.run(cancel=cancel)
+
+    assert exc_info.value.reason == "cancel"
+    assert len(exc_info.value.output.records) == 2
+    assert "final" not in exc_info.value.output.data
+
+
+def test_pipearray_run_budgets():
+    """Test method `run` of `Pipearray` with budgets."""
+
+    with pytest.raises(BudgetExceededError):
+        Pipearray(
+            Pipeline(Stage()),
+            Pipeline(Stage(), Stage()),
+        ).run(max_stages=1)
+
+
+# #############################
+# ### Resource
+
+class _Connection:
+    """Dummy connection for `Resource`-tests."""
+    created = 0
+    closed = 0
+
+    def __init__(self):
+        _Connection.created += 1
+
+    def close(self):
+        _Connection.closed += 1
+
+
+@pytest.fixture(name="connection")
+def _connection():
+    _Connection.created = 0
+    _Connection.closed = 0
+    return _Connection
+
+
+def test_pipeline_resources_minimal(connection):
+    """Test `Resource`s of class `Pipeline` for single thread."""
+
+    pipeline = Pipeline(
+        Stage(
+            message=lambda db, **kwargs: type(db).__name__
+        ),
+        resources={"db": connection}
+    )
+
+    output = pipeline.run(arg=0)
+    assert output.last_message == "_Connection"
+    assert output.kwargs == {"arg": 0}
+    pipeline.run()
+    assert connection.created == 1
+    pipeline.close()
+    assert connection.closed == 1
+    pipeline.run()
+    assert connection.created == 2
+
+
+def test_pipeline_resources_reserved(connection):
+    """Test `Resource`-names being reserved in `Pipeline.run`."""
+
+    pipeline = Pipeline(
+        Stage(export=lambda **kwargs: {"db": 0}),
+        resources={"db": connection}
+    )
+    with pytest.raises(PipelineError):
+        pipeline.run(db=0)
+    with pytest.raises(PipelineError):
+        pipeline.run()
+
+
+def test_pipeline_resources_per_thread(connection):
+    """
+    Test `Resource`s of class `Pipeline` being created once per thread
+    and closed on thread exit.
+    """
+
+    pipeline = Pipeline(
+        Stage(message=lambda db, **kwargs: str(id(db))),
+        resources={"db": connection}
+    )
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        ids = set(
+            o.last_message
+            for o in executor.map(lambda _: pipeline.run(), range(20))
+        )
+    assert connection.created == len(ids)
+    assert connection.created <= 2
+    assert connection.closed == connection.created
+
+
+def test_pipeline_resources_pool(connection):
+    """Test pooled `Resource`s of class `Pipeline`."""
+
+    with Pipeline(
+        Stage(action=lambda **kwargs: sleep(0.001)),
+        resources={"db": Resource(connection, pool_size=1)}
+    ) as pipeline:
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            list(executor.map(lambda _: pipeline.run(), range(20)))
+        assert connection.created == 1
+    assert connection.closed == 1
+
+
+def test_pipeline_resources_thread_bound():
+    """
+    Test per-thread `Resource`s being closed by their own threads.
+    """
+    import sqlite3
+
+    closed = []
+
+    def close(connection):
+        connection.close()  # raises if called from another thread
+        closed.append(connection)
+
+    pipeline = Pipeline(
+        Stage(
+            primer=lambda db, **kwargs: db.execute("SELECT 1").fetchone()
+        ),
+        resources={
+            "db": Resource(
+                lambda: sqlite3.connect(":memory:", check_same_thread=True),
+                close=close
+            )
+        }
+    )
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        executor.submit(pipeline.run).result()
+        pipeline.run()
+        pipeline.close()
+        assert len(closed) == 1  # instance of calling thread
+        executor.submit(pipeline.run).result()
+        assert len(closed) == 2  # stale instance closed by its thread
+    assert len(closed) == 3
+
+
+def test_resource_pool_close_borrowed(connection):
+    """Test closing a pooled `Resource` while instances are borrowed."""
+
+    resource = Resource(connection, pool_size=2)
+    borrowed = resource.acquire()
+    resource.release(resource.acquire())
+    resource.close()
+    assert connection.closed == 1
+    resource.release(borrowed)
+    assert connection.closed == 2
+    assert resource.acquire() is not borrowed
+
+
+def test_resource_bad_pool_size():
+    """Test constructor of class `Resource` with bad pool size."""
+
+    with pytest.raises(ValueError):
+        Resource(lambda: None, pool_size=0)
+
+
+# #############################
+# ### Pipearray share_stages
+
+@pytest.mark.parametrize(
+    ("share_stages", "expected_calls"),
+    [
+        (False, 8),
+        (True, 6),
+    ]
+)
+def test_pipearray_share_stages(share_stages, expected_calls):
+    """Test `Pipearray` re-using results of shared `Stage`s."""
+
+    calls = []
+    shared_a = Stage(
+        action=lambda **kwargs: calls.append("a"),
+        export=lambda **kwargs: {"exported": 1},
+        message=lambda **kwargs: "a",
+    )
+    shared_b = Stage(
+        requires={Previous: 0},
+        action=lambda **kwargs: calls.append("b"),
+    )
+    output = Pipearray(
+        p=Pipeline(
+            shared_a, shared_b,
+            Stage(
+                action=lambda **kwargs: calls.append("c"),
+                message=lambda exported, **kwargs: str(exported),
+            ),
+        ),
+        q=Pipeline(
+            shared_a, shared_b,
+            Stage(action=lambda **kwargs: calls.append("d")),
+        ),
+        r=Pipeline(
+            Stage(action=lambda **kwargs: calls.append("e")),
+            shared_a,
+        ),
+        share_stages=share_stages
+    ).run()
+
+    assert len(calls) == expected_calls
+    assert output["p"].records == [("a", 0), ("", 0), ("1", 0)]
+    assert output["p"].records[:2] == output["q"].records[:2]
+    assert output["q"].kwargs == {"exported": 1}
+    assert output["r"].records[1].index == 1
+
+
+def test_pipearray_share_stages_fork():
+    """Test `Pipearray` not sharing `Stage`-results after a `Fork`."""
+
+    calls = []
+    shared = Stage(action=lambda **kwargs: calls.append(0))
+    fork = Fork(lambda **kwargs: Next)
+    Pipearray(
+        Pipeline(fork, shared),
+        Pipeline(fork, shared),
+        share_stages=True
+    ).run()
+
+    assert len(calls) == 2
+
+
+def test_pipearray_share_stages_static_requirement():
+    """
+    Test `Pipearray` not sharing `Stage`-results if requirements refer
+    to the arrangement of the `Pipeline`.
+    """
+
+    calls = []
+    first = Stage(action=lambda **kwargs: calls.append("first"))
+    shared = Stage(
+        requires={StageByIndex(0): 0},
+        action=lambda **kwargs: calls.append("shared")
+    )
+    Pipearray(
+        Pipeline(first, shared), Pipeline(first, shared), share_stages=True
+    ).run()
+
+    assert calls == ["first", "shared", "shared"]
+
+
+@pytest.mark.parametrize(
+    "bind",
+    [
+        lambda stage, value: Pipeline(
+            stage, resources={"value": Resource(lambda: value)}
+        ),
+        lambda stage, value: Pipeline(stage).specialize(value=value),
+    ],
+    ids=["resources", "constants"]
+)
+def test_pipearray_share_stages_bound_kwargs(bind):
+    """
+    Test `Pipearray` not sharing `Stage`-results with `Pipeline`s that
+    have `Resource`s or constants.
+    """
+
+    shared = Stage(message=lambda value, **kwargs: str(value))
+    output = Pipearray(
+        bind(shared, 1), bind(shared, 2), share_stages=True
+    ).run()
+
+    assert [o.last_message for o in output] == ["1", "2"]
+
+
+def test_pipearray_share_stages_process_pool():
+    """Test `Pipearray` disabling shared `Stage`s for process pools."""
+
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        array = Pipearray(
+            Pipeline(), share_stages=True, executor=executor
+        )
+        assert array._shared_cache() is None
+    assert Pipearray(Pipeline(), share_stages=True)._shared_cache() == {}
+
+
+# #############################
+# ### Pipearray executor/reductions
+
+def test_pipearray_run_executor():
+    """Test method `run` of `Pipearray` with executor."""
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        output = Pipearray(
+            Pipeline(
+                Stage(
+                    action=lambda **kwargs: sleep(0.01),
+                    status=lambda **kwargs: 0
+                )
+            ),
+            Pipeline(Stage(status=lambda **kwargs: 1)),
+            executor=executor
+        ).run()
+
+    assert [o.last_status for o in output] == [0, 1]
+
+
+def _reduction_pipearray(calls, executor=None):
+    return Pipearray(
+        a=Pipeline(Stage(
+            action=lambda **kwargs: calls.append("a"),
+            status=lambda **kwargs: 0
+        )),
+        b=Pipeline(Stage(
+            action=lambda **kwargs: calls.append("b"),
+            status=lambda **kwargs: 2
+        )),
+        c=Pipeline(Stage(
+            action=lambda **kwargs: calls.append("c"),
+            status=lambda **kwargs: 1
+        )),
+        executor=executor
+    )
+
+
+@pytest.mark.parametrize(
+    ("reduction", "args", "expected_result", "expected_calls"),
+    [
+        ("any_status", (0,), True, ["a"]),
+        ("any_status", (1,), True, ["a", "b", "c"]),
+        ("any_status", (3,), False, ["a", "b", "c"]),
+        ("any_status", (lambda status: status > 1,), True, ["a", "b"]),
+        ("all_ok", (), False, ["a", "b"]),
+        ("all_ok", (lambda status: status < 3,), True, ["a", "b", "c"]),
+        ("worst_status", (), 2, ["a", "b", "c"]),
+        ("worst_status", (2,), 2, ["a", "b"]),
+    ]
+)
+def test_pipearray_reductions(reduction, args, expected_result, expected_calls):
+    """Test short-circuiting reductions of `Pipearray`."""
+
+    calls = []
+    assert getattr(_reduction_pipearray(calls), reduction)(*args) \
+        == expected_result
+    assert calls == expected_calls
+
+
+def test_pipearray_first_failure():
+    """Test method `first_failure` of `Pipearray`."""
+
+    calls = []
+    label, output = _reduction_pipearray(calls).first_failure()
+    assert label == "b"
+    assert output.last_status == 2
+    assert calls == ["a", "b"]
+
+    assert Pipearray(Pipeline(), Pipeline(Stage())).first_failure() is None
+
+
+def test_pipearray_reductions_cancel_pending():
+    """
+    Test short-circuiting reductions of `Pipearray` cancelling pending
+    `Pipeline`s when using an executor.
+    """
+
+    calls = []
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        array = Pipearray(
+            Pipeline(Stage(status=lambda **kwargs: 1)),
+            Pipeline(
+                Stage(action=lambda **kwargs: calls.append(0)),
+                loop=True
+            ),
+            executor=executor
+        )
+        assert array.any_status(1)
+        assert not array.all_ok()
+    # executor shuts down only if the infinite Pipeline has been either
+    # cancelled or interrupted
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        array = Pipearray(
+            Pipeline(Stage(
+                action=lambda **kwargs: sleep(0.01),
+                status=lambda **kwargs: 1
+            )),
+            Pipeline(
+                Stage(action=lambda **kwargs: calls.append(0)),
+                loop=True
+            ),
+            executor=executor
+        )
+        assert array.worst_status(1) == 1
+    # infinite Pipeline has been interrupted
+    assert len(calls) > 0
+
+
+def _slow_fast_pipearray(executor=None):
+    return Pipearray(
+        slow=Pipeline(Stage(
+            action=lambda **kwargs: sleep(0.05),
+            message=lambda **kwargs: "slow"
+        )),
+        fast=Pipeline(Stage(message=lambda **kwargs: "fast")),
+        executor=executor
+    )
+
+
+def test_pipearray_run_iter():
+    """Test method `run_iter` of `Pipearray`."""
+
+    assert [
+        label for label, _ in _slow_fast_pipearray().run_iter()
+    ] == ["slow", "fast"]
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        outputs = list(_slow_fast_pipearray(executor).run_iter())
+    assert [label for label, _ in outputs] == ["fast", "slow"]
+    assert [o.last_message for _, o in outputs] == ["fast", "slow"]
+
+
+def test_pipearray_run_iter_async():
+    """Test method `run_iter_async` of `Pipearray`."""
+
+    async def collect(array, **kwargs):
+        return [
+            label async for label, _ in array.run_iter_async(**kwargs)
+        ]
+
+    assert asyncio.run(collect(_slow_fast_pipearray())) == ["fast", "slow"]
+
+    with pytest.raises(BudgetExceededError) as exc_info:
+        asyncio.run(
+            collect(_slow_fast_pipearray(), deadline=monotonic() + 0.01)
+        )
+    assert exc_info.value.reason == "deadline"
+
+
+# #############################
+# ### run_many
+
+def _status_from_value(value, **kwargs):
+    return value % 3
+
+
+def _message_from_pid(**kwargs):
+    return str(os.getpid())
+
+
+def _run_many_pipeline():
+    return Pipeline(
+        Stage(status=_status_from_value, message=_message_from_pid)
+    )
+
+
+@pytest.mark.parametrize(
+    "executor", [None, ThreadPoolExecutor, ProcessPoolExecutor]
+)
+def test_pipeline_run_many(executor):
+    """Test method `run_many` of `Pipeline`."""
+
+    pipeline = _run_many_pipeline()
+    inputs = ({"value": i} for i in range(100))
+    if executor is None:
+        outputs = list(pipeline.run_many(inputs, chunksize=7, other=0))
+    else:
+        with executor(max_workers=2) as _executor:
+            outputs = list(
+                pipeline.run_many(
+                    inputs, executor=_executor, chunksize=7, other=0
+                )
+            )
+
+    assert [o.last_status for o in outputs] == [i % 3 for i in range(100)]
+    assert outputs[5].kwargs == {"value": 5, "other": 0}
+    if executor is ProcessPoolExecutor:
+        assert str(os.getpid()) not in {o.last_message for o in outputs}
+
+
+def test_pipeline_run_many_worker_cache():
+    """
+    Test packing of `Pipeline`s for worker processes and the bounded
+    cache of `Pipeline`s in worker processes.
+    """
+
+    from data_plumber import batch
+
+    pipelines = [
+        _run_many_pipeline() for _ in range(batch.WORKER_CACHE_SIZE + 1)
+    ]
+    assert batch.pack(pipelines, None) is pipelines
+
+    closed = []
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        packed = batch.pack(pipelines, executor)
+        # Pipelines are pickled once per version
+        assert batch.pack(pipelines[:1], executor)[0].payload \
+            is packed[0].payload
+        pipelines[0].append(Stage())
+        assert batch.pack(pipelines[:1], executor)[0].token \
+            != packed[0].token
+
+    try:
+        first = batch._worker_pipeline(packed[0])
+        first.close = lambda: closed.append(first)
+        assert batch._worker_pipeline(packed[0]) is first
+        for p in packed[1:]:
+            batch._worker_pipeline(p)
+        assert closed == [first]
+        assert len(batch._worker_pipelines) == batch.WORKER_CACHE_SIZE
+    finally:
+        batch._worker_pipelines.clear()
+
+
+def test_pipeline_run_many_bad_chunksize():
+    """Test method `run_many` of `Pipeline` with bad chunk size."""
+
+    with pytest.raises(ValueError):
+        list(Pipeline().run_many([{}], chunksize=0))
+
+
+@pytest.mark.parametrize("executor", [None, ProcessPoolExecutor])
+def test_pipearray_run_many(executor):
+    """Test methods `run_many` and `status_matrix` of `Pipearray`."""
+
+    def _array(_executor):
+        return Pipearray(
+            a=_run_many_pipeline(),
+            b=Pipeline(Stage(status=_status_from_value), Stage()),
+            executor=_executor
+        )
+
+    inputs = [{"value": i} for i in range(10)]
+    if executor is None:
+        outputs = list(_array(None).run_many(inputs, chunksize=3))
+        matrix = _array(None).status_matrix(inputs, chunksize=3)
+    else:
+        with executor(max_workers=2) as _executor:
+            outputs = list(_array(_executor).run_many(inputs, chunksize=3))
+            matrix = _array(_executor).status_matrix(inputs, chunksize=3)
+
+    assert len(outputs) == 10
+    assert outputs[4]["a"].last_status == 1
+    assert outputs[4]["b"].last_status == 0
+    assert matrix == {
+        "a": [i % 3 for i in range(10)],
+        "b": [0] * 10,
+    }
+    assert Pipearray(_run_many_pipeline()).status_matrix(inputs[:2]) \
+        == {0: [0, 1]}
+
+
+# #############################
+# ### Pipeline.compile
+
+def _compile_test_pipelines():
+    return [
+        Pipeline(),
+        Pipeline(
+            Stage(
+                primer=lambda value=None, **kwargs: isinstance(value, list),
+                status=lambda primer, **kwargs: 0 if primer else 1,
+                message=lambda primer, **kwargs: "" if primer else "bad",
+            ),
+            Stage(
+                requires={Previous: 0},
+                action=lambda out, value, **kwargs: out.update(n=len(value)),
+                export=lambda value, **kwargs: {"first": value[:1]},
+                message=lambda first, **kwargs: str(first),
+            ),
+            "label",
+            "a",
+            "c",
+            Stage(
+                requires={"c": 0},
+                message=lambda **kwargs: "requires c",
+            ),
+            Stage(
+                requires={-1: lambda status: status == 0, "a": 2},
+                status=lambda count, **kwargs: count,
+            ),
+            Stage(requires={"a": 0}),
+            a=Stage(status=lambda **kwargs: 2),
+            c=Stage(message=lambda count, **kwargs: f"c{count}"),
+            finalize_output=lambda data, records, **kwargs:
+                data.update(records=len(records)),
+        ),
+        Pipeline(
+            Stage(status=lambda **kwargs: 1),
+            Stage(requires={First: 1}, status=lambda **kwargs: 2),
+            Stage(),
+            exit_on_status=lambda status: status > 1,
+        ),
+        Pipeline(
+            Stage(
+                action=lambda out, **kwargs:
+                    out.update(n=out.get("n", 0) + 1),
+                status=lambda out, **kwargs: out["n"],
+            ),
+            loop=True,
+            exit_on_status=5,
+        ),
+        Pipeline(Stage(requires={Previous: 0})),
+    ]
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [{}, {"value": 1}, {"value": [1, 2]}]
+)
+@pytest.mark.parametrize(
+    "index", range(len(_compile_test_pipelines()))
+)
+def test_pipeline_compile_equivalence(index, kwargs):
+    """
+    Test method `compile` of class `Pipeline` generating identical
+    output to `run`.
+    """
+
+    def _output(run):
+        try:
+            return run(**kwargs)
+        except (PipelineError, TypeError) as exc_info:
+            return type(exc_info), str(exc_info)
+
+    pipeline = _compile_test_pipelines()[index]
+    assert _output(pipeline.compile()) == _output(pipeline.run)
+
+
+def test_pipeline_compile_budgets():
+    """
+    Test method `compile` of class `Pipeline` with budgets.
+    """
+
+    run = Pipeline(Stage(), loop=True).compile()
+    with pytest.raises(BudgetExceededError) as exc_info:
+        run(max_stages=4)
+    assert len(exc_info.value.output.records) == 4
+
+    cancel = Event()
+    cancel.set()
+    with pytest.raises(BudgetExceededError) as exc_info:
+        run(cancel=cancel)
+    assert exc_info.value.reason == "cancel"
+
+
+def test_pipeline_compile_cache():
+    """
+    Test method `compile` of class `Pipeline` caching generated code
+    per version of `Pipeline`.
+    """
+
+    pipeline = Pipeline(Stage(message=lambda **kwargs: "a"))
+    run = pipeline.compile()
+    assert pipeline.compile() is run
+    assert run().last_message == "a"
+
+    pipeline.append(Stage(message=lambda **kwargs: "b"))
+    assert pipeline.compile() is not run
+    assert pipeline.compile()().last_message == "b"
+
+
+def _fork_pipeline(**kwargs):
+    return Pipeline(
+        Stage(
+            export=lambda value, **kwargs: {"value": value + 1},
+            status=lambda value, **kwargs: value % 2,
+        ),
+        Fork(
+            lambda value, **kwargs: (
+                None if value > 6 else ("a" if value % 3 else Previous)
+            )
+        ),
+        Stage(message=lambda **kwargs: "skipped"),
+        "a",
+        Fork(lambda **kwargs: StageByIndex(0)),
+        a=Stage(
+            requires={Previous: 1},
+            message=lambda value, **kwargs: f"a{value}",
+        ),
+        **kwargs
+    )
+
+
+@pytest.mark.parametrize("value", [0, 1, 2, 5, 7])
+def test_pipeline_compile_fork(value):
+    """
+    Test method `compile` of class `Pipeline` for `Pipeline` with
+    `Fork`s.
+    """
+
+    expected = _fork_pipeline().run(value=value)
+    for p in (
+        _fork_pipeline(),
+        _fork_pipeline(profile=PipelineProfile.from_dict(
+            {"forks": {"1": {"3": 5, "0": 1}, "4": {"0": 2}}}
+        )),
+    ):
+        output = p.compile()(value=value)
+        assert [(r.index, r.message, r.status) for r in output.records] \
+            == [(r.index, r.message, r.status) for r in expected.records]
+        assert output.kwargs == expected.kwargs
+
+
+def test_pipeline_profile_recording():
+    """Test recording of `PipelineProfile` in `Pipeline.run`."""
+
+    profile = PipelineProfile()
+    p = _fork_pipeline(profile=profile)
+    p.run(value=3)
+    assert p.profile is profile
+    assert profile.forks == {1: {3: 2, 0: 1, None: 1}, 4: {0: 2}}
+    assert profile.runs("a") == 1
+    assert profile.failure_rate("a") == 0
+    assert profile.failure_rate(p._pipeline[0]) == 0.5
+    assert profile.failure_rate("unknown") is None
+    assert profile.hot_targets() == {1: 3, 4: 0}
+
+    # compiled version records the same
+    p.compile()(value=3)
+    assert profile.forks == {1: {3: 4, 0: 2, None: 2}, 4: {0: 4}}
+    assert profile.runs("a") == 2
+
+
+def test_pipeline_profile_hot_path():
+    """
+    Test method `compile` of class `Pipeline` with `PipelineProfile`.
+    """
+
+    profile = PipelineProfile()
+    p = _fork_pipeline(profile=profile)
+    cold = p.compile()
+    for _ in range(3):
+        p.run(value=2)
+    hot = p.compile()
+    assert hot is not cold
+    assert hot is p.compile()
+    assert hot(value=2).records[2:] == p.run(value=2).records[2:]
+
+
+def test_pipeline_profile_save_load(tmp_path):
+    """Test methods `save` and `load` of class `PipelineProfile`."""
+
+    profile = PipelineProfile()
+    _fork_pipeline(profile=profile).run(value=5)
+    profile.save(tmp_path / "profile.json")
+    loaded = PipelineProfile.load(tmp_path / "profile.json")
+    assert loaded.forks == profile.forks
+    assert loaded.stages == profile.stages
+
+
+# #############################
+# ### Pipeline reorder
+
+def _reorder_pipeline(calls, **kwargs):
+    def check(name, status):
+        def _(**kwargs):
+            calls.append(name)
+            return status
+        return _
+    return Pipeline(
+        "a", "b", "c", "d",
+        a=Stage(status=check("a", 0), commutative=True),
+        b=Stage(status=check("b", 0), commutative=True),
+        c=Stage(status=check("c", 1), commutative=True),
+        d=Stage(status=check("d", 0)),
+        **({"exit_on_status": 1} | kwargs)
+    )
+
+
+def test_pipeline_reorder():
+    """Test argument `reorder` of class `Pipeline`."""
+
+    calls = []
+    p = _reorder_pipeline(calls, reorder=True)
+    output = p.run()
+    assert calls == ["a", "b", "c"]
+    assert [r.index for r in output.records] == [0, 1, 2]
+
+    # failing Stage is moved to the front
+    calls.clear()
+    output = p.run()
+    assert calls == ["c"]
+    assert [r.index for r in output.records] == [2]
+    assert output.last_status == 1
+
+    # same in compiled version
+    calls.clear()
+    assert p.compile()().last_status == 1
+    assert calls == ["c"]
+
+
+def test_pipeline_reorder_disabled():
+    """Test `Stage`s with `commutative=True` in `Pipeline` by default."""
+
+    calls = []
+    p = _reorder_pipeline(calls)
+    p.run()
+    p.run()
+    assert calls == ["a", "b", "c"] * 2
+
+
+def test_pipeline_reorder_continue():
+    """
+    Test argument `reorder` of class `Pipeline` for execution after
+    group of commutative `Stage`s.
+    """
+
+    calls = []
+    p = _reorder_pipeline(calls, reorder=True, exit_on_status=2)
+    p.run()
+    calls.clear()
+    p._scheduler.record(2, True, 0)
+    output = p.run()
+    assert calls == ["c", "a", "b", "d"]
+    assert [r.index for r in output.records] == [0, 1, 2, 3]
+    assert set(p._scheduler.stats) == {0, 1, 2}
+
+
+@pytest.mark.parametrize("relative", [True, False])
+def test_pipeline_reorder_later_requirements(relative):
+    """
+    Test argument `reorder` of class `Pipeline` not leaking the learned
+    order into requirements, records, and status of later `Stage`s.
+    """
+
+    calls = []
+    p = Pipeline(
+        "a", "b", "c",
+        a=Stage(status=lambda **kwargs: 2, commutative=True),
+        b=Stage(
+            status=lambda x, **kwargs: 1 if x else 0, commutative=True
+        ),
+        c=Stage(
+            requires={Previous if relative else StageById("b"): 0},
+            action=lambda **kwargs: calls.append("c"),
+        ),
+        exit_on_status=1,
+        reorder=True
+    )
+    before = p.run(x=False)
+    p.run(x=True)
+    after = p.run(x=False)
+
+    assert calls == ["c", "c"]
+    assert after.records == before.records
+    assert [r.index for r in after.records] == [0, 1, 2]
+    assert (after.last_status, after.last_message) \
+        == (before.last_status, before.last_message)
+    assert p._commutative_groups() == ({} if relative else {0: 2})
+
+
+def test_commutative_groups():
+    """Test function `commutative_groups`."""
+
+    stages = [
+        Stage(commutative=True), Stage(commutative=True), Stage(),
+        Stage(commutative=True), Stage(commutative=True),
+        Stage(commutative=True, requires={StageByIndex(0): 0}),
+        Stage(commutative=True),
+    ]
+    p = Pipeline(*stages, reorder=True)
+    assert p._commutative_groups() == {0: 2, 3: 5}
+    p.append(Stage(commutative=True))
+    assert p._commutative_groups() == {0: 2, 3: 5, 6: 8}
+    # groups followed by record-relative requirements
+    p.append(Stage(requires={Previous: 0}))
+    assert p._commutative_groups() == {}
+    p = Pipeline(*stages, Stage(requires={First: 0}), stages[0], stages[0])
+    assert p._commutative_groups() == {8: 10}
+    p = Pipeline(*stages, Stage(requires={First: 0}), loop=True)
+    assert p._commutative_groups() == {}
+
+
+# #############################
+# ### Lazy
+
+def _lazy_pipeline():
+    return Pipeline(
+        Stage(status=lambda **kwargs: 0),
+        Fork(lambda flag, **kwargs: None if flag else 1),
+        Stage(
+            export=lambda **kwargs: {"exported": Lazy(lambda: "exported")},
+            status=lambda body, **kwargs: len(body),
+        ),
+        Stage(message=lambda exported, **kwargs: exported),
+        Stage(message=lambda **kwargs: str(kwargs["other"])),
+    )
+
+
+@pytest.mark.parametrize("compiled", [False, True])
+def test_lazy(compiled):
+    """Test class `Lazy` as kwarg of `Pipeline.run`."""
+
+    calls = []
+
+    def body():
+        calls.append("body")
+        return "body"
+
+    p = _lazy_pipeline()
+    run = p.compile() if compiled else p.run
+    output = run(
+        flag=False, body=Lazy(body), other=Lazy(lambda: "other")
+    )
+    assert calls == ["body"]
+    assert output.kwargs["body"] == "body"
+    assert output.kwargs["exported"] == "exported"
+    assert [r.message for r in output.records][-2] == "exported"
+    # only declared via **kwargs
+    assert output.records[-1].message.startswith("Lazy(")
+    assert isinstance(output.kwargs["other"], Lazy)
+
+    # not evaluated on early exit
+    calls.clear()
+    output = run(flag=True, body=Lazy(body), other=None)
+    assert calls == []
+    assert isinstance(output.kwargs["body"], Lazy)
+
+
+def test_lazy_finalize_output():
+    """Test class `Lazy` with `finalize_output`."""
+
+    def finalize_output(data, body, **kwargs):
+        data["body"] = body
+
+    output = Pipeline(finalize_output=finalize_output).run(
+        body=Lazy(lambda: "body")
+    )
+    assert output.data == {"body": "body"}
+
+
+# #############################
+# ### Pipeline.run_chunked
+
+def _chunked_pipeline(**kwargs):
+    def count(out, chunk, **kwargs):
+        out["count"] = out.get("count", 0) + len(chunk)
+    return Pipeline(
+        Stage(action=count),
+        Stage(
+            status=lambda chunk, **kwargs: int(any(i < 0 for i in chunk)),
+            message=lambda chunk, status, **kwargs:
+                f"negative item in {chunk}" if status else "",
+        ),
+        **kwargs
+    )
+
+
+def test_pipeline_run_chunked():
+    """Test method `run_chunked` of class `Pipeline`."""
+
+    consumed = []
+
+    def items():
+        for i in [1, 2, -3, 4, 5, 6, 7]:
+            consumed.append(i)
+            yield i
+
+    output = _chunked_pipeline(
+        finalize_output=lambda data, records, **kwargs:
+            data.update(records=len(records))
+    ).run_chunked(items(), chunksize=3, other=1)
+    assert len(output.chunks) == 3
+    assert output.items == 7
+    assert output.data == {"count": 7, "records": 6}
+    assert output.kwargs == {"other": 1}
+    assert output.last_statuses == [1, 0, 0]
+    assert output.status == 1
+    assert output.messages == [(0, "negative item in [1, 2, -3]")]
+    assert len(output.records) == 6
+
+    # stop early
+    consumed.clear()
+    output = _chunked_pipeline().run_chunked(
+        items(), chunksize=3, stop_on_status=1
+    )
+    assert consumed == [1, 2, -3]
+    assert output.items == 3
+    assert output.status == 1
+
+
+def test_pipeline_run_chunked_empty():
+    """Test method `run_chunked` of class `Pipeline` without items."""
+
+    output = _chunked_pipeline().run_chunked([], key="chunk")
+    assert output.chunks == []
+    assert output.status is None
+    assert output.data == {}
+
+
+# #############################
+# ### Sources
+
+def test_jsonl_source(tmp_path):
+    """Test class `JSONLSource`."""
+
+    path = tmp_path / "input.jsonl"
+    path.write_text(
+        "\n".join(f'{{"a": {i}, "b": "{i}"}}' for i in range(100)) + "\n\n",
+        encoding="utf-8"
+    )
+    records = list(JSONLSource(path, block_size=64))
+    assert records == [{"a": i, "b": str(i)} for i in range(100)]
+    assert len(list(JSONLSource(path, block_size=64).batches())) > 1
+    assert list(JSONLSource(path, columns={"a": "x"}))[1] == {"x": 1}
+
+    outputs = Pipeline(
+        Stage(status=lambda x, **kwargs: x % 2)
+    ).run_many(JSONLSource(path, columns={"a": "x"}))
+    assert [o.last_status for o in outputs] == [i % 2 for i in range(100)]
+
+
+def test_jsonl_source_single_mapping(tmp_path, monkeypatch):
+    """Test sequential `JSONLSource` mapping the file only once."""
+
+    path = tmp_path / "input.jsonl"
+    path.write_text(
+        "".join(f'{{"a": {i}}}\r\n\n' for i in range(100)),
+        encoding="utf-8"
+    )
+    mappings = []
+    mmap_ = source_module.mmap.mmap
+
+    def mapping(*args, **kwargs):
+        mappings.append(args)
+        return mmap_(*args, **kwargs)
+    monkeypatch.setattr(source_module.mmap, "mmap", mapping)
+    source = JSONLSource(path, block_size=64)
+    assert len(list(source.batches())) > 1
+    assert list(source) == [{"a": i} for i in range(100)]
+    assert len(mappings) == 2
+
+
+def test_jsonl_source_error(tmp_path):
+    """Test class `JSONLSource` for bad input."""
+
+    path = tmp_path / "input.jsonl"
+    path.write_text('{"a": 0}\n{"a": \n', encoding="utf-8")
+    with pytest.raises(ValueError):
+        list(JSONLSource(path))
+
+    # record that spans multiple lines
+    path.write_text('{"a": [1\n2]}\n', encoding="utf-8")
+    with pytest.raises(ValueError):
+        list(JSONLSource(path))
+    path.write_text('{"a": 0}\n\n{"a": [1\n2]}\n', encoding="utf-8")
+    with pytest.raises(ValueError):
+        list(JSONLSource(path))
+
+
+def test_csv_source(tmp_path):
+    """Test class `CSVSource`."""
+
+    path = tmp_path / "input.csv"
+    path.write_text(
+        "name;value\r\n"
+        + "".join(f"n{i};{i}\r\n" for i in range(50)),
+        encoding="utf-8"
+    )
+    records = list(CSVSource(path, block_size=32, delimiter=";"))
+    assert records == [{"name": f"n{i}", "value": str(i)} for i in range(50)]
+    assert list(
+        CSVSource(path, columns={"value": "v"}, delimiter=";")
+    )[0] == {"v": "0"}
+
+    # quoted values with characters that str.splitlines splits at
+    values = ["a\x0bb", "c\x0cd", "e\x1cf", "g\x85h", "i\u2028j"]
+    path.write_text(
+        "value\n" + "".join(f'"{value}"\n' for value in values),
+        encoding="utf-8"
+    )
+    assert list(CSVSource(path)) == [{"value": value} for value in values]
+
+
+def test_source_empty(tmp_path):
+    """Test sources for empty file."""
+
+    path = tmp_path / "input.csv"
+    path.write_text("", encoding="utf-8")
+    assert list(CSVSource(path)) == []
+    assert list(JSONLSource(path)) == []
+
+
+def test_source_executor(tmp_path):
+    """Test sources with `ProcessPoolExecutor`."""
+
+    path = tmp_path / "input.jsonl"
+    path.write_text(
+        "".join(f'{{"a": {i}}}\n' for i in range(1000)), encoding="utf-8"
+    )
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        records = list(JSONLSource(path, block_size=256, executor=executor))
+    assert records == [{"a": i} for i in range(1000)]
+
+
+# #############################
+# ### Sinks
+
+def _sink_outputs(n=5):
+    return Pipeline(
+        Stage(
+            action=lambda out, x, **kwargs: out.update(y=2 * x),
+            status=lambda x, **kwargs: x % 2,
+            message=lambda x, **kwargs: f"x={x}",
+        )
+    ).run_many({"x": x} for x in range(n))
+
+
+@pytest.mark.parametrize("background", [False, True])
+def test_jsonl_sink(tmp_path, background):
+    """Test class `JSONLSink`."""
+
+    path = tmp_path / "output.jsonl"
+    with JSONLSink(
+        path, fields=["index", "last_status", "records"], data=["y"],
+        kwargs=["x"], batch_size=2, background=background
+    ) as sink:
+        assert sink.write_many(_sink_outputs()) == 5
+    rows = list(JSONLSource(path))
+    assert [row["index"] for row in rows] == list(range(5))
+    assert rows[3]["last_status"] == 1
+    assert rows[3]["y"] == 6
+    assert rows[3]["x"] == 3
+    assert rows[3]["records"][0]["message"] == "x=3"
+
+
+def test_csv_sink(tmp_path):
+    """Test class `CSVSink`."""
+
+    path = tmp_path / "output.csv"
+    with CSVSink(path, data=["y"], background=True) as sink:
+        for output in _sink_outputs():
+            sink.write(output)
+    rows = list(CSVSource(path))
+    assert rows[2] == {"last_status": "0", "last_message": "x=2", "y": "4"}
+
+
+def test_sqlite_sink(tmp_path):
+    """Test class `SQLiteSink` with `Pipearray`-output."""
+
+    import sqlite3
+    path = tmp_path / "output.db"
+    array = Pipearray(
+        a=Pipeline(Stage(status=lambda x, **kwargs: x)),
+        b=Pipeline(Stage(status=lambda **kwargs: 0)),
+    )
+    with SQLiteSink(
+        path, fields=["index", "pipeline", "last_status"], batch_size=3,
+        background=True
+    ) as sink:
+        sink.write_many(array.run_many({"x": x} for x in range(4)))
+    with sqlite3.connect(path) as connection:
+        rows = connection.execute(
+            "SELECT * FROM outputs ORDER BY \"index\", pipeline"
+        ).fetchall()
+    assert len(rows) == 8
+    assert rows[2] == (1, "a", 1)
+    assert rows[3] == (1, "b", 0)
+
+
+def test_sink_errors(tmp_path):
+    """Test errors of sinks."""
+
+    with pytest.raises(ValueError):
+        JSONLSink(tmp_path / "output.jsonl", fields=["unknown"])
+
+    sink = JSONLSink(tmp_path / "missing" / "output.jsonl", background=True)
+    sink.write_many([])
+    sink.write(Pipeline().run())
+    with pytest.raises(FileNotFoundError):
+        sink.close()
+    with pytest.raises(ValueError):
+        sink.write(Pipeline().run())
+
+    # sink remains failed after an error of the writer thread
+    sink = JSONLSink(
+        tmp_path / "missing" / "output.jsonl", batch_size=1, background=True
+    )
+    sink.write(Pipeline().run())
+    sink._queue.join()
+    for _ in range(2):
+        with pytest.raises(FileNotFoundError):
+            sink.write(Pipeline().run())
+    with pytest.raises(FileNotFoundError):
+        sink.flush()
+    with pytest.raises(FileNotFoundError):
+        sink.close()
+
+    # columns have to be distinct
+    with pytest.raises(ValueError):
+        JSONLSink(tmp_path / "output.jsonl", data=["index"], fields=["index"])
+    with pytest.raises(ValueError):
+        CSVSink(tmp_path / "output.csv", data=["x"], kwargs=["x"])
+
+
+# #############################
+# ### RunHistory
+
+def test_run_history(tmp_path):
+    """Test class `RunHistory`."""
+
+    history = RunHistory(tmp_path / "history.db", interval=0.01)
+    p = Pipeline(
+        "a", "b",
+        a=Stage(status=lambda x, **kwargs: x % 2),
+        b=Stage(message=lambda x, **kwargs: "m" * 100 + str(x)),
+        history=history,
+    )
+    q = Pipeline("a", a=Stage(), history=history)
+    assert p.history is history
+    start = time()
+    for x in range(6):
+        p.run(x=x)
+    q.run()
+    sleep(0.05)  # let writer thread write
+
+    runs = history.runs(pipeline=p.id)
+    assert len(runs) == 6
+    assert [r.last_status for r in runs] == [0] * 6
+    assert runs[1].records[0] == StageRecord(0, "a", "", 1)
+    assert runs[1].records[1].message == "m" * 100 + "1"
+    assert all(r.time >= start for r in runs)
+
+    failed = history.runs(stage="a", status=1)
+    assert [r.records[0].status for r in failed] == [1, 1, 1]
+    assert len(history.runs(stage="a", status=1, limit=2)) == 2
+    assert len(history.runs(since=time() + 10)) == 0
+    assert len(history.runs(until=time() + 10)) == 7
+
+    records = history.records(stage="a", status=0)
+    assert len(records) == 4
+    assert history.records(pipeline=q.id) == [StageRecord(0, "a", "", 0)]
+    history.close()
+
+
+def test_run_history_failed_runs(tmp_path):
+    """Test class `RunHistory` with runs that cannot be written."""
+
+    history = RunHistory(tmp_path / "history.db", interval=100)
+    Pipeline(Stage(message=lambda **kwargs: None), history=history).run()
+    history.flush()
+    assert history.records()[0].message is None
+
+    # message cannot be encoded
+    bad = Pipeline(
+        Stage(message=lambda **kwargs: "\udc80" * 100), history=history
+    )
+    bad.run()
+    with pytest.raises(UnicodeEncodeError):
+        history.flush()
+    # later runs are still written, the error is kept until handled
+    good = Pipeline(Stage(status=lambda **kwargs: 1), history=history)
+    good.run()
+    with pytest.raises(UnicodeEncodeError):
+        history.flush()
+    assert [r.last_status for r in history.runs(pipeline=good.id)] == [1]
+
+    assert [run[0] for run in history.discard_failed()] == [bad.id]
+    history.flush()
+    history.close()
+
+
+def test_run_history_persistence(tmp_path):
+    """Test persistence of class `RunHistory`."""
+
+    with RunHistory(tmp_path / "history.db", interval=100) as history:
+        p = Pipeline(Stage(), history=history)
+        p.run()
+        p.compile()()
+    with RunHistory(tmp_path / "history.db") as history:
+        assert [r.id_ for r in history.runs()] == [1, 2]
+        Pipeline(Stage(), history=history).run()
+        assert [r.id_ for r in history.runs()] == [1, 2, 3]
+
+
+# #############################
+# ### Projection
+
+def _projection_pipeline():
+    return Pipeline(
+        Stage(message=lambda **kwargs: "a"),
+        Stage(
+            export=lambda **kwargs: {"large": list(range(1000))},
+            status=lambda **kwargs: 1,
+            message=lambda **kwargs: "b",
+        ),
+        Stage(message=lambda **kwargs: "c"),
+        initialize_output=lambda: {"x": 1, "y": 2},
+    )
+
+
+@pytest.mark.parametrize(
+    ("mode", "expected"),
+    [
+        ("full", [("a", 0), ("b", 1), ("c", 0)]),
+        ("last", [("c", 0)]),
+        ("status", [("", 0)]),
+        ("failures", [("b", 1)]),
+    ]
+)
+def test_projection_modes(mode, expected):
+    """Test modes of class `Projection`."""
+
+    output = _projection_pipeline().run(projection=mode, id=1)
+    assert [tuple(r) for r in output.records] == expected
+    # only mode "full" keeps kwargs and data by default
+    if mode == "full":
+        assert "large" in output.kwargs and output.data == {"x": 1, "y": 2}
+    else:
+        assert output.kwargs == {} and output.data == {}
+
+    output = _projection_pipeline().compile()(projection=mode)
+    assert [tuple(r) for r in output.records] == expected
+
+
+def test_projection_keys():
+    """Test arguments `kwargs` and `data` of class `Projection`."""
+
+    output = _projection_pipeline().run(
+        projection=Projection(kwargs=["id"], data=["y", "z"]), id=1
+    )
+    assert len(output.records) == 3
+    assert output.kwargs == {"id": 1}
+    assert output.data == {"y": 2}
+
+    output = _projection_pipeline().run(
+        projection=Projection("failures", ok=lambda status: status < 2)
+    )
+    assert output.records == []
+
+    # keeping everything in reducing modes requires explicit opt-in
+    output = _projection_pipeline().run(
+        projection=Projection("status", kwargs=None, data=None)
+    )
+    assert "large" in output.kwargs and output.data == {"x": 1, "y": 2}
+    assert len(output.records) == 1
+
+    with pytest.raises(ValueError):
+        Projection("unknown")
+
+
+def test_projection_run_many():
+    """Test argument `projection` of `run_many`."""
+
+    outputs = list(
+        _projection_pipeline().run_many(
+            [{"id": 1}, {"id": 2}], projection=Projection("last", kwargs=[])
+        )
+    )
+    assert [o.kwargs for o in outputs] == [{}, {}]
+    assert [len(o.records) for o in outputs] == [1, 1]
+
+    outputs = list(
+        Pipearray(a=_projection_pipeline()).run_many(
+            [{"id": 1}], projection="status"
+        )
+    )
+    assert outputs[0]["a"].records[0].message == ""
+
+
+# #############################
+# ### Metrics
+
+def _metrics_pipeline(metrics):
+    return Pipeline(
+        "a", "b", "f", "c",
+        a=Stage(status=lambda x, **kwargs: x % 2),
+        b=Stage(requires={"a": 0}),
+        f=Fork(lambda x, **kwargs: None if x > 1 else "c"),
+        c=Stage(),
+        metrics=metrics,
+    )
+
+
+def test_metrics_registry():
+    """Test class `MetricsRegistry`."""
+
+    metrics = MetricsRegistry()
+    p = _metrics_pipeline(metrics.pipeline("p"))
+    assert p.metrics is metrics.pipeline("p")
+    for x in range(4):
+        p.run(x=x)
+    counters, histograms = metrics.collect()
+
+    assert counters[("data_plumber_runs_total", ("p",))] == 4
+    assert counters[("data_plumber_stages_total", ("p", "a", "1"))] == 2
+    assert counters[("data_plumber_stages_total", ("p", "b", "0"))] == 2
+    assert counters[("data_plumber_stages_total", ("p", "c", "0"))] == 2
+    assert counters[("data_plumber_requirement_skips_total", ("p", "b"))] \
+        == 2
+    assert counters[("data_plumber_forks_total", ("p", "2", "3"))] == 2
+    assert counters[("data_plumber_forks_total", ("p", "2", "-1"))] == 2
+    histogram = histograms[("data_plumber_run_duration_seconds", ("p",))]
+    assert sum(histogram[:-2]) == histogram[-1] == 4
+
+    text = metrics.render()
+    assert "# TYPE data_plumber_runs_total counter" in text
+    assert 'data_plumber_runs_total{pipeline="p"} 4' in text
+    assert (
+        'data_plumber_run_duration_seconds_bucket{pipeline="p",le="+Inf"} 4'
+        in text
+    )
+    assert 'data_plumber_run_duration_seconds_count{pipeline="p"} 4' in text
+
+
+def test_metrics_compiled_and_threads():
+    """
+    Test metrics of compiled `Pipeline`s and of runs on multiple
+    threads.
+    """
+
+    generic, compiled = MetricsRegistry(), MetricsRegistry()
+    p = _metrics_pipeline(generic)
+    q = _metrics_pipeline(compiled)
+    run = q.compile()
+    with ThreadPoolExecutor(4) as executor:
+        list(executor.map(lambda x: p.run(x=x % 4), range(100)))
+        list(executor.map(lambda x: run(x=x % 4), range(100)))
+
+    def _counters(metrics, pipeline):
+        return {
+            (name, labels[1:]): value
+            for (name, labels), value in metrics.collect()[0].items()
+            if labels[0] == pipeline.id
+        }
+    assert _counters(generic, p) == _counters(compiled, q)
+    assert _counters(generic, p)[("data_plumber_runs_total", ())] == 100
+
+
+def test_metrics_short_lived_threads():
+    """Test metrics merging shards of threads that have exited."""
+
+    metrics = MetricsRegistry()
+    p = _metrics_pipeline(metrics)
+    for x in range(20):
+        thread = Thread(target=lambda x=x: p.run(x=x % 4))
+        thread.start()
+        thread.join()
+    p.run(x=0)
+
+    # only the shard of the current thread remains
+    assert len(metrics._shards) == 1
+    counters, histograms = metrics.collect()
+    assert counters[("data_plumber_runs_total", (p.id,))] == 21
+    assert histograms[
+        ("data_plumber_run_duration_seconds", (p.id,))
+    ][-1] == 21
+    p.run(x=0)
+    assert metrics.collect()[0][("data_plumber_runs_total", (p.id,))] == 22
+
+
+def test_metrics_exposition(tmp_path):
+    """Test methods `write` and `serve` of class `MetricsRegistry`."""
+
+    from urllib.request import urlopen
+
+    metrics = MetricsRegistry()
+    Pipeline(Stage(), metrics=metrics.pipeline("p")).run()
+
+    metrics.write(tmp_path / "metrics.prom")
+    assert (tmp_path / "metrics.prom").read_text() == metrics.render()
+    assert os.listdir(tmp_path) == ["metrics.prom"]
+
+    server = metrics.serve()
+    try:
+        with urlopen(
+            f"http://127.0.0.1:{server.server_address[1]}/metrics"
+        ) as response:
+            assert response.headers["Content-Type"].startswith("text/plain")
+            assert response.read().decode("utf-8") == metrics.render()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+# #############################
+# ### Hooks
+
+def _hooks_pipeline(hooks):
+    return Pipeline(
+        "a", "b", "f", "c",
+        a=Stage(status=lambda x, **kwargs: x % 2),
+        b=Stage(requires={"a": 0}),
+        f=Fork(lambda x, **kwargs: None if x > 1 else "c"),
+        c=Stage(),
+        hooks=hooks,
+    )
+
+
+def test_hooks_events():
+    """Test events of class `Hooks` for generic and compiled runs."""
+
+    events = []
+    hooks = Hooks(
+        **{
+            event: (
+                lambda event=event, **kwargs: events.append((event, kwargs))
+            )
+            for event in ("before_stage", "after_stage", "on_fork",
+                          "on_requirement_skip", "on_exit")
+        }
+    )
+    hooks.add(
+        "on_finalize",
+        lambda output, **kwargs: events.append(("on_finalize", output))
+    )
+
+    output = _hooks_pipeline(hooks).run(x=1)
+    assert [e for e, _ in events] == [
+        "before_stage", "after_stage", "on_requirement_skip", "on_fork",
+        "before_stage", "after_stage", "on_exit", "on_finalize"
+    ]
+    assert events[1][1] == {
+        "index": 0, "stage": "a", "status": 1, "message": ""
+    }
+    assert events[2][1] == {"index": 1, "stage": "b"}
+    assert events[3][1] == {"index": 2, "fork": "f", "target": 3}
+    assert events[6][1] == {"index": 4, "reason": "end"}
+    assert events[7][1] is output
+
+    for x in range(4):
+        events.clear()
+        _hooks_pipeline(hooks).run(x=x)
+        expected = [(e, k) for e, k in events if e != "on_finalize"]
+        events.clear()
+        _hooks_pipeline(hooks).compile()(x=x)
+        assert [(e, k) for e, k in events if e != "on_finalize"] == expected
+    assert events[-2] == ("on_exit", {"index": 2, "reason": "fork"})
+
+
+def test_hooks_context():
+    """Test argument `context` of `Hooks`-callbacks."""
+
+    positions = []
+    hooks = Hooks(
+        before_stage=lambda context, **kwargs:
+            positions.append((context.current_position, context.count)),
+        after_stage=lambda **kwargs: None
+    )
+    assert hooks.dispatcher("before_stage").context
+    assert not hooks.dispatcher("after_stage").context
+    assert hooks.dispatcher("on_exit") is None
+
+    _hooks_pipeline(hooks).run(x=0)
+    _hooks_pipeline(hooks).compile()(x=0)
+    assert positions == [(0, 0), (1, 1), (3, 2)] * 2
+
+    with pytest.raises(ValueError):
+        hooks.add("unknown", lambda **kwargs: None)
+
+
+def test_hooks_compiled_away():
+    """Test that empty `Hooks` do not change compiled code."""
+
+    assert generate_source(_hooks_pipeline(Hooks()))[0] \
+        == generate_source(_hooks_pipeline(None))[0]
+
+    stages = []
+    hooks = Hooks()
+    p = _hooks_pipeline(hooks)
+    run = p.compile()
+    callback = hooks.add(
+        "before_stage", lambda stage, **kwargs: stages.append(stage)
+    )
+    assert p.compile() is not run
+    p.compile()(x=0)
+    assert stages == ["a", "b", "c"]
+    hooks.remove("before_stage", callback)
+    p.compile()(x=0)
+    assert stages == ["a", "b", "c"]
+
+
+# #############################
+# ### Pipeline.explain
+
+def test_pipeline_explain():
+    """Test method `explain` of class `Pipeline`."""
+
+    p = Pipeline(
+        "a", "b", "f", "c",
+        a=Stage(
+            export=lambda **kwargs: {"large": list(range(100))},
+            status=lambda x, **kwargs: x % 2,
+        ),
+        b=Stage(requires={"a": 0}),
+        f=Fork(lambda x, **kwargs: None if x > 1 else "c"),
+        c=Stage(action=lambda out, **kwargs: out.update({"c": [0] * 100})),
+        hooks=Hooks(before_stage=lambda **kwargs: pytest.fail()),
+    )
+    explanation = p.explain(x=1)
+
+    assert [(s.index, s.kind) for s in explanation.steps] == [
+        (0, "stage"), (1, "skip"), (2, "fork"), (3, "stage"), (4, "exit")
+    ]
+    a, b, f, c, exit_ = explanation.steps
+    assert a.status == 1
+    assert set(a.callables) == {"export", "status"}
+    assert a.exported > c.exported == 0
+    assert c.out > a.out
+    assert b.reasons == ["'a' has status 1 (requires 0)"]
+    assert f.target == 3 and set(f.callables) == {"fork"}
+    assert exit_.reasons == ["end"]
+    assert explanation.output.data["c"] == [0] * 100
+
+    report = str(explanation)
+    assert report.startswith("EXPLAIN ANALYZE (5 steps")
+    assert "[1] b  skipped" in report
+    data = explanation.as_dict()
+    assert data["steps"][0]["callables"]["status"]["blocks"] is not None
+    assert data["steps"][2]["target"] == 3
+
+    assert [s.kind for s in p.explain(x=2).steps][-2:] == ["fork", "exit"]
+    assert p.explain(x=2).steps[-1].reasons == ["fork"]
+
+
+# #############################
+# ### MemoryProfile
+
+def test_memory_profile():
+    """Test class `MemoryProfile`."""
+
+    leak = []
+    memory = MemoryProfile(window=20)
+    p = Pipeline(
+        "a", "b", "c",
+        a=Stage(action=lambda out, **kwargs: out.update({"a": [0] * 1000})),
+        b=Stage(action=lambda **kwargs: leak.append(bytearray(1000))),
+        c=Stage(),
+        memory=memory,
+    )
+    assert p.memory is memory
+    try:
+        for _ in range(30):
+            p.run()
+        for _ in range(30):
+            p.compile()()
+        stages = memory.stages
+        assert stages["a"].runs == 60
+        assert stages["a"].mean >= 8000
+        assert stages["a"].peak >= 8000
+        assert stages["b"].mean >= 1000
+        assert len(stages["a"].history) == 20
+        assert stages["c"].history == [0] * 20
+        assert sorted(memory.growing()) == ["a", "b"]
+        assert "(growing)" in memory.report()
+
+        # without leak
+        memory.reset()
+        leak.clear()
+        p = Pipeline("a", "c", a=p["a"], c=p["c"], memory=memory)
+        for _ in range(30):
+            p.run()
+        assert memory.growing() == []
+    finally:
+        tracemalloc.stop()
+
+
+def test_memory_profile_chunked():
+    """Test class `MemoryProfile` with `Pipeline.run_chunked`."""
+
+    memory = MemoryProfile()
+    p = Pipeline(
+        Stage(
+            action=lambda out, chunk, **kwargs:
+                out.setdefault("items", []).extend(chunk)
+        ),
+        memory=memory,
+    )
+    try:
+        p.run_chunked(range(1000), chunksize=10)
+    finally:
+        tracemalloc.stop()
+    assert memory.growing() == [p.stages[0]]
+
+
+# #############################
+# ### Capture
+
+
+def test_capture_replay(tmp_path):
+    """Test capturing runs and replaying them against a Pipeline."""
+    def pipeline(threshold, capture=None):
+        return Pipeline(
+            Stage(
+                status=lambda value, **kwargs: int(value > threshold),
+                message=lambda value, **kwargs: f"value {value}"
+            ),
+            capture=capture
+        )
+    capture = Capture(tmp_path / "capture.jsonl.gz")
+    p = pipeline(5, capture)
+    for value in range(10):
+        p.run(value=value)
+    capture.close()
+    assert capture.count == 10
+    captured = list(load_capture(capture.path))
+    assert captured[7].kwargs == {"value": 7}
+    assert captured[7].outputs == [[0, p.stages[0], "value 7", 1]]
+
+    report = replay(pipeline(5), tmp_path / "capture.jsonl.gz")
+    assert report.ok
+    assert report.runs == len(report.latencies) == 10
+    assert report.percentile(50) <= report.percentile(99)
+    assert report.as_dict()["mismatches"] == 0
+    report = replay(
+        pipeline(7).compile(), tmp_path / "capture.jsonl.gz",
+        concurrency=4
+    )
+    assert [m[0] for m in report.mismatches] == [6, 7]
+    assert report.mismatches[0][1:] == (
+        [(1, "value 6")], [(0, "value 6")]
+    )
+    assert "2 mismatches" in str(report)
+
+
+def test_capture_sampling_redaction(tmp_path):
+    """Test sampling rate and redaction of `Capture`."""
+    with pytest.raises(ValueError):
+        Capture(tmp_path / "capture.jsonl.gz", rate=2)
+    with Capture(
+        tmp_path / "capture.jsonl.gz", rate=0.25, redact=["token"],
+        seed=0
+    ) as capture:
+        p = Pipeline(Stage(), capture=capture)
+        for value in range(400):
+            p.run(value=value, token="secret")
+    assert 50 < capture.count < 150
+    captured = list(load_capture(tmp_path / "capture.jsonl.gz"))
+    assert len(captured) == capture.count
+    assert all(c.kwargs["token"] == "<redacted>" for c in captured)
+
+    with Capture(
+        tmp_path / "custom.jsonl.gz",
+        redact=lambda kwargs: {"value": len(kwargs["value"])}
+    ) as capture:
+        Pipeline(Stage(), capture=capture).run(value="abc")
+    assert next(load_capture(capture.path)).kwargs == {"value": 3}
+
+
+def test_capture_pipearray(tmp_path):
+    """Test capturing and replaying `Pipearray.run`s."""
+    with Capture(tmp_path / "capture.jsonl.gz") as capture:
+        array = Pipearray(
+            p=Pipeline(Stage(status=lambda **kwargs: 1)),
+            q=Pipeline(Stage(status=lambda **kwargs: 2)),
+            capture=capture
+        )
+        array.run(value=1)
+        array.run(value=2)
+    captured = list(load_capture(capture.path))
+    assert [c.kwargs for c in captured] == [{"value": 1}, {"value": 2}]
+    assert set(captured[0].outputs) == {"p", "q"}
+    assert replay(array, capture.path, concurrency=2).ok
+
+    # anonymous Pipearray whose first Pipeline generates no records
+    with Capture(tmp_path / "anonymous.jsonl.gz") as capture:
+        array = Pipearray(
+            Pipeline(), Pipeline(Stage(message=lambda **kwargs: "b")),
+            capture=capture
+        )
+        array.run()
+    captured = list(load_capture(capture.path))
+    assert captured[0].kind == "pipearray"
+    assert captured[0].outputs[0] == []
+    assert replay(array, capture.path).ok
+    report = replay(
+        Pipearray(Pipeline(), Pipeline(Stage(status=lambda **kwargs: 1))),
+        capture.path
+    )
+    assert len(report.mismatches) == 1
+
+
+# #############################
+# ### bench
+
+
+def test_bench_benchmark():
+    """Test `benchmark` in modes "thread" and "async"."""
+    def action(value, **kwargs):
+        if value < 0:
+            raise ValueError("negative")
+    p = Pipeline(Stage(action=action))
+    inputs = [{"value": 1}, {"value": 2}, {"value": -1}]
+    for mode in ("thread", "async"):
+        for concurrency in (1, 3):
+            result = benchmark(p, inputs, mode, concurrency, runs=30)
+            assert result.runs == len(result.latencies) == 30
+            assert result.errors == 10
+            assert result.throughput > 0
+            assert result.as_dict()["p99"] >= result.as_dict()["p50"]
+    with pytest.raises(ValueError):
+        benchmark(p, inputs, "process")
+    with pytest.raises(ValueError):
+        benchmark(p, inputs, "fiber")
+    with pytest.raises(ValueError):
+        benchmark(p, [])
+
+
+def test_bench_main(tmp_path, monkeypatch, capsys):
+    """Test command line interface of `data_plumber.bench`."""
+    (tmp_path / "bench_target.py").write_text(
+        "from data_plumber import Pipeline, Stage\n"
+        + "pipeline = Pipeline(Stage(status=lambda x, **kwargs: x))\n"
+        + "def inputs():\n"
+        + "    return [{'x': i} for i in range(5)]\n",
+        encoding="utf-8"
+    )
+    monkeypatch.syspath_prepend(str(tmp_path))
+    assert bench_main([
+        "bench_target:pipeline", "--generator", "bench_target:inputs",
+        "--runs", "20", "--mode", "thread", "process", "--concurrency",
+        "1", "2", "--json", str(tmp_path / "bench.json")
+    ]) == 0
+    assert len(capsys.readouterr().out.splitlines()) == 5
+    report = json.loads((tmp_path / "bench.json").read_text())
+    assert report["inputs"] == 5
+    assert [(r["mode"], r["concurrency"]) for r in report["results"]] \
+        == [("thread", 1), ("thread", 2), ("process", 1), ("process", 2)]
+    assert all(r["runs"] == 20 for r in report["results"])
+
+    with Capture(tmp_path / "capture.jsonl.gz") as capture:
+        Pipeline(Stage(), capture=capture).run(x=1)
+    assert bench_main([
+        "bench_target:pipeline", "--input", str(capture.path), "--runs",
+        "10", "--compiled", "--json", "-"
+    ]) == 0
+    report = json.loads(capsys.readouterr().out)
+    assert report["results"][0]["runs"] == 10
+    assert report["results"][0]["errors"] == 0
+
+
+# #############################
+# ### FrozenPipeline
+
+
+def test_frozen_pipeline():
+    """Test `Pipeline.freeze`."""
+    hooks = Hooks()
+    p = Pipeline(
+        "a", "f", "b",
+        a=Stage(status=lambda value, **kwargs: value),
+        f=Fork(lambda **kwargs: Next()),
+        b=Stage(message=lambda value, **kwargs: f"b{value}"),
+        exit_on_status=2, hooks=hooks
+    )
+    frozen = p.freeze()
+    assert frozen.stages == ["a", "f", "b"]
+    assert frozen.catalog == p.catalog
+    assert frozen.id == p.id
+    p.append("c", c=Stage())
+    assert len(p) == 4 and len(frozen) == 3
+    assert "c" not in frozen
+    for operation in (
+        lambda: frozen.append(Stage()), lambda: frozen.prepend(Stage()),
+        lambda: frozen.insert(0, Stage()), lambda: frozen + Stage()
+    ):
+        with pytest.raises(PipelineError):
+            operation()
+
+    for value in range(3):
+        assert frozen.run(value=value).records == [
+            r for r in p.run(value=value).records if r.id_ != "c"
+        ]
+    # hooks registered after freezing are respected
+    events = []
+    hooks.add("after_stage", lambda stage, **kwargs: events.append(stage))
+    frozen.run(value=0)
+    assert events == ["a", "b"]
+    assert frozen.explain(value=0).output.last_status == 0
+
+
+def test_frozen_pipeline_state():
+    """Test `Pipeline.freeze` copying mutable state."""
+    resource = Resource(lambda: 1)
+    p = Pipeline(
+        Stage(commutative=True), Stage(commutative=True),
+        resources={"db": resource}, reorder=True
+    ).specialize(x=1)
+    p.run()
+    frozen = p.freeze()
+    assert frozen._resources == p._resources
+    assert frozen._resources is not p._resources
+    assert frozen._constants == {"x": 1}
+    assert frozen._constants is not p._constants
+    assert frozen._scheduler.stats == p._scheduler.stats
+    frozen.run()
+    assert frozen._scheduler.stats != p._scheduler.stats
+
+
+def test_frozen_pipeline_threads():
+    """Test concurrent runs of `FrozenPipeline` while original changes."""
+    p = Pipeline(
+        Stage(
+            status=lambda value, **kwargs: value % 3,
+            message=lambda value, **kwargs: str(value)
+        ),
+        Stage(export=lambda value, **kwargs: {"double": 2 * value}),
+        Stage(message=lambda double, **kwargs: str(double)),
+    )
+    frozen = p.freeze()
+
+    def run(value):
+        output = frozen.run(value=value)
+        return [r.message for r in output.records], output.last_status
+
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        futures = [executor.submit(run, value) for value in range(2000)]
+        for _ in range(100):
+            p.append(Stage(status=lambda **kwargs: 9))
+        results = [future.result() for future in futures]
+    assert results == [
+        ([str(value), "", str(2 * value)], 0) for value in range(2000)
+    ]
+
+
+def test_frozen_pipeline_processes():
+    """Test `FrozenPipeline` in `ProcessPoolExecutor`."""
+    frozen = Pipeline(Stage(), Stage()).freeze()
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        assert [
+            len(o.records)
+            for o in frozen.run_many([{}] * 10, executor, chunksize=2)
+        ] == [2] * 10
+
+
+# #############################
+# ### PipelineHandle
+
+
+def test_pipeline_handle():
+    """Test publishing and updating versions with `PipelineHandle`."""
+    warmups = []
+    resource = Resource(lambda: object())
+    handle = PipelineHandle(
+        Pipeline(
+            Stage(action=lambda value, **kwargs: warmups.append(value)),
+            resources={"connection": resource}
+        ),
+        warmup=[{"value": "warmup"}]
+    )
+    assert handle.version == 1
+    assert warmups == ["warmup"]
+    assert len(handle.run(value=1).records) == 1
+
+    original = handle.current
+    assert handle.update(
+        lambda p: p.append(Stage(message=lambda **kwargs: "new"))
+    ) == 2
+    assert len(original) == 1
+    assert handle.current.resources["connection"] is resource
+    assert handle.current.id == original.id
+    assert handle.run(value=2).records[-1].message == "new"
+    assert warmups == ["warmup", 1, "warmup", 2]
+
+    future = handle.publish(
+        Pipeline(Stage(), Stage(), Stage()), warmup=[], background=True
+    )
+    assert future.result(timeout=5) == 3
+    assert len(handle.run().records) == 3
+    assert len(list(handle.run_many([{}] * 3))) == 3
+
+    future = handle.update(lambda p: p.missing(), background=True)
+    with pytest.raises(AttributeError):
+        future.result(timeout=5)
+    assert handle.version == 3
+
+
+def test_pipeline_handle_in_flight():
+    """Test that runs in flight finish on the previous version."""
+    started, release = Event(), Event()
+
+    def block(**kwargs):
+        started.set()
+        release.wait(5)
+    handle = PipelineHandle(
+        Pipeline(Stage(action=block), Stage(message=lambda **kwargs: "v1"))
+    )
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        future = executor.submit(handle.run)
+        assert started.wait(5)
+        handle.publish(
+            Pipeline(Stage(), Stage(message=lambda **kwargs: "v2"))
+        )
+        assert handle.run().records[-1].message == "v2"
+        release.set()
+        assert future.result().records[-1].message == "v1"
+
+
+# #############################
+# ### PipelineRegistry
+
+
+def test_pipeline_registry():
+    """Test lazy compilation, LRU-eviction, and usage of registry."""
+    built = []
+
+    def factory(key):
+        def build():
+            built.append(key)
+            return Pipeline(Stage(message=lambda **kwargs: key))
+        return build
+    with pytest.raises(ValueError):
+        PipelineRegistry(capacity=0)
+    registry = PipelineRegistry(capacity=2)
+    for key in ("a", "b", "c"):
+        registry.register(key, factory(key))
+    assert len(registry) == 3 and "a" in registry
+    assert built == [] and registry.cached == []
+
+    assert registry.run("a").records[0].message == "a"
+    assert registry.get("a") is registry.get("a")
+    registry.run("b")
+    registry.run("a")
+    registry.run("c")  # evicts "b" (least recently used)
+    assert registry.cached == ["a", "c"]
+    assert built == ["a", "b", "c"]
+    registry.run("b")
+    assert built == ["a", "b", "c", "b"]
+
+    usage = registry.usage()
+    assert (usage["a"].hits, usage["a"].misses) == (3, 1)
+    assert (usage["b"].misses, usage["b"].evictions) == (2, 1)
+    assert usage["a"].evictions == 1 and usage["a"].size is None
+    assert usage["b"].size > 0 and usage["b"].lookups == 2
+    assert registry.size == usage["b"].size + usage["c"].size
+
+    # replacing a definition discards compiled Pipeline
+    registry.register("c", Pipeline(Stage(message=lambda **kwargs: "new")))
+    assert registry.cached == ["b"]
+    assert registry.run("c").records[0].message == "new"
+    registry.unregister("c")
+    with pytest.raises(KeyError):
+        registry.get("c")
+    registry.clear()
+    assert registry.cached == [] and registry.size == 0
+    assert registry.usage()["b"].evictions == 2
+
+
+def test_pipeline_registry_release():
+    """
+    Test `PipelineRegistry` closing `Resource`s and dropping generated
+    source of evicted and replaced `Pipeline`s.
+    """
+    import linecache
+
+    closed = []
+
+    def build():
+        return Pipeline(
+            Stage(status=lambda db, **kwargs: db),
+            resources={"db": Resource(lambda: 0, close=closed.append)}
+        )
+    registry = PipelineRegistry(capacity=1)
+    definition = build()
+    registry.register("a", definition)
+    registry.register("b", build)
+    frozen = registry.get("a")
+    frozen.run()
+    # other compiled copies of the same Pipeline keep their source
+    other = definition.freeze()
+    filenames = [
+        f._engine[1].__code__.co_filename for f in (frozen, other)
+    ]
+    assert filenames[0] != filenames[1]
+    assert all(filename in linecache.cache for filename in filenames)
+
+    registry.run("b")  # evicts "a"
+    assert closed == [0]
+    assert filenames[0] not in linecache.cache
+    assert filenames[1] in linecache.cache
+    registry.register("b", build)  # replaces "b"
+    assert closed == [0, 0]
+
+
+def test_pipeline_registry_max_bytes():
+    """Test memory-based eviction of `PipelineRegistry`."""
+    registry = PipelineRegistry(capacity=100)
+    for key in range(10):
+        registry.register(key, Pipeline(Stage(), Stage(), Stage()))
+    registry.get(0)
+    size = registry.size
+    registry = PipelineRegistry(capacity=100, max_bytes=int(3.5 * size))
+    for key in range(10):
+        registry.register(key, Pipeline(Stage(), Stage(), Stage()))
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        assert all(
+            len(o.records) == 3
+            for o in executor.map(lambda key: registry.run(key), range(10))
+        )
+    assert len(registry.cached) == 3
+    assert registry.size <= 3.5 * size
+    assert sum(u.evictions for u in registry.usage().values()) == 7
+
+
+
+# #############################
+# ### Pipeline.specialize
+
+def _specialize_pipeline(calls, **settings):
+    def config(tenant, **kwargs):
+        calls.append(tenant)
+        return {"limit": len(tenant)}
+    return Pipeline(
+        "config", "strict", "fork", "check", "payload", "guarded",
+        config=Stage(
+            export=config,
+            message=lambda tenant, **kwargs: tenant,
+            depends=["tenant"]
+        ),
+        strict=Stage(
+            status=lambda strict, **kwargs: int(strict), depends=["strict"]
+        ),
+        fork=Fork(lambda strict, **kwargs: Next(), depends=["strict"]),
+        check=Stage(
+            status=lambda limit, **kwargs: int(limit < 2), depends=["limit"]
+        ),
+        payload=Stage(
+            status=lambda body, limit, **kwargs: int(len(body) > limit),
+            message=lambda body, **kwargs: body
+        ),
+        guarded=Stage(
+            requires={"strict": 1}, message=lambda **kwargs: "strict"
+        ),
+        **settings
+    )
+
+
+def test_pipeline_specialize():
+    """Test `Pipeline.specialize` against unspecialized runs."""
+    calls = []
+    p = _specialize_pipeline(calls)
+    sp = p.specialize(tenant="acme", strict=True)
+    assert calls == ["acme"]
+    assert sp._prefix.index == 4 and sp._prefix.count == 3
+    assert sp._prefix.exported == {"limit": 4}
+    assert "tenant" in sp._reserved_words and p._constants == {}
+
+    for body in ["ab", "abcdefg"]:
+        expected = p.run(tenant="acme", strict=True, body=body)
+        for output in (
+            sp.run(body=body),
+            sp.compile()(body=body),
+            sp.freeze().run(body=body),
+        ):
+            assert output.records == expected.records
+            assert output.kwargs == expected.kwargs
+    assert calls == ["acme", "acme", "acme"]
+
+    # requirements on constant statuses are folded into generated code
+    assert "'strict'" not in generate_source(sp, {})[0]
+
+    # constants cannot be overridden
+    with pytest.raises(PipelineError):
+        sp.run(tenant="other", body="")
+
+    # runs that are shorter than the prefix are not affected
+    with pytest.raises(BudgetExceededError) as exc_info:
+        sp.run(body="ab", max_stages=2)
+    assert len(exc_info.value.output.records) == 2
+    with pytest.raises(BudgetExceededError) as exc_info:
+        sp.compile()(body="ab", max_stages=2)
+    assert len(exc_info.value.output.records) == 2
+
+
+def test_pipeline_specialize_exit_and_changes():
+    """Test `Pipeline.specialize` with exit in the prefix and changes."""
+    p = Pipeline(
+        Stage(status=lambda tenant, **kwargs: 1, depends=["tenant"]),
+        Stage(message=lambda body, **kwargs: body),
+        exit_on_status=1
+    )
+    sp = p.specialize(tenant="acme")
+    assert sp._prefix.reason == "status"
+    assert sp.run(body="b").records \
+        == sp.compile()(body="b").records \
+        == p.run(tenant="acme", body="b").records
+    assert len(sp.run(body="b").records) == 1
+
+    # specializing twice accumulates constants
+    p = _specialize_pipeline([])
+    sp = p.specialize(tenant="acme").specialize(strict=False)
+    assert sp._constants == {"tenant": "acme", "strict": False}
+    assert sp.run(body="ab").records \
+        == p.run(tenant="acme", strict=False, body="ab").records
+
+    # changes discard the prefix but keep folded Stages
+    sp.append(Stage(message=lambda tenant, **kwargs: tenant))
+    assert sp._prefix is None
+    assert sp.run(body="ab").last_message == "acme"
+    assert sp.freeze().specialize()._prefix is not None
+
+
+def test_pipeline_specialize_ids(tmp_path):
+    """
+    Test `Pipeline.specialize` using the new id for metrics and history
+    and releasing generated source.
+    """
+    import gc
+    import linecache
+
+    metrics = MetricsRegistry()
+    with RunHistory(tmp_path / "history.db") as history:
+        p = _specialize_pipeline([], metrics=metrics, history=history)
+        sp = p.specialize(tenant="acme", strict=True)
+        sp.run(body="ab")
+        assert [r.pipeline for r in history.runs()] == [sp.id]
+    assert ("data_plumber_runs_total", (sp.id,)) in metrics.collect()[0]
+    assert ("data_plumber_runs_total", (p.id,)) not in metrics.collect()[0]
+    # explicitly labeled metrics are kept
+    labeled = metrics.pipeline("labeled")
+    assert _specialize_pipeline([], metrics=labeled).specialize(
+        tenant="acme"
+    )._metrics is labeled
+
+    sp.compile()
+    filenames = [f for f in linecache.cache if sp.id in str(f)]
+    assert len(filenames) == 1
+    del sp
+    gc.collect()
+    assert filenames[0] not in linecache.cache
+
+
+def test_pipeline_specialize_capture(tmp_path):
+    """Test capturing and replaying runs of a specialized `Pipeline`."""
+
+    with Capture(tmp_path / "capture.jsonl.gz") as capture:
+        sp = _specialize_pipeline([], capture=capture).specialize(
+            tenant="acme", strict=True
+        )
+        sp.run(body="ab")
+        sp.compile()(body="abcdefg")
+    captured = list(load_capture(capture.path))
+    assert [c.kwargs for c in captured] \
+        == [{"body": "ab"}, {"body": "abcdefg"}]
+    assert replay(sp, capture.path).ok
+    assert replay(sp.freeze(), capture.path).ok